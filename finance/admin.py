@@ -1,6 +1,9 @@
 from datetime import datetime
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.conf.urls import url
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from import_export import resources
@@ -9,10 +12,17 @@ from import_export import fields
 
 from djangoql.admin import DjangoQLSearchMixin
 
-from .models import Payment
+from opencabs.routers import ReportingExportMixin
+from utils.export import PrefetchingResourceMixin
+from utils.paginator import KeysetPaginator
 
+from .forms import StatementUploadForm
+from .models import Payment, GatewayCallback, ACCOUNTS_FIELDS
+from .reconciliation import (read_statement, match_statement, apply_matches,
+                             StatementError)
 
-class PaymentResource(resources.ModelResource):
+
+class PaymentResource(PrefetchingResourceMixin, resources.ModelResource):
     booking_id = fields.Field()
     customer_name = fields.Field()
     travel_datetime = fields.Field()
@@ -27,14 +37,17 @@ class PaymentResource(resources.ModelResource):
                   'accounts_last_updated']
         export_order = fields
 
+    export_select_related = ('created_by', 'accounts_last_updated_by')
+    export_prefetch_related = ('item_object',)
+
     def dehydrate_booking_id(self, payment):
-        return payment.bookings.first().booking_id
+        return payment.item_object.booking_id
 
     def dehydrate_customer_name(self, payment):
-        return payment.bookings.first().customer_name
+        return payment.item_object.customer_name
 
     def dehydrate_travel_datetime(self, payment):
-        booking = payment.bookings.first()
+        booking = payment.item_object
         return datetime.combine(booking.travel_date, booking.travel_time)
 
     def dehydrate_amount(self, payment):
@@ -43,14 +56,20 @@ class PaymentResource(resources.ModelResource):
 
 
 @admin.register(Payment)
-class PaymentAdmin(ExportMixin, DjangoQLSearchMixin, admin.ModelAdmin):
+class PaymentAdmin(ReportingExportMixin, ExportMixin, DjangoQLSearchMixin,
+                   admin.ModelAdmin):
     list_filter = ('type', 'accounts_verified', 'created_by', 'created', 'mode',
                    'accounts_last_updated_by', 'accounts_last_updated')
     search_fields = ('bookings__booking_id',
                      'bookings__customer_name', 'bookings__travel_date')
 
     resource_class = PaymentResource
+    ordering = ('-created', '-id')
+    paginator = KeysetPaginator
+    show_full_result_count = False
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('item_object')
 
     def booking(self, obj):
         return mark_safe(
@@ -72,7 +91,46 @@ class PaymentAdmin(ExportMixin, DjangoQLSearchMixin, admin.ModelAdmin):
             obj.accounts_last_updated_by = request.user
             obj.accounts_last_updated = timezone.now()
 
-        super().save_model(request, obj, form, change)
+        if change and form.changed_data and \
+                set(form.changed_data) <= ACCOUNTS_FIELDS:
+            obj.save(update_fields=set(form.changed_data) | {
+                'last_updated', 'last_updated_by',
+                'accounts_last_updated', 'accounts_last_updated_by'})
+        else:
+            super().save_model(request, obj, form, change)
+
+    def get_urls(self):
+        return [
+            url(r'^reconcile/$',
+                self.admin_site.admin_view(self.reconcile_view),
+                name='finance_payment_reconcile'),
+        ] + super().get_urls()
+
+    def reconcile_view(self, request):
+        if not request.user.has_perm('finance.verify_payment'):
+            raise PermissionDenied
+        matches = unmatched = None
+        form = StatementUploadForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            try:
+                rows = read_statement(form.cleaned_data['statement'])
+            except StatementError as e:
+                form.add_error('statement', str(e))
+            else:
+                matches, unmatched = match_statement(rows)
+                if not form.cleaned_data['dry_run']:
+                    count = apply_matches(matches, request.user)
+                    messages.success(
+                        request, '{} payments verified.'.format(count))
+        return TemplateResponse(
+            request, 'admin/finance/payment/reconcile.html', {
+                **self.admin_site.each_context(request),
+                'opts': self.model._meta,
+                'title': 'Reconcile bank statement',
+                'form': form,
+                'matches': matches,
+                'unmatched': unmatched,
+            })
 
     def get_readonly_fields(self, request, obj=None):
         fields = ['created_by', 'last_updated_by', 'created', 'last_updated',
@@ -90,3 +148,23 @@ class PaymentAdmin(ExportMixin, DjangoQLSearchMixin, admin.ModelAdmin):
         return fields
 
     booking.allow_tags = True
+
+
+@admin.register(GatewayCallback)
+class GatewayCallbackAdmin(admin.ModelAdmin):
+    list_display = ('id', 'provider', 'order_id', 'received', 'processed',
+                    'attempts', 'next_attempt_at', 'error')
+    list_filter = ('provider',)
+    search_fields = ('order_id',)
+    ordering = ('-id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = dict(extra_context or {},
+                             inbox=GatewayCallback.objects.stats())
+        return super().changelist_view(request, extra_context)
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.translation import ugettext_lazy as _
+
+
+class FinanceConfig(AppConfig):
+    name = 'finance'
+    verbose_name = _('finance')
+
+    def ready(self):
+        from .utils import load_providers
+        load_providers()
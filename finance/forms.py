@@ -0,0 +1,10 @@
+from django import forms
+
+
+class StatementUploadForm(forms.Form):
+    statement = forms.FileField(
+        help_text='CSV with an amount column and an invoice id and/or '
+                  'reference id column.')
+    dry_run = forms.BooleanField(
+        required=False, initial=True,
+        help_text='Only show the matches, do not verify payments.')
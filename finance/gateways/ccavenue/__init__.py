@@ -1,15 +1,41 @@
 import json
 
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404, Http404, render, redirect
 from django.urls import reverse
 from django.utils import timezone
 
-from finance.models import Payment
+from finance.models import GatewayCallback, Payment
+from utils.metrics import CALLBACK_SECONDS, OUTBOUND_SECONDS, timed
 
-from .utils import encrypt, decrypt
+from .utils import encrypt, decrypt, get_key
+
+
+# Gateway order_status -> (payment status, booking transition)
+ORDER_STATUSES = {
+    'Success': ('SUC', 'confirm'),
+    'Aborted': ('ABT', 'request'),
+    'Failure': ('FAL', 'request'),
+}
+
+# Order status API order_status -> callback order_status
+API_ORDER_STATUSES = {
+    'Successful': 'Success',
+    'Shipped': 'Success',
+    'Success': 'Success',
+    'Aborted': 'Aborted',
+    'Unsuccessful': 'Failure',
+    'Failure': 'Failure',
+    'Invalid': 'Failure',
+    'Timeout': 'Failure',
+    'Auto-Cancelled': 'Failure',
+}
 
 
 class CCAvenue(object):
+    # Key in PAYMENT_PROVIDERS, set by load_providers.
+    name = None
 
     def __init__(self, config):
         self._project_name = config['PROJECT_NAME']
@@ -21,6 +47,8 @@ class CCAvenue(object):
         self._cancel_url = config['CANCEL_URL']
         self._billing_details = config['BILLING_DETAILS']
         self._language = config['LANGUAGE']
+        self._status_api_url = config.get('STATUS_API_URL')
+        get_key(self._working_key)
 
     def handle_start(self, request):
         invoice_id = request.GET.get('order_id')
@@ -70,7 +98,7 @@ class CCAvenue(object):
 
         encrypted_merchant_data = encrypt(merchant_data, self._working_key)
         payment.status = 'STR'
-        payment.save()
+        payment.save(update_item=False)
 
         return render(request, 'finance/ccavenue/start.html', context={
             'project_name': self._project_name,
@@ -81,31 +109,129 @@ class CCAvenue(object):
         })
 
     def _handle_callback(self, request):
-        enc_resp = request.POST['encResp']
-        resp = decrypt(enc_resp, self._working_key)
-        data = dict([i.split('=') for i in resp.split('&')])
-        payment = get_object_or_404(Payment, invoice_id=data['order_id'])
-        payment.details = json.dumps(data)
-        payment.save()
-        booking = payment.bookings.all()[0]
-        payment.timestamp = timezone.now()
-        if data['order_status'] == 'Success':
-            payment.status = 'SUC'
-            payment.comment = u"tracking_id={}, bank_ref_no={}".format(
-                data['tracking_id'], data['bank_ref_no'])
-            payment.save()
-            booking.confirm()
-        elif data['order_status'] == 'Aborted':
-            payment.status = 'ABT'
-            payment.save()
-            booking.request()
-        elif data['order_status'] == 'Failure':
-            payment.status = 'FAL'
-            payment.save()
-            booking.request()
+        data = self.parse_response(request.POST['encResp'])
+        payment, booking = self.process_callback(data)
         return redirect(reverse('booking_details') + '?bookingid=' + booking.booking_id + \
                         '&orderid=' + payment.invoice_id)
 
+    def queue_callback(self, request, provider):
+        """Store the callback in the inbox and send the customer on.
+
+        Callbacks for unknown orders, or for payments made with another
+        provider, are answered with a 404 and not stored.
+        """
+        enc_resp = request.POST['encResp']
+        order_id = self.parse_response(enc_resp)['order_id']
+        payment = Payment.objects.filter(invoice_id=order_id).values_list(
+            'provider', 'bookings__booking_id').first()
+        if payment is None or payment[1] is None or \
+                (payment[0] or settings.PAYMENT_PROVIDER) != provider:
+            raise Http404
+        booking_id = payment[1]
+        GatewayCallback.objects.create(
+            provider=provider, order_id=order_id, payload=enc_resp)
+        return redirect(reverse('booking_details') + '?bookingid=' + booking_id + \
+                        '&orderid=' + order_id)
+
+    def process_queued_callback(self, callback):
+        return self.process_callback(self.parse_response(callback.payload))
+
+    def parse_response(self, enc_resp):
+        resp = decrypt(enc_resp, self._working_key)
+        return dict([i.split('=', 1) for i in resp.split('&') if i])
+
+    @timed(CALLBACK_SECONDS)
+    def process_callback(self, data):
+        """Apply a decrypted gateway response to its payment and booking.
+
+        Runs in a single transaction with the payment row locked, so
+        concurrent or repeated callbacks for the same order are applied
+        once. Customer notifications are sent after commit. Payments made
+        with another provider raise ``Http404``.
+        """
+        with transaction.atomic():
+            payment = get_object_or_404(
+                Payment.objects.select_for_update(),
+                invoice_id=data['order_id'])
+            if (payment.provider or settings.PAYMENT_PROVIDER) != self.name:
+                raise Http404('Payment {} was not made with {}.'.format(
+                    payment.invoice_id, self.name))
+            booking = payment.bookings.select_for_update().get()
+            if self._is_duplicate(payment, data):
+                return payment, booking
+
+            status, transition = ORDER_STATUSES.get(
+                data.get('order_status'), (None, None))
+            payment.details = json.dumps(data)
+            payment.timestamp = timezone.now()
+            if status:
+                payment.status = status
+                payment.reference_id = data.get('tracking_id') or \
+                    payment.reference_id
+            if status == 'SUC':
+                payment.comment = u"tracking_id={}, bank_ref_no={}".format(
+                    data['tracking_id'], data['bank_ref_no'])
+            payment.save(update_item=False)
+
+            if transition:
+                getattr(booking, transition)()
+        return payment, booking
+
+    def _is_duplicate(self, payment, data):
+        """A callback is a repeat if the order already succeeded or is
+        already in the reported state, or if its tracking id was applied
+        to another order."""
+        status = ORDER_STATUSES.get(data.get('order_status'), (None, None))[0]
+        if payment.status == 'SUC' or (status and payment.status == status):
+            return True
+        tracking_id = data.get('tracking_id')
+        return bool(tracking_id) and Payment.objects.filter(
+            reference_id=tracking_id, mode='PG').exclude(
+                pk=payment.pk).exists()
+
+    @property
+    def has_order_status(self):
+        """Whether ``STATUS_API_URL`` is configured, for
+        ``fetch_order_status``."""
+        return bool(self._status_api_url)
+
+    @timed(OUTBOUND_SECONDS, 'gateway')
+    def fetch_order_status(self, invoice_id, timeout=10):
+        """Ask the gateway for the state of an order.
+
+        Returns the order as callback data for ``process_callback``, or
+        ``None`` if the gateway has no final state for it yet.
+        """
+        if not self._status_api_url:
+            return None
+        import requests
+        resp = requests.post(self._status_api_url, data={
+            'enc_request': encrypt(json.dumps({'order_no': invoice_id}),
+                                   self._working_key),
+            'access_code': self._access_code,
+            'command': 'orderStatusTracker',
+            'request_type': 'JSON',
+            'response_type': 'JSON',
+            'version': '1.2',
+        }, timeout=timeout)
+        resp.raise_for_status()
+        fields = dict([i.split('=', 1) for i in resp.text.strip().split('&')
+                       if '=' in i])
+        if fields.get('status') != '0' or not fields.get('enc_response'):
+            return None
+        order = json.loads(decrypt(fields['enc_response'].strip(),
+                                   self._working_key))
+        order = order.get('Order_Status_Result', order)
+        order_status = API_ORDER_STATUSES.get(order.get('order_status'))
+        if order_status is None:
+            return None
+        return {
+            'order_id': invoice_id,
+            'order_status': order_status,
+            'tracking_id': str(order.get('reference_no') or ''),
+            'bank_ref_no': str(order.get('order_bank_ref_no') or ''),
+        }
+
     def handle_cancel(self, request):
         return self._handle_callback(request)
 
@@ -1,25 +1,41 @@
-from Crypto.Cipher import AES
 import hashlib
+from functools import lru_cache
+
+
+IV = b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f'
 
 
 def pad(data):
     length = 16 - (len(data) % 16)
-    data += chr(length) * length
+    data += bytes([length]) * length
+    return data
+
+
+def unpad(data):
+    length = data[-1] if data else 0
+    if 0 < length <= 16 and data.endswith(bytes([length]) * length):
+        return data[:-length]
     return data
 
 
+@lru_cache(maxsize=None)
+def get_key(working_key):
+    """AES key for a working key; hashed once per process."""
+    return hashlib.md5(working_key.encode()).digest()
+
+
+def _cipher(working_key):
+    # Loaded on first use, so processes that never talk to the gateway
+    # don't import the crypto library.
+    from Crypto.Cipher import AES
+    return AES.new(get_key(working_key), AES.MODE_CBC, IV)
+
+
 def encrypt(plain_text, working_key):
-    iv = '\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f'
-    plain_text = pad(plain_text)
-    enc_digest = hashlib.md5()
-    enc_digest.update(working_key.encode())
-    enc_cipher = AES.new(enc_digest.digest(), AES.MODE_CBC, iv)
-    return enc_cipher.encrypt(plain_text).hex()
+    plain_text = pad(plain_text.encode())
+    return _cipher(working_key).encrypt(plain_text).hex()
+
 
 def decrypt(cipher_text, working_key):
-    iv = '\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f'
-    dec_digest = hashlib.md5()
-    dec_digest.update(working_key.encode())
     encrypted_text = bytes.fromhex(cipher_text)
-    dec_cipher = AES.new(dec_digest.digest(), AES.MODE_CBC, iv)
-    return dec_cipher.decrypt(encrypted_text).decode()
+    return unpad(_cipher(working_key).decrypt(encrypted_text)).decode()
@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.shortcuts import get_object_or_404, Http404, redirect
+from django.urls import reverse
+
+from finance.gateways.ccavenue import CCAvenue
+from finance.gateways.ccavenue.utils import encrypt
+from finance.models import Payment
+from utils.metrics import OUTBOUND_SECONDS, timed
+
+
+class FakeGateway(CCAvenue):
+    """Local stand-in for the CCAvenue gateway, for load testing.
+
+    ``handle_start`` does not leave the process: after a configurable
+    delay it builds an encrypted CCAvenue style response and feeds it to
+    the regular callback handling, as if the customer had returned from
+    the gateway. The outcome is picked at random using the configured
+    failure, abort and duplicate callback rates.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._latency = float(config.get('LATENCY', 0))
+        self._failure_rate = float(config.get('FAILURE_RATE', 0))
+        self._abort_rate = float(config.get('ABORT_RATE', 0))
+        self._duplicate_rate = float(config.get('DUPLICATE_RATE', 0))
+        self._random = random.Random(config.get('SEED'))
+
+    def handle_start(self, request):
+        invoice_id = request.GET.get('order_id')
+        if not invoice_id:
+            raise Http404
+
+        payment = get_object_or_404(Payment, invoice_id=invoice_id)
+        payment.status = 'STR'
+        payment.save(update_item=False)
+
+        self._wait_for_gateway()
+        enc_resp = self.build_response(payment, self._pick_status())
+        callbacks = 2 if self._random.random() < self._duplicate_rate else 1
+        for i in range(callbacks):
+            payment, booking = self.process_callback(
+                self.parse_response(enc_resp))
+        return redirect(reverse('booking_details') + '?bookingid=' + booking.booking_id + \
+                        '&orderid=' + payment.invoice_id)
+
+    @timed(OUTBOUND_SECONDS, 'gateway')
+    def _wait_for_gateway(self):
+        if self._latency:
+            time.sleep(self._latency * self._random.uniform(0.5, 1.5))
+
+    def build_response(self, payment, order_status):
+        """Return an encrypted response as CCAvenue would post it back."""
+        tracking_id = str(self._random.randrange(10 ** 11, 10 ** 12))
+        return encrypt('&'.join([
+            'order_id={}'.format(payment.invoice_id),
+            'tracking_id={}'.format(tracking_id),
+            'bank_ref_no={}'.format(tracking_id[::-1]),
+            'order_status={}'.format(order_status),
+            'failure_message=',
+            'payment_mode=Net Banking',
+            'currency={}'.format(payment.amount.currency.code),
+            'amount={}'.format(payment.amount.amount),
+            'status_code=null',
+            'status_message={}'.format(order_status),
+        ]), self._working_key)
+
+    def _pick_status(self):
+        roll = self._random.random()
+        if roll < self._failure_rate:
+            return 'Failure'
+        if roll < self._failure_rate + self._abort_rate:
+            return 'Aborted'
+        return 'Success'
@@ -0,0 +1,104 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from zlib import crc32
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from finance.models import GatewayCallback
+from finance.utils import get_provider
+from utils import metrics
+
+
+class Command(BaseCommand):
+    help = ('Process gateway callbacks stored in the inbox. Callbacks for '
+            'the same order are handled by the same worker, in the order '
+            'they arrived, and failed ones are retried with exponential '
+            'backoff. Several instances may run: each callback is claimed '
+            'with a row lock, so it is only applied once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to wait when the inbox is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the inbox and exit.')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print queue depth and lag, and exit.')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_stats()
+            return
+        try:
+            self.process_inbox(options)
+        finally:
+            # This process serves no metrics/ requests, so write its
+            # metrics for the web workers to report.
+            metrics.flush(force=True)
+
+    def process_inbox(self, options):
+        workers = options['workers']
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                callbacks = list(GatewayCallback.objects.due().order_by(
+                    'id')[:options['batch_size']])
+                if callbacks:
+                    partitions = defaultdict(list)
+                    for callback in callbacks:
+                        partitions[crc32(callback.order_id.encode('utf-8')) %
+                                   workers].append(callback)
+                    list(pool.map(self.process, partitions.values()))
+                    self.write_stats()
+                    metrics.flush()
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+
+    def process(self, callbacks):
+        # Once a callback fails, or another worker holds it, later ones for
+        # its order wait for the next batch.
+        blocked = set()
+        try:
+            for callback in callbacks:
+                if callback.order_id in blocked:
+                    continue
+                with transaction.atomic():
+                    if not self.process_claimed(callback):
+                        blocked.add(callback.order_id)
+        finally:
+            connection.close()
+
+    def process_claimed(self, callback):
+        """Lock ``callback``'s row, skipping it if another worker holds it
+        or already processed it, and apply it. Returns whether it was
+        applied."""
+        callback = GatewayCallback.objects.select_for_update(
+            skip_locked=True).filter(
+                pk=callback.pk, processed__isnull=True,
+                next_attempt_at__lte=timezone.now()).first()
+        if callback is None:
+            return False
+        try:
+            with transaction.atomic():
+                get_provider(callback.provider).process_queued_callback(
+                    callback)
+        except Exception as e:
+            callback.retry_later(repr(e))
+            self.stderr.write('{}: {}'.format(callback, e))
+            return False
+        callback.processed = timezone.now()
+        callback.attempts += 1
+        callback.error = ''
+        callback.save(update_fields=['processed', 'attempts', 'error'])
+        return True
+
+    def write_stats(self):
+        self.stdout.write(
+            'Inbox depth: {depth}, lag: {lag:.1f}s, '
+            'processing lag: {processing_lag:.1f}s, '
+            'failed: {failed}'.format(**GatewayCallback.objects.stats()))
@@ -0,0 +1,88 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+
+from finance.models import Payment
+from finance.utils import get_provider
+from utils import metrics
+
+
+class Command(BaseCommand):
+    help = ('Ask payment providers for the state of gateway payments that '
+            'were started but never came back, and apply the answers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30,
+                            help='Only payments created this many minutes '
+                                 'ago or earlier.')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent order status requests.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+        # Served by the (mode, status, created) index.
+        pending = Payment.objects.filter(
+            mode='PG', status__in=('WAT', 'STR'), created__lte=cutoff,
+        ).order_by('created').values_list('invoice_id', 'provider')
+
+        by_provider = defaultdict(list)
+        for invoice_id, provider in pending:
+            by_provider[provider].append(invoice_id)
+
+        checked = applied = failed = 0
+        with ThreadPoolExecutor(options['workers']) as pool:
+            for name, invoice_ids in by_provider.items():
+                try:
+                    provider = get_provider(name or None)
+                except Http404:
+                    self.stderr.write('Skipping {} payments of unknown '
+                                      'provider {!r}.'.format(
+                                          len(invoice_ids), name))
+                    continue
+                if not getattr(provider, 'has_order_status', False):
+                    self.stderr.write('Skipping {} payments of provider {!r}, '
+                                      'which has no order status API '
+                                      'configured.'.format(
+                                          len(invoice_ids), name))
+                    continue
+                for i in range(0, len(invoice_ids), options['batch_size']):
+                    batch = invoice_ids[i:i + options['batch_size']]
+                    results = list(pool.map(
+                        lambda invoice_id: self.fetch(provider, invoice_id),
+                        batch))
+                    checked += len(batch)
+                    failed += results.count(False)
+                    updates = [data for data in results if data]
+                    if updates and not options['dry_run']:
+                        self.apply(provider, updates)
+                    applied += len(updates)
+
+        metrics.flush(force=True)
+        self.stdout.write(self.style.SUCCESS(
+            'Checked {} payments: {} {}, {} lookups failed.'.format(
+                checked, applied,
+                'would be updated' if options['dry_run'] else 'updated',
+                failed)))
+
+    def fetch(self, provider, invoice_id):
+        try:
+            return provider.fetch_order_status(invoice_id)
+        except Exception as e:
+            self.stderr.write('{}: {}'.format(invoice_id, e))
+            return False
+
+    def apply(self, provider, updates):
+        # One transaction per batch; customers are notified once it commits.
+        with transaction.atomic():
+            for data in updates:
+                try:
+                    provider.process_callback(data)
+                except Exception as e:
+                    self.stderr.write('{}: {}'.format(data['order_id'], e))
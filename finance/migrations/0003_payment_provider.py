@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_auto_20211120_2304'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='provider',
+            field=models.CharField(blank=True, default='', help_text='Payment provider for gateway payments', max_length=50),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_payment_provider'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['mode', 'status', 'created'], name='payment_mode_status_created'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.4 on 2026-10-19 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0004_payment_mode_status_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GatewayCallback',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50)),
+                ('order_id', models.CharField(db_index=True, max_length=50)),
+                ('payload', models.TextField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='gatewaycallback',
+            index=models.Index(fields=['processed', 'id'], name='gatewaycallback_pending'),
+        ),
+    ]
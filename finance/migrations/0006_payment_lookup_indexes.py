@@ -0,0 +1,22 @@
+# Generated by Django 3.0.4 on 2026-10-19 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_gatewaycallback'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='invoice_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['item_content_type', 'item_object_id'], name='payment_item'),
+        ),
+    ]
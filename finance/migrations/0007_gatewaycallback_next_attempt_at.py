@@ -0,0 +1,19 @@
+# Generated by Django 3.0.4 on 2026-10-19 18:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_payment_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gatewaycallback',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
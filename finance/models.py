@@ -6,6 +6,7 @@ from django.utils import timezone
 from django.conf import settings
 
 import uuid
+from datetime import timedelta
 from hashlib import md5
 
 from djmoney.models.fields import MoneyField
@@ -32,6 +33,14 @@ PAYMENT_STATUS_CHOICES = getattr(settings, 'PAYMENT_STATUS_CHOICES', (
     ('ERR', 'Error')
 ))
 
+# Fields that can change without affecting the item a payment is made
+# towards, so saving only these skips recomputing the item.
+ACCOUNTS_FIELDS = frozenset([
+    'accounts_verified', 'accounts_received', 'accounts_due',
+    'accounts_comment', 'accounts_last_updated_by', 'accounts_last_updated',
+    'last_updated', 'last_updated_by',
+])
+
 
 class Payment(models.Model):
     amount = MoneyField(
@@ -45,10 +54,12 @@ class Payment(models.Model):
     status = models.CharField(choices=PAYMENT_STATUS_CHOICES, max_length=3,
                               blank=True, null=True)
     details = models.TextField(max_length=1024, blank=True, null=True)
+    provider = models.CharField(max_length=50, blank=True, default='',
+                                help_text='Payment provider for gateway payments')
 
     # auto generated
     timestamp = models.DateTimeField(blank=True, null=True)
-    invoice_id = models.CharField(max_length=50, blank=True)
+    invoice_id = models.CharField(max_length=50, blank=True, db_index=True)
 
     # Item towards which this payment is made
     item_content_type = models.ForeignKey(
@@ -78,6 +89,13 @@ class Payment(models.Model):
         permissions = (
             ('verify_payment', 'Verify payment'),
         )
+        indexes = [
+            models.Index(fields=['mode', 'status', 'created'],
+                         name='payment_mode_status_created'),
+            # Payments of an item, through its GenericRelation.
+            models.Index(fields=['item_content_type', 'item_object_id'],
+                         name='payment_item'),
+        ]
 
     def __str__(self):
         return '%s' % self.received
@@ -86,7 +104,7 @@ class Payment(models.Model):
     def received(self):
         return self.type * self.amount
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, update_item=True, **kwargs):
         if not self.invoice_id:
             self.invoice_id = self._create_invoice_id()
 
@@ -94,9 +112,89 @@ class Payment(models.Model):
             self.timestamp = timezone.now()
 
         self.accounts_due = self.amount.amount - self.accounts_received
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'accounts_received' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'accounts_due'}
+        # update_item=False skips recomputing the item this payment is for,
+        # when the caller takes care of that itself. The post_save signal
+        # reads the flag, which only lasts for this save.
+        self._update_item = update_item
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            del self._update_item
 
     def _create_invoice_id(self):
         text = str(uuid.uuid1())
         return (settings.INVOICE_ID_PREFIX + md5(
-            text.encode('utf-8')).hexdigest()[:8]).upper()
\ No newline at end of file
+            text.encode('utf-8')).hexdigest()[:8]).upper()
+
+
+class GatewayCallbackQuerySet(models.QuerySet):
+
+    def pending(self):
+        return self.filter(
+            processed__isnull=True,
+            attempts__lt=settings.PAYMENT_CALLBACK_MAX_ATTEMPTS)
+
+    def due(self):
+        """Pending callbacks to process now: those not waiting for a
+        retry, of orders with no callback waiting for one, so that an
+        order's callbacks are still applied in the order they arrived."""
+        now = timezone.now()
+        waiting = self.pending().filter(next_attempt_at__gt=now)
+        return self.pending().filter(next_attempt_at__lte=now).exclude(
+            order_id__in=waiting.values('order_id'))
+
+    def stats(self):
+        """Queue depth and lag, in seconds, of the callback inbox."""
+        now = timezone.now()
+        pending = self.pending().aggregate(
+            depth=models.Count('id'), oldest=models.Min('received'))
+        recent = list(self.filter(processed__isnull=False).order_by(
+            '-processed').values_list('received', 'processed')[:100])
+        return {
+            'depth': pending['depth'],
+            'lag': (now - pending['oldest']).total_seconds()
+            if pending['oldest'] else 0,
+            'processing_lag': sum(
+                (processed - received).total_seconds()
+                for received, processed in recent) / len(recent)
+            if recent else 0,
+            'failed': self.filter(
+                processed__isnull=True,
+                attempts__gte=settings.PAYMENT_CALLBACK_MAX_ATTEMPTS).count(),
+        }
+
+
+class GatewayCallback(models.Model):
+    """Raw payment gateway callback, stored to be processed later."""
+    provider = models.CharField(max_length=50)
+    order_id = models.CharField(max_length=50, db_index=True)
+    payload = models.TextField()
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True, default='')
+
+    objects = GatewayCallbackQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed', 'id'],
+                         name='gatewaycallback_pending'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.provider, self.order_id)
+
+    def retry_later(self, error):
+        """Record a failed attempt, and schedule the next one with
+        exponential backoff from ``PAYMENT_CALLBACK_RETRY_DELAY``."""
+        self.attempts += 1
+        self.error = error
+        self.next_attempt_at = timezone.now() + timedelta(
+            seconds=settings.PAYMENT_CALLBACK_RETRY_DELAY *
+            2 ** (self.attempts - 1))
+        self.save(update_fields=['attempts', 'error', 'next_attempt_at'])
@@ -0,0 +1,132 @@
+import csv
+import io
+from collections import defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Payment
+
+
+StatementRow = namedtuple(
+    'StatementRow', ['line', 'invoice_id', 'reference_id', 'amount', 'comment'])
+
+COLUMN_ALIASES = {
+    'invoice_id': ('invoice_id', 'invoice', 'order_id', 'order'),
+    'reference_id': ('reference_id', 'reference', 'ref', 'ref_no',
+                     'bank_ref_no', 'utr'),
+    'amount': ('amount', 'credit', 'deposit'),
+    'comment': ('comment', 'narration', 'description', 'remarks'),
+}
+
+VERIFY_FIELDS = ['accounts_verified', 'accounts_received', 'accounts_due',
+                 'accounts_comment', 'accounts_last_updated_by',
+                 'accounts_last_updated']
+
+
+class StatementError(Exception):
+    pass
+
+
+def read_statement(fileobj):
+    """Parse a CSV bank statement into ``StatementRow`` items."""
+    content = fileobj.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(content))
+    headers = {(name or '').strip().lower(): name
+               for name in reader.fieldnames or []}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in headers:
+                columns[column] = headers[alias]
+                break
+    if 'amount' not in columns:
+        raise StatementError('Statement has no amount column.')
+    if 'invoice_id' not in columns and 'reference_id' not in columns:
+        raise StatementError(
+            'Statement needs an invoice id or a reference id column.')
+
+    rows = []
+    for line, record in enumerate(reader, start=2):
+        def value(column):
+            return (record.get(columns.get(column)) or '').strip()
+        try:
+            amount = Decimal(value('amount').replace(',', ''))
+        except InvalidOperation:
+            raise StatementError('Invalid amount on line {}.'.format(line))
+        rows.append(StatementRow(line, value('invoice_id').upper(),
+                                 value('reference_id'), amount,
+                                 value('comment')))
+    return rows
+
+
+def match_statement(rows):
+    """Match statement rows against unverified payments.
+
+    Rows are matched by invoice id first, then reference id, then by amount
+    when exactly one unverified payment has that amount. A row whose invoice
+    id matches no payment is left unmatched rather than matched by amount.
+    Gateway payments only count once successful. Returns a list of
+    ``(row, payment)`` pairs and a list of unmatched rows.
+    """
+    invoice_ids = {row.invoice_id for row in rows if row.invoice_id}
+    reference_ids = {row.reference_id for row in rows if row.reference_id}
+    pending = Payment.objects.filter(
+        ~Q(mode='PG') | Q(status='SUC'), accounts_verified=False, type=1)
+
+    by_invoice = {}
+    by_reference = {}
+    if invoice_ids or reference_ids:
+        for payment in pending.filter(Q(invoice_id__in=invoice_ids) |
+                                      Q(reference_id__in=reference_ids)):
+            by_invoice[payment.invoice_id.upper()] = payment
+            if payment.reference_id:
+                by_reference[payment.reference_id] = payment
+
+    by_amount = defaultdict(list)
+    amounts = sorted({row.amount for row in rows if not row.invoice_id})
+    for start in range(0, len(amounts), 500):
+        for payment in pending.filter(amount__in=amounts[start:start + 500]):
+            by_amount[payment.amount.amount].append(payment)
+
+    matches = []
+    unmatched = []
+    claimed = set()
+    for row in rows:
+        payment = by_invoice.get(row.invoice_id) or \
+            by_reference.get(row.reference_id)
+        if payment is None and not row.invoice_id:
+            candidates = [p for p in by_amount.get(row.amount, [])
+                          if p.id not in claimed]
+            if len(candidates) == 1:
+                payment = candidates[0]
+        if payment is None or payment.id in claimed:
+            unmatched.append(row)
+            continue
+        claimed.add(payment.id)
+        matches.append((row, payment))
+    return matches, unmatched
+
+
+def apply_matches(matches, user):
+    """Mark matched payments as verified with a single batched update."""
+    now = timezone.now()
+    payments = []
+    for row, payment in matches:
+        payment.accounts_verified = True
+        payment.accounts_received = row.amount
+        payment.accounts_due = payment.amount.amount - row.amount
+        if row.comment:
+            payment.accounts_comment = row.comment[:200]
+        payment.accounts_last_updated_by = user
+        payment.accounts_last_updated = now
+        payments.append(payment)
+    # Accounting fields don't change booking totals, so skipping the
+    # Payment signals leaves the bookings and revenue rollups correct.
+    with transaction.atomic():
+        Payment.objects.bulk_update(payments, VERIFY_FIELDS, batch_size=500)
+    return len(payments)
@@ -1,3 +1,629 @@
-from django.test import TestCase
+import glob
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from copy import deepcopy
+from datetime import date, time, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.utils import timezone
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from finance.gateways.ccavenue.utils import decrypt, encrypt
+from finance.management.commands.process_gateway_callbacks import Command
+from finance.models import GatewayCallback, Payment
+from finance.reconciliation import (StatementError, StatementRow,
+                                    apply_matches, match_statement,
+                                    read_statement)
+from finance.utils import choose_provider, get_provider
+from opencabs.models import (Booking, Place, Rate, VehicleCategory,
+                             VehicleRateCategory)
+from utils import metrics
+from utils.paginator import KeysetPaginator
+
+
+WORKING_KEY = 'stubkey'
+
+
+class OrderStatusStub(BaseHTTPRequestHandler):
+    """CCAvenue order status API answering from ``orders``."""
+    orders = {}
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        request = json.loads(decrypt(form['enc_request'][0], WORKING_KEY))
+        order = self.orders.get(request['order_no'])
+        if order is None:
+            body = 'status=1&enc_response=No records found'
+        else:
+            body = 'status=0&enc_response={}'.format(
+                encrypt(json.dumps(order), WORKING_KEY))
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+def create_booking_data():
+    """Keyword arguments for a booking on a newly created route."""
+    source = Place.objects.create(name='Kohima')
+    destination = Place.objects.create(name='Dimapur')
+    vehicle_type = VehicleRateCategory.objects.create(
+        name='Sedan', tariff_per_km=10, tariff_after_hours=100,
+        category=VehicleCategory.objects.create(name='Car'))
+    Rate.objects.create(
+        source=source, destination=destination,
+        vehicle_category=vehicle_type, oneway_price=1500,
+        oneway_driver_charge=200)
+    return dict(
+        source=source, destination=destination, booking_type='OW',
+        travel_date=date.today() + timedelta(days=7),
+        travel_time=time(10), vehicle_type=vehicle_type,
+        customer_name='Test', customer_mobile='9999999999',
+        payment_method='ONL', status='3')
+
+
+class ReconcilePaymentsTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), OrderStatusStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue'].update({
+            'WORKING_KEY': WORKING_KEY,
+            'STATUS_API_URL': 'http://127.0.0.1:{}/'.format(
+                cls.server.server_port),
+        })
+        cls.settings_override = override_settings(
+            PAYMENT_PROVIDERS=providers, PAYMENT_PROVIDER='ccavenue',
+            SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.booking_data = create_booking_data()
+
+    def create_payment(self, minutes_ago=60, status='STR'):
+        booking = Booking.objects.create(**self.booking_data)
+        payment = booking.payments.create(
+            amount=booking.total_fare, type=1, mode='PG', status=status,
+            provider='ccavenue')
+        Payment.objects.filter(pk=payment.pk).update(
+            created=payment.created - timedelta(minutes=minutes_ago))
+        return payment
+
+    def reconcile(self, stderr=None, **options):
+        out = StringIO()
+        call_command('reconcile_payments', stdout=out,
+                     stderr=stderr or StringIO(), **options)
+        return out.getvalue()
+
+    def test_applies_gateway_status(self):
+        paid = self.create_payment()
+        failed = self.create_payment(status='WAT')
+        pending = self.create_payment()
+        OrderStatusStub.orders = {
+            paid.invoice_id: {'order_status': 'Successful',
+                              'reference_no': 'T1',
+                              'order_bank_ref_no': 'B1'},
+            failed.invoice_id: {'order_status': 'Unsuccessful',
+                                'reference_no': 'T2'},
+            pending.invoice_id: {'order_status': 'Initiated'},
+        }
+
+        output = self.reconcile(batch_size=2, workers=2)
+
+        self.assertIn('Checked 3 payments: 2 updated', output)
+        paid.refresh_from_db()
+        self.assertEqual((paid.status, paid.reference_id), ('SUC', 'T1'))
+        self.assertEqual(paid.bookings.get().status, '1')
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, 'FAL')
+        self.assertEqual(failed.bookings.get().status, '0')
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'STR')
+        self.assertEqual(pending.bookings.get().status, '3')
+
+    def test_skips_recent_payments_and_dry_run(self):
+        recent = self.create_payment(minutes_ago=0)
+        stale = self.create_payment()
+        OrderStatusStub.orders = {
+            invoice_id: {'order_status': 'Successful', 'reference_no': ref}
+            for invoice_id, ref in ((recent.invoice_id, 'T3'),
+                                    (stale.invoice_id, 'T4'))
+        }
+
+        output = self.reconcile(dry_run=True)
+
+        self.assertIn('Checked 1 payments: 1 would be updated', output)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'STR')
+
+    def test_missing_order_is_left_alone(self):
+        payment = self.create_payment()
+        OrderStatusStub.orders = {}
+
+        self.assertIn('Checked 1 payments: 0 updated', self.reconcile())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'STR')
+
+    def test_requires_status_api_url(self):
+        payment = self.create_payment()
+        OrderStatusStub.orders = {payment.invoice_id: {
+            'order_status': 'Successful', 'reference_no': 'T5'}}
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue']['STATUS_API_URL'] = ''
+        err = StringIO()
+
+        with override_settings(PAYMENT_PROVIDERS=providers):
+            output = self.reconcile(stderr=err)
+
+        self.assertIn('Checked 0 payments', output)
+        self.assertIn('no order status API configured', err.getvalue())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'STR')
+
+
+class StatementReconciliationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('accounts')
+        booking = Booking.objects.create(**create_booking_data())
+        cls.transfer = booking.payments.create(
+            amount=500, mode='BT', reference_id='UTR1')
+        cls.cash = booking.payments.create(amount=700, mode='CA')
+        cls.paid = booking.payments.create(
+            amount=300, mode='PG', status='SUC', provider='ccavenue')
+        cls.started = booking.payments.create(
+            amount=200, mode='PG', status='STR', provider='ccavenue')
+
+    def statement(self, *lines):
+        return read_statement(BytesIO('\ufeff{}\n{}\n'.format(
+            'Invoice,UTR,Credit,Narration', '\n'.join(lines)).encode('utf-8')))
+
+    def test_read_statement(self):
+        rows = self.statement('inv1,,"1,500.50",Transfer', ',R2,20,')
+        self.assertEqual(rows, [
+            StatementRow(2, 'INV1', '', Decimal('1500.50'), 'Transfer'),
+            StatementRow(3, '', 'R2', Decimal('20'), '')])
+        with self.assertRaisesMessage(StatementError, 'line 2'):
+            self.statement('INV1,,abc,')
+        with self.assertRaisesMessage(StatementError, 'no amount column'):
+            read_statement(BytesIO(b'Invoice,UTR\nINV1,R1\n'))
+
+    def test_match_statement(self):
+        matches, unmatched = match_statement(self.statement(
+            '{},,300,'.format(self.paid.invoice_id.lower()),
+            ',UTR1,500,',
+            ',,700,Cash deposit',
+            # Not successful at the gateway, so not received.
+            '{},,200,'.format(self.started.invoice_id),
+            ',,200,',
+            # An unknown invoice id isn't matched by amount.
+            'UNKNOWN,,700,',
+        ))
+        self.assertEqual([(row.line, payment) for row, payment in matches],
+                         [(2, self.paid), (3, self.transfer), (4, self.cash)])
+        self.assertEqual([row.line for row in unmatched], [5, 6, 7])
+
+    def test_match_statement_claims_payment_once(self):
+        matches, unmatched = match_statement(self.statement(
+            ',UTR1,500,', ',UTR1,500,'))
+        self.assertEqual(len(matches), 1)
+        self.assertEqual([row.line for row in unmatched], [3])
+
+    def test_apply_matches(self):
+        matches, unmatched = match_statement(self.statement(
+            ',UTR1,450,Short', ',,700,'))
+
+        self.assertEqual(apply_matches(matches, self.user), 2)
+
+        self.transfer.refresh_from_db()
+        self.assertTrue(self.transfer.accounts_verified)
+        self.assertEqual(self.transfer.accounts_received, Decimal('450'))
+        self.assertEqual(self.transfer.accounts_due, Decimal('50'))
+        self.assertEqual(self.transfer.accounts_comment, 'Short')
+        self.assertEqual(self.transfer.accounts_last_updated_by, self.user)
+        self.cash.refresh_from_db()
+        self.assertTrue(self.cash.accounts_verified)
+        # Verified payments aren't matched again.
+        self.assertEqual(match_statement(self.statement(',,700,'))[0], [])
+
+
+class KeysetPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        booking = Booking.objects.create(**create_booking_data())
+        Payment.objects.bulk_create([
+            Payment(item_object=booking, amount=i + 1, mode='BT')
+            for i in range(92)])
+        # Rows sharing a timestamp are ordered by id.
+        for i, pk in enumerate(Payment.objects.values_list('pk', flat=True)):
+            Payment.objects.filter(pk=pk).update(
+                created=booking.created - timedelta(minutes=i // 3))
+
+    def setUp(self):
+        cache.clear()
+
+    def paginators(self, queryset):
+        queryset = queryset.order_by('-created', '-id')
+        return (KeysetPaginator(queryset, 10, orphans=2),
+                Paginator(queryset, 10, orphans=2))
+
+    def delete(self, payment):
+        # Without signals: the payments add up to more than the booking's
+        # fare.
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM finance_payment WHERE id = %s',
+                           [payment.pk])
+
+    def assertPage(self, keyset, offset, number):
+        with CaptureQueriesContext(connection) as queries:
+            page = list(keyset.page(number))
+        self.assertEqual(page, list(offset.page(number)))
+        return '\n'.join(query['sql'] for query in queries)
+
+    def test_pages_match_offset_pagination(self):
+        keyset, offset = self.paginators(Payment.objects.all())
+        self.assertEqual(keyset.num_pages, 9)
+        for number in (1, 2, 3, 7, 5, 9, 8, 4, 6):
+            self.assertPage(keyset, offset, number)
+        # With boundaries left by another paginator.
+        keyset = self.paginators(Payment.objects.all())[0]
+        for number in range(9, 0, -1):
+            self.assertPage(keyset, offset, number)
+
+    def test_seeks_instead_of_offset(self):
+        keyset, offset = self.paginators(Payment.objects.filter(mode='BT'))
+        # The first row of the last pages is found backwards from the end
+        # of the list.
+        self.assertIn('OFFSET 11', self.assertPage(keyset, offset, 9))
+        self.assertIn('OFFSET 21', self.assertPage(keyset, offset, 8))
+        # The next pages start from the boundary of the previous one.
+        self.assertIn('OFFSET 10', self.assertPage(keyset, offset, 2))
+        self.assertNotIn('OFFSET', self.assertPage(keyset, offset, 3))
+        self.assertIn('OFFSET 10', self.assertPage(keyset, offset, 5))
+
+    def test_rows_added_and_removed(self):
+        keyset, offset = self.paginators(Payment.objects.all())
+        for number in range(1, 10):
+            self.assertPage(keyset, offset, number)
+        booking = Booking.objects.get()
+        latest = Payment.objects.order_by('-created', '-id')[0]
+        # A new row at the top, and the same count.
+        [payment] = Payment.objects.bulk_create([
+            Payment(item_object=booking, amount=100, mode='BT')])
+        Payment.objects.filter(pk=payment.pk).update(
+            created=latest.created + timedelta(minutes=1))
+        self.delete(Payment.objects.order_by('created', 'id')[0])
+        keyset, offset = self.paginators(Payment.objects.all())
+        for number in range(1, 10):
+            self.assertPage(keyset, offset, number)
+        # One row less.
+        self.delete(latest)
+        keyset, offset = self.paginators(Payment.objects.all())
+        for number in range(2, 10):
+            self.assertPage(keyset, offset, number)
+
+    def test_empty_querysets(self):
+        for queryset in (Payment.objects.none(),
+                         Payment.objects.filter(pk__in=[])):
+            keyset, offset = self.paginators(queryset)
+            self.assertEqual(keyset.count, 0)
+            self.assertEqual(list(keyset.page(1)), [])
+
+
+class GatewayCallbackTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue']['WORKING_KEY'] = WORKING_KEY
+        providers['other'] = providers['ccavenue']
+        cls.settings_override = override_settings(
+            PAYMENT_PROVIDERS=providers, PAYMENT_PROVIDER='ccavenue',
+            PAYMENT_CALLBACK_INBOX=False,
+            SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.booking_data = create_booking_data()
+
+    def setUp(self):
+        self.booking = Booking.objects.create(**self.booking_data)
+        self.payment = self.booking.payments.create(
+            amount=self.booking.total_fare, mode='PG', status='STR',
+            provider='ccavenue')
+
+    def callback(self, order_status='Success', tracking_id='T1',
+                 payment=None, path='/payment/success/ccavenue/'):
+        payment = payment or self.payment
+        return self.client.post(path, {'encResp': encrypt('&'.join([
+            'order_id={}'.format(payment.invoice_id),
+            'tracking_id={}'.format(tracking_id),
+            'bank_ref_no=B{}'.format(tracking_id),
+            'order_status={}'.format(order_status),
+            'amount={}'.format(payment.amount.amount)]), WORKING_KEY)})
+
+    def assertPaid(self, payment, booking):
+        payment.refresh_from_db()
+        booking.refresh_from_db()
+        self.assertEqual((payment.status, payment.reference_id),
+                         ('SUC', 'T1'))
+        self.assertEqual((booking.status, booking.payment_status,
+                          booking.payment_done),
+                         ('1', 'PD', payment.amount.amount))
+
+    def test_success(self):
+        response = self.callback()
+        self.assertRedirects(
+            response, '/booking/?bookingid={}&orderid={}'.format(
+                self.booking.booking_id, self.payment.invoice_id),
+            fetch_redirect_response=False)
+        self.assertPaid(self.payment, self.booking)
+
+    def test_repeated_callbacks_apply_once(self):
+        self.callback()
+        last_updated = Payment.objects.get(pk=self.payment.pk).last_updated
+        self.callback()
+        # A late failure doesn't undo the success.
+        self.callback('Failure', 'T2')
+        self.callback('Aborted', 'T1', path='/payment/cancel/ccavenue/')
+        self.assertPaid(self.payment, self.booking)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).last_updated,
+                         last_updated)
+
+    def test_tracking_id_of_another_order(self):
+        self.callback()
+        other = Booking.objects.create(**self.booking_data)
+        payment = other.payments.create(
+            amount=other.total_fare, mode='PG', status='STR',
+            provider='ccavenue')
+
+        self.callback(payment=payment)
+
+        payment.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(payment.status, 'STR')
+        self.assertEqual((other.status, other.payment_status), ('3', 'NP'))
+
+    def test_callback_of_another_provider(self):
+        self.payment.provider = 'other'
+        self.payment.save(update_item=False)
+
+        response = self.callback()
+
+        self.assertEqual(response.status_code, 404)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'STR')
+        self.assertEqual(self.callback(path='/payment/success/other/').url,
+                         '/booking/?bookingid={}&orderid={}'.format(
+                             self.booking.booking_id, self.payment.invoice_id))
+        self.assertPaid(self.payment, self.booking)
+
+    def test_failure(self):
+        self.callback('Failure', 'T3')
+        self.payment.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual(self.payment.status, 'FAL')
+        self.assertEqual((self.booking.status, self.booking.payment_status),
+                         ('0', 'NP'))
+
+    def test_update_item_is_per_save(self):
+        payment = self.booking.payments.create(amount=100, mode='CA')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_done, 100)
+
+        payment.save(update_item=False)
+        payment.delete()
+
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_done, 0)
+
+
+class CallbackInboxTest(TransactionTestCase):
+
+    def setUp(self):
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue']['WORKING_KEY'] = WORKING_KEY
+        providers['other'] = providers['ccavenue']
+        settings_override = override_settings(
+            PAYMENT_PROVIDERS=providers, PAYMENT_PROVIDER='ccavenue',
+            PAYMENT_CALLBACK_INBOX=True, PAYMENT_CALLBACK_RETRY_DELAY=30,
+            SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.booking = Booking.objects.create(**create_booking_data())
+        self.payment = self.booking.payments.create(
+            amount=self.booking.total_fare, mode='PG', status='STR',
+            provider='ccavenue')
+
+    def callback(self, order_id=None, path='/payment/success/ccavenue/'):
+        return self.client.post(path, {'encResp': encrypt('&'.join([
+            'order_id={}'.format(order_id or self.payment.invoice_id),
+            'tracking_id=T1', 'bank_ref_no=B1', 'order_status=Success',
+            'amount={}'.format(self.payment.amount.amount)]), WORKING_KEY)})
+
+    def process(self):
+        call_command('process_gateway_callbacks', once=True, workers=2,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_queue_and_process(self):
+        response = self.callback()
+
+        self.assertEqual(response.url,
+                         '/booking/?bookingid={}&orderid={}'.format(
+                             self.booking.booking_id, self.payment.invoice_id))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'STR')
+        self.assertEqual(GatewayCallback.objects.stats()['depth'], 1)
+
+        self.process()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'SUC')
+        callback = GatewayCallback.objects.get()
+        self.assertIsNotNone(callback.processed)
+        self.assertEqual((callback.attempts, callback.error), (1, ''))
+
+    def test_booking_details_follow_the_worker(self):
+        url = self.callback().url
+
+        self.assertContains(self.client.get(url), '<dd>Attempt</dd>')
+        # Saved by the worker's threads, which share no state with the
+        # views but the database.
+        self.process()
+        self.assertContains(self.client.get(url), '<dd>Confirmed</dd>')
+
+        Booking.objects.filter(pk=self.booking.pk).update(
+            status='2', last_updated=timezone.now())
+        self.assertContains(self.client.get(url), '<dd>Declined</dd>')
+
+    def test_worker_writes_metrics(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        self.callback()
+
+        with override_settings(METRICS_SAMPLE_RATE=1,
+                               METRICS_DIR=metrics_dir), \
+                mock.patch.dict(metrics._process, pid=None):
+            self.process()
+
+        [path] = glob.glob(os.path.join(metrics_dir, 'metrics-*.json'))
+        with open(path) as f:
+            series = dict((tuple(labels), values) for labels, values in
+                          json.load(f)[metrics.CALLBACK_SECONDS.name])
+        self.assertEqual(sum(series[('ok',)][:-1]), 1)
+
+    def test_callbacks_applied_once(self):
+        self.callback()
+        # A second worker, which read the same batch before the first one
+        # processed it.
+        stale = list(GatewayCallback.objects.due())
+        self.process()
+        with mock.patch('finance.gateways.ccavenue.CCAvenue.'
+                        'process_queued_callback') as process_queued:
+            Command().process(stale)
+        process_queued.assert_not_called()
+        self.assertEqual(GatewayCallback.objects.get().attempts, 1)
+
+    def test_unknown_orders_are_not_stored(self):
+        self.assertEqual(self.callback('unknown').status_code, 404)
+        self.assertEqual(
+            self.callback(path='/payment/success/other/').status_code, 404)
+        self.assertFalse(GatewayCallback.objects.exists())
+
+    def test_failed_callbacks_back_off(self):
+        failing = GatewayCallback.objects.create(
+            provider='ccavenue', order_id=self.payment.invoice_id,
+            payload='not encrypted')
+        self.callback()
+
+        started = timezone.now()
+        self.process()
+
+        failing.refresh_from_db()
+        self.assertEqual(failing.attempts, 1)
+        self.assertTrue(failing.error)
+        self.assertAlmostEqual(
+            (failing.next_attempt_at - started).total_seconds(), 30, delta=5)
+        # The order's later callback waits for the retry.
+        self.process()
+        self.assertEqual(GatewayCallback.objects.filter(
+            processed__isnull=True).count(), 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'STR')
+
+        GatewayCallback.objects.filter(pk=failing.pk).update(
+            next_attempt_at=started)
+        started = timezone.now()
+        self.process()
+
+        failing.refresh_from_db()
+        self.assertEqual(failing.attempts, 2)
+        self.assertAlmostEqual(
+            (failing.next_attempt_at - started).total_seconds(), 60, delta=5)
+
+
+class ProviderTest(TestCase):
+
+    def providers(self, **weights):
+        providers = {}
+        for name, weight in weights.items():
+            providers[name] = deepcopy(settings.PAYMENT_PROVIDERS['ccavenue'])
+            providers[name]['WEIGHT'] = weight
+        return providers
+
+    def test_weighted_choice(self):
+        with override_settings(PAYMENT_PROVIDERS=self.providers(
+                first=3, second=1, unused=0)):
+            chosen = [choose_provider('B{:05d}'.format(i))
+                      for i in range(4000)]
+            self.assertEqual(set(chosen), {'first', 'second'})
+            self.assertAlmostEqual(chosen.count('first') / len(chosen), 0.75,
+                                   delta=0.03)
+            # The same booking always goes to the same provider.
+            self.assertEqual(
+                [choose_provider('B{:05d}'.format(i)) for i in range(100)],
+                chosen[:100])
+
+    def test_unweighted_choice(self):
+        providers = self.providers(first=None, second=None)
+        with override_settings(PAYMENT_PROVIDERS=providers,
+                               PAYMENT_PROVIDER='second'):
+            self.assertEqual(choose_provider('B00001'), 'second')
+            self.assertIs(get_provider(), get_provider('second'))
+
+    def test_unknown_provider(self):
+        with self.assertRaises(Http404):
+            get_provider('unknown')
+        response = self.client.post('/payment/success/unknown/',
+                                    {'encResp': ''})
+        self.assertEqual(response.status_code, 404)
+
+    def test_fake_gateway_is_opt_in(self):
+        from opencabs import default_settings
+        try:
+            for value, configured in (('', False), ('True', True)):
+                with mock.patch.dict(os.environ, FAKE_GATEWAY=value):
+                    importlib.reload(default_settings)
+                self.assertEqual('fake' in default_settings.PAYMENT_PROVIDERS,
+                                 configured)
+        finally:
+            importlib.reload(default_settings)
@@ -4,7 +4,9 @@ from .views import start, success, cancel, index
 
 urlpatterns = [
     url(r'^success/$', success),
+    url(r'^success/(?P<provider>[\w-]+)/$', success),
     url('^start/$', start, name='payment_start'),
     url('^cancel/$', cancel),
+    url(r'^cancel/(?P<provider>[\w-]+)/$', cancel),
     url('^index/$', index, name='payment_index')
 ]
@@ -1,8 +1,69 @@
+from hashlib import md5
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import Http404
 
 from utils import import_path
 
 
-def get_provider():
-    path = settings.PAYMENT_PROVIDERS[settings.PAYMENT_PROVIDER]['CLASS']
-    return import_path(path)(settings.PAYMENT_PROVIDERS[settings.PAYMENT_PROVIDER])
+_providers = {}
+_weights = []
+
+
+def load_providers():
+    """Instantiate every configured payment provider once, naming each
+    after its ``PAYMENT_PROVIDERS`` key."""
+    providers = {}
+    for name, config in settings.PAYMENT_PROVIDERS.items():
+        providers[name] = import_path(config['CLASS'])(config)
+        providers[name].name = name
+    _providers.clear()
+    _providers.update(providers)
+    _weights[:] = [
+        (name, config['WEIGHT'])
+        for name, config in sorted(settings.PAYMENT_PROVIDERS.items())
+        if config.get('WEIGHT')
+    ]
+    return _providers
+
+
+def get_provider(name=None):
+    """Return the provider called ``name``, or ``PAYMENT_PROVIDER``.
+
+    Raises ``Http404`` for a name that isn't configured, as it comes from
+    callback URLs.
+    """
+    if not _providers:
+        load_providers()
+    try:
+        return _providers[name or settings.PAYMENT_PROVIDER]
+    except KeyError:
+        raise Http404('Unknown payment provider: {}'.format(name))
+
+
+def choose_provider(key):
+    """Pick the provider for a new payment.
+
+    Traffic is split between providers by their ``WEIGHT`` setting, hashing
+    ``key`` so that the same booking always goes to the same provider. With
+    no weights configured, ``PAYMENT_PROVIDER`` is used.
+    """
+    if not _providers:
+        load_providers()
+    if not _weights:
+        return settings.PAYMENT_PROVIDER
+    point = int(md5(key.encode('utf-8')).hexdigest()[:8], 16) % sum(
+        weight for name, weight in _weights)
+    for name, weight in _weights:
+        if point < weight:
+            return name
+        point -= weight
+
+
+@receiver(setting_changed)
+def reset_providers(setting, **kwargs):
+    if setting in ('PAYMENT_PROVIDERS', 'PAYMENT_PROVIDER'):
+        _providers.clear()
+        _weights[:] = []
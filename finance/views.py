@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 
+from .models import Payment
 from .utils import get_provider
 
 
@@ -10,17 +12,27 @@ def index(request):
 
 @csrf_exempt
 def start(request):
-    provider = get_provider()
+    name = Payment.objects.filter(
+        invoice_id=request.GET.get('order_id')).values_list(
+            'provider', flat=True).first()
+    provider = get_provider(name)
     return provider.handle_start(request)
 
 
+def _callback(request, name, handler):
+    name = name or settings.PAYMENT_PROVIDER
+    provider = get_provider(name)
+    if settings.PAYMENT_CALLBACK_INBOX and \
+            hasattr(provider, 'queue_callback'):
+        return provider.queue_callback(request, name)
+    return getattr(provider, handler)(request)
+
+
 @csrf_exempt
-def success(request):
-    provider = get_provider()
-    return provider.handle_success(request)
+def success(request, provider=None):
+    return _callback(request, provider, 'handle_success')
 
 
 @csrf_exempt
-def cancel(request):
-    provider = get_provider()
-    return provider.handle_cancel(request)
+def cancel(request, provider=None):
+    return _callback(request, provider, 'handle_cancel')
@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# A starting point, not a tuned value: measure on the deployment hardware
+# (see the README). Requests spend much of their time waiting on the
+# database, SMS, email and payment gateways, so each worker process runs a
+# few threads.
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth.
+max_requests = 1000
+max_requests_jitter = 100
+
+preload_app = True
+accesslog = '-'
@@ -1,8 +1,8 @@
 import json
+from functools import lru_cache
 
 from django.contrib import admin
 from django.conf.urls import url
-from django.core.mail import send_mail
 from django.conf import settings
 from django.db import models
 from django import forms
@@ -16,16 +16,24 @@ from import_export.widgets import JSONWidget
 from finance.models import Payment
 
 from utils import import_path
+from utils.export import PrefetchingResourceMixin
+from utils.paginator import KeysetPaginator
 
 from .models import (Booking, Place, Rate, VehicleCategory, VehicleFeature,
-                     Vehicle, Driver, VehicleRateCategory, BookingVehicle)
+                     Vehicle, Driver, VehicleRateCategory, BookingVehicle,
+                     RevenueRollup)
 from .models import (BOOKING_TYPE_CHOICES_DICT,
                      BOOKING_STATUS_CHOICES_DICT,
-                     BOOKING_PAYMENT_STATUS_CHOICES_DICT)
+                     BOOKING_PAYMENT_STATUS_CHOICES_DICT,
+                     BOOKING_ACCOUNTS_FIELDS)
+from .notification import send_mail
+from .routers import ReportingExportMixin, reporting
+from .filters import (CountedChoicesFieldListFilter,
+                      CountedDateFieldListFilter)
 from .views import booking_invoice
 
 
-class BookingResource(resources.ModelResource):
+class BookingResource(PrefetchingResourceMixin, resources.ModelResource):
     booking_type = fields.Field()
     vehicles = fields.Field()
     source = fields.Field()
@@ -60,6 +68,10 @@ class BookingResource(resources.ModelResource):
                         'payments'
                         )
 
+    export_select_related = ('source', 'destination', 'vehicle_type')
+    export_prefetch_related = ('bookingvehicle_set__vehicle',
+                               'bookingvehicle_set__driver', 'payments')
+
     def dehydrate_driver(self, booking):
         return str(booking.driver) if booking.driver else ''
 
@@ -101,7 +113,25 @@ class BookingResource(resources.ModelResource):
 
 
 
-class PaymentInline(GenericTabularInline):
+class SharedChoicesInlineMixin(object):
+    """Inline whose foreign key choices are queried once, when first
+    rendered, and shared by all its forms, instead of once per form, extra
+    form and empty form."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if field is not None:
+            choices = field.choices
+
+            @lru_cache(maxsize=None)
+            def shared_choices():
+                return [choice for choice in choices]
+
+            field.choices = shared_choices
+        return field
+
+
+class PaymentInline(SharedChoicesInlineMixin, GenericTabularInline):
     model = Payment
     extra = 1
     ct_field = 'item_content_type'
@@ -110,8 +140,12 @@ class PaymentInline(GenericTabularInline):
     exclude = ('details', 'accounts_verified', 'accounts_received', 'accounts_due', 'accounts_comment')
     readonly_fields = ['invoice_id', 'created_by', 'last_updated_by']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'created_by', 'last_updated_by')
 
-class BookingVehicleInline(admin.TabularInline):
+
+class BookingVehicleInline(SharedChoicesInlineMixin, admin.TabularInline):
     model = BookingVehicle
     extra = 1
     can_delete = True
@@ -123,22 +157,33 @@ class BookingVehicleInline(admin.TabularInline):
     verbose_name = 'Vehicle'
     verbose_name_plural = 'Vehicles'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'booking', 'vehicle', 'driver')
+
     def save_model(self, request, obj, form, change):
         pass
 
 
 @admin.register(Booking)
-class BookingAdmin(ExportMixin, admin.ModelAdmin):
+class BookingAdmin(ReportingExportMixin, ExportMixin, admin.ModelAdmin):
     list_display = ('booking_id', 'payment_method', 'customer_name', 'customer_mobile',
                     'source', 'destination', 'booking_type',
                     'travel_date', 'travel_time', 'vehicle_type',
                     'vehicle_count', 'vehicles',
                     'status', 'total_fare', 'payment_done', 'payment_status',
                     'payment_due', 'passengers', 'created',)
-    list_filter = ('booking_type', 'status', 'travel_date',
-                   'created', 'payment_status', 'payment_method')
+    list_filter = (('booking_type', CountedChoicesFieldListFilter),
+                   ('status', CountedChoicesFieldListFilter),
+                   ('travel_date', CountedDateFieldListFilter),
+                   ('created', CountedDateFieldListFilter),
+                   ('payment_status', CountedChoicesFieldListFilter),
+                   ('payment_method', CountedChoicesFieldListFilter))
     search_fields = ('booking_id', 'customer_name', 'customer_mobile',
                      'travel_date', 'drivers')
+    ordering = ('-created', '-id')
+    paginator = KeysetPaginator
+    show_full_result_count = False
     readonly_fields = ('total_fare', 'payment_due', 'payment_done',
                        'payment_status', 'revenue',
                        'last_payment_date',)
@@ -176,6 +221,10 @@ class BookingAdmin(ExportMixin, admin.ModelAdmin):
     )
     resource_class = import_path(settings.BOOKING_RESOURCE_CLASS)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            'bookingvehicle_set__driver', 'bookingvehicle_set__vehicle')
+
     def vehicles(self, obj):
         return ', '.join(['{}/{}'.format(i.driver or '-', i.vehicle or '-') for i in obj.bookingvehicle_set.all()] or ['x'])
 
@@ -227,6 +276,7 @@ class BookingAdmin(ExportMixin, admin.ModelAdmin):
 @admin.register(BookingVehicle)
 class BookingVehicle(admin.ModelAdmin):
     search_fields = ('booking__booking_id', 'driver__name', 'vehicle__number')
+    list_select_related = ('booking', 'vehicle', 'driver')
 
 class Account(Booking):
     class Meta:
@@ -247,6 +297,52 @@ class AccountAdmin(admin.ModelAdmin):
                        'payment_due')
     list_filter = ('accounts_verified', 'last_updated', 'created')
     search_fields = ('booking_id',)
+    ordering = ('-created', '-id')
+    paginator = KeysetPaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        if change and form.changed_data and \
+                set(form.changed_data) <= BOOKING_ACCOUNTS_FIELDS:
+            obj.save(update_fields=set(form.changed_data) | {'last_updated'})
+        else:
+            super().save_model(request, obj, form, change)
+
+
+@admin.register(RevenueRollup)
+class RevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'source', 'destination', 'vehicle_type',
+                    'payment_method', 'bookings', 'total_fare',
+                    'payment_done', 'payment_due', 'revenue')
+    list_filter = ('payment_method', 'vehicle_type', 'source', 'destination')
+    list_select_related = ('source', 'destination', 'vehicle_type')
+    date_hierarchy = 'date'
+    ordering = ('-date',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        with reporting():
+            response = super().changelist_view(request, extra_context)
+            try:
+                queryset = response.context_data['cl'].queryset
+            except (AttributeError, KeyError):
+                return response
+            response.context_data['totals'] = queryset.aggregate(
+                bookings=models.Sum('bookings'),
+                total_fare=models.Sum('total_fare'),
+                payment_done=models.Sum('payment_done'),
+                payment_due=models.Sum('payment_due'),
+                revenue=models.Sum('revenue'))
+            # Rendering runs the list queries, so do it here.
+            return response.render()
 
 
 @admin.register(Place)
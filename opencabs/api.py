@@ -0,0 +1,129 @@
+import json
+import secrets
+
+from django.conf import settings
+from django.http import JsonResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, \
+    require_POST
+
+from .forms import booking as booking_form
+from .models import Booking
+from .views import create_booking
+
+
+def _error(status, message, errors=None):
+    body = {'error': message}
+    if errors:
+        body['errors'] = errors
+    return JsonResponse(body, status=status)
+
+
+def _authorized(request):
+    """Whether the request carries one of ``API_TOKENS`` as a bearer
+    token."""
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    # Compare with every token, so the time taken doesn't tell which one
+    # is closest.
+    matches = [secrets.compare_digest(authorization, 'Bearer {}'.format(t))
+               for t in settings.API_TOKENS]
+    return any(matches)
+
+
+def _validate(data):
+    """Validate a booking with the wizard's forms, in the wizard's order.
+
+    Returns the merged cleaned data, or the errors of the first invalid
+    form.
+    """
+    cleaned_data = {}
+    for form_class in (booking_form.BookingTravelForm,
+                       booking_form.BookingVehiclesForm,
+                       booking_form.BookingContactInfoForm,
+                       booking_form.BookingPaymentInfoForm):
+        kwargs = {}
+        if form_class is booking_form.BookingVehiclesForm:
+            kwargs = {k: cleaned_data[k]
+                      for k in ('source', 'destination', 'booking_type')}
+        form = form_class(data=data, **kwargs)
+        if not form.is_valid():
+            return None, form.errors.get_json_data()
+        cleaned_data.update(form.cleaned_data)
+    return cleaned_data, None
+
+
+def _booking_json(booking):
+    return {
+        'booking_id': booking.booking_id,
+        'status': booking.status,
+        'status_display': booking.get_status_display(),
+        'payment_method': booking.payment_method,
+        'payment_status': booking.payment_status,
+        'total_fare': booking.total_fare,
+        'payment_done': booking.payment_done,
+        'payment_due': booking.payment_due,
+        'travel_date': booking.travel_date,
+        'travel_time': booking.travel_time,
+        'last_updated': booking.last_updated,
+    }
+
+
+@csrf_exempt
+@require_POST
+def bookings(request):
+    """Create a booking from a single JSON object with the fields of all
+    the booking wizard steps. Clients authenticate with a bearer token from
+    ``API_TOKENS``."""
+    if not _authorized(request):
+        response = _error(401, 'Authentication required.')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        return _error(400, 'Request body is not valid JSON.')
+    if not isinstance(data, dict):
+        return _error(400, 'Request body must be a JSON object.')
+
+    cleaned_data, errors = _validate(data)
+    if errors:
+        return _error(400, 'Invalid booking.', errors)
+    booking, next_url = create_booking(cleaned_data)
+
+    body = _booking_json(booking)
+    body['fare_details'] = json.loads(booking.fare_details)
+    body['next_url'] = request.build_absolute_uri(next_url)
+    response = JsonResponse(body, status=201)
+    response['Location'] = request.build_absolute_uri(
+        reverse('api_booking', args=[booking.booking_id]))
+    return response
+
+
+def _booking_last_updated(request, booking_id):
+    # Shared by both condition functions, so look it up once.
+    if not hasattr(request, '_booking_last_updated'):
+        request._booking_last_updated = Booking.objects.filter(
+            booking_id=booking_id.upper()).values_list(
+                'last_updated', flat=True).first()
+    return request._booking_last_updated
+
+
+def _booking_etag(request, booking_id):
+    last_updated = _booking_last_updated(request, booking_id)
+    if last_updated is None:
+        return None
+    return '{}-{}'.format(booking_id.upper(), last_updated.timestamp())
+
+
+@require_GET
+@condition(etag_func=_booking_etag, last_modified_func=_booking_last_updated)
+def booking(request, booking_id):
+    """Status of a booking, with ETag and Last-Modified for conditional
+    requests."""
+    try:
+        booking = get_object_or_404(Booking, booking_id=booking_id.upper())
+    except Http404:
+        return _error(404, 'No such booking.')
+    return JsonResponse(_booking_json(booking))
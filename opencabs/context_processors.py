@@ -1,4 +1,27 @@
 from django.conf import settings as django_settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+# Settings used by the site templates.
+SITE_SETTINGS = ('PROJECT_NAME', 'PROJECT_HEADER', 'PROJECT_DESCRIPTION',
+                 'HEADER_IMAGE', 'CONTACT_PHONE', 'CONTACT_EMAIL')
+
+_site_settings = {}
+
+
+def get_site_settings():
+    if not _site_settings:
+        _site_settings.update({name: getattr(django_settings, name, '')
+                               for name in SITE_SETTINGS})
+    return _site_settings
+
+
+@receiver(setting_changed)
+def reset_site_settings(setting, **kwargs):
+    if setting in SITE_SETTINGS:
+        _site_settings.clear()
+
 
 def settings(request):
-    return {'settings': django_settings}
+    return {'settings': get_site_settings()}
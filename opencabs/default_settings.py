@@ -86,7 +86,6 @@ INSTALLED_APPS = [
 
     'logentry_admin',
 
-    'debug_toolbar',
     'formtools',
     'import_export',
     'djmoney',
@@ -100,16 +99,21 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'utils.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.contrib.flatpages.middleware.FlatpageFallbackMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'opencabs.flatpages.FlatpageFallbackMiddleware',
+    'utils.metrics.MetricsMiddleware',
 ]
 
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'opencabs.urls'
 
 TEMPLATES = [
@@ -143,6 +147,21 @@ DATABASES = {
 }
 
 
+# Exports and reports read from this database alias when it is configured,
+# and from the primary otherwise.
+REPORTING_DB_ALIAS = os.environ.get('REPORTING_DB_ALIAS', 'replica')
+
+DATABASE_ROUTERS = ['opencabs.routers.ReportingRouter']
+
+# Check that persistent (CONN_MAX_AGE) connections are still usable at the
+# start of each request, instead of failing the request's first query.
+# Connections opened or checked less than DB_HEALTH_CHECK_AGE seconds ago
+# are trusted without a check.
+DB_HEALTH_CHECKS = os.environ.get(
+    'DB_HEALTH_CHECKS', 'True').lower() == 'true'
+DB_HEALTH_CHECK_AGE = float(os.environ.get('DB_HEALTH_CHECK_AGE', '30'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -186,6 +205,9 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static')]
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Runs the tests with plain static files storage, without collectstatic.
+TEST_RUNNER = 'utils.test_runner.TestRunner'
+
 MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 MEDIA_URL = '/media/'
 
@@ -274,8 +296,78 @@ Make cheques payable to Company Name Ltd.""")
 SEND_CUSTOMER_SMS = os.environ.get('SEND_CUSTOMER_SMS', 'True').lower() == 'true'
 SEND_DRIVER_SMS = os.environ.get('SEND_DRIVER_SMS', 'True').lower() == 'true'
 
+# Seconds the public booking details page stays cached. Saving a booking
+# replaces its cached page.
+BOOKING_DETAILS_CACHE_TIMEOUT = int(os.environ.get(
+    'BOOKING_DETAILS_CACHE_TIMEOUT', '3600'))
+
+# Seconds each process serves flatpages, and answers unknown URLs, from its
+# own copy before checking whether another process changed them.
+FLATPAGES_CHECK_INTERVAL = float(os.environ.get(
+    'FLATPAGES_CHECK_INTERVAL', '10'))
+
+# Clients of the booking API send one of these, comma separated, as a bearer
+# token to create bookings, which sends SMS and email. Without any, bookings
+# can't be created through the API.
+API_TOKENS = [token for token in os.environ.get(
+    'API_TOKENS', '').split(',') if token]
+
+# Share of requests whose latency and queries are recorded, from 0 (off) to
+# 1. SMS, email, gateway and PDF timings are recorded whenever it's above 0.
+# Processes write their metrics to METRICS_DIR, if set, every
+# METRICS_FLUSH_INTERVAL seconds so metrics/ can report all of them.
+# Scrapers can send METRICS_TOKEN as a bearer token instead of logging in.
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '0'))
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', '10'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Profile a PROFILE_SAMPLE_RATE share of the requests with cProfile, and
+# keep the sampled stacks of requests slower than PROFILE_SLOW_THRESHOLD
+# seconds (0 to turn off). The newest PROFILE_KEEP dumps are kept in
+# PROFILE_DIR and listed at admin/profiles/.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_THRESHOLD = float(os.environ.get('PROFILE_SLOW_THRESHOLD', '0'))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get(
+    'PROFILE_SAMPLE_INTERVAL', '0.005'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/opencabs-profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '200'))
+
+# Queries slower than SLOW_QUERY_THRESHOLD seconds, and query shapes run
+# SLOW_QUERY_REPEAT times or more in one request, are written to
+# SLOW_QUERY_LOG as JSON lines. `manage.py slow_query_report` sums it up.
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '')
+SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', '0.1'))
+SLOW_QUERY_REPEAT = int(os.environ.get('SLOW_QUERY_REPEAT', '10'))
+if SLOW_QUERY_LOG:
+    LOGGING['formatters']['message'] = {'format': '{message}', 'style': '{'}
+    LOGGING['handlers']['slow_queries'] = {
+        'class': 'logging.handlers.WatchedFileHandler',
+        'filename': SLOW_QUERY_LOG,
+        'formatter': 'message',
+    }
+    LOGGING['loggers']['slow_queries'] = {
+        'handlers': ['slow_queries'],
+        'level': 'INFO',
+        'propagate': False,
+    }
+
 PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'ccavenue')
 
+# Store gateway callbacks in an inbox and answer them at once, leaving the
+# payment and booking updates to `manage.py process_gateway_callbacks`.
+PAYMENT_CALLBACK_INBOX = os.environ.get(
+    'PAYMENT_CALLBACK_INBOX', 'False').lower() == 'true'
+PAYMENT_CALLBACK_MAX_ATTEMPTS = int(os.environ.get(
+    'PAYMENT_CALLBACK_MAX_ATTEMPTS', '5'))
+# Seconds before retrying a failed callback, doubled on every attempt.
+PAYMENT_CALLBACK_RETRY_DELAY = int(os.environ.get(
+    'PAYMENT_CALLBACK_RETRY_DELAY', '30'))
+
+# Providers are instantiated once at startup. To split gateway traffic, give
+# providers a 'WEIGHT'; new payments are then spread across the weighted
+# providers by booking. Each provider's callbacks go to
+# payment/success/<name>/ and payment/cancel/<name>/.
 PAYMENT_PROVIDERS = {
     'ccavenue': {
         'CLASS': 'finance.gateways.ccavenue.CCAvenue',
@@ -287,6 +379,10 @@ PAYMENT_PROVIDERS = {
         'REDIRECT_URL': os.environ.get('CCAVENUE_REDIRECT_URL', ''),
         'CANCEL_URL': os.environ.get('CCACENUE_CANCEL_URL', ''),
         'LANGUAGE': os.environ.get('CCAVENUE_LANGUAGE', 'en'),
+        # Order status API, for reconcile_payments. Unset, payments are not
+        # reconciled. The test gateway's is
+        # https://apitest.ccavenue.com/apis/servlet/DoWebTrans.
+        'STATUS_API_URL': os.environ.get('CCAVENUE_STATUS_API_URL', ''),
         'BILLING_DETAILS': {
             'NAME': os.environ.get('CCAVENUE_BILLING_NAME', ''),
             'ADDRESS': os.environ.get('CCAVENUE_BILLING_ADDRESS', ''),
@@ -297,5 +393,32 @@ PAYMENT_PROVIDERS = {
             'TEL': os.environ.get('CCAVENUE_BILLING_TEL', ''),
             'EMAIL': os.environ.get('CCAVENUE_BILLING_EMAIL', ''),
         },
-    }
+    },
 }
+
+# In-process stand-in for CCAvenue, for load testing. Anyone can pay through
+# it, so it is only configured with FAKE_GATEWAY=True; then set
+# PAYMENT_PROVIDER=fake to use it.
+FAKE_GATEWAY = os.environ.get('FAKE_GATEWAY', 'False').lower() == 'true'
+if FAKE_GATEWAY:
+    PAYMENT_PROVIDERS['fake'] = {
+        'CLASS': 'finance.gateways.fake.FakeGateway',
+        'PROJECT_NAME': PROJECT_NAME,
+        'GATEWAY_BASE_URL': '',
+        'MERCHANT_ID': 'fake',
+        'ACCESS_CODE': 'fake',
+        'WORKING_KEY': os.environ.get('FAKE_GATEWAY_WORKING_KEY', 'fake'),
+        'REDIRECT_URL': '',
+        'CANCEL_URL': '',
+        'LANGUAGE': 'en',
+        'BILLING_DETAILS': {
+            'NAME': '', 'ADDRESS': '', 'CITY': '', 'STATE': '', 'ZIP': '',
+            'COUNTRY': '', 'TEL': '', 'EMAIL': '',
+        },
+        'LATENCY': float(os.environ.get('FAKE_GATEWAY_LATENCY', 0)),
+        'FAILURE_RATE': float(os.environ.get(
+            'FAKE_GATEWAY_FAILURE_RATE', 0)),
+        'ABORT_RATE': float(os.environ.get('FAKE_GATEWAY_ABORT_RATE', 0)),
+        'DUPLICATE_RATE': float(os.environ.get(
+            'FAKE_GATEWAY_DUPLICATE_RATE', 0)),
+    }
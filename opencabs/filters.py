@@ -0,0 +1,162 @@
+import hashlib
+from abc import ABCMeta, abstractmethod
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import FieldError
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import CacheVersion
+
+
+FACET_CACHE_TIMEOUT = 60 * 60
+
+
+def _version_name(model):
+    return 'facets:{}'.format(model._meta.label_lower)
+
+
+def facet_version(model):
+    return CacheVersion.get(_version_name(model))
+
+
+def invalidate_facets(model):
+    """Drop every cached facet count for ``model``, in every process, once
+    the current transaction commits.
+
+    Bumping the version locks its row, so it is left out of the
+    transaction, for concurrent bookings not to queue up behind it.
+    """
+    transaction.on_commit(lambda: CacheVersion.bump(_version_name(model)))
+
+
+class FacetCountsMixin(metaclass=ABCMeta):
+    """Show the number of matching rows next to each filter choice.
+
+    Counts honour the other active filters and the search, are computed
+    with a single grouped query and are cached until ``invalidate_facets`` is called for
+    the model. Subclasses compute the counts in ``compute_counts``.
+    """
+
+    def __init__(self, field, request, params, model, model_admin,
+                 field_path):
+        self.facet_model = model
+        # One version read for all the filters of a changelist.
+        versions = request.__dict__.setdefault('_facet_versions', {})
+        if model not in versions:
+            versions[model] = facet_version(model)
+        self.facet_version = versions[model]
+        self.facet_request = request
+        self.facet_admin = model_admin
+        super().__init__(field, request, params, model, model_admin,
+                         field_path)
+
+    def facet_params(self, changelist):
+        own = set(self.expected_parameters())
+        return {k: v for k, v in changelist.get_filters_params().items()
+                if k not in own}
+
+    def facet_cache_key(self, params):
+        digest = hashlib.md5(repr(sorted(params.items())).encode('utf-8'))
+        return 'facets:{}:{}:{}:{}'.format(
+            self.facet_model._meta.label_lower, self.facet_version,
+            self.field_path,
+            digest.hexdigest())
+
+    def facet_counts(self, changelist):
+        params = self.facet_params(changelist)
+        search = getattr(changelist, 'query', '')
+        key = self.facet_cache_key(
+            dict(params, _search=search) if search else params)
+        counts = cache.get(key)
+        if counts is None:
+            queryset = self.facet_model._default_manager.order_by()
+            if search:
+                searched, duplicates = self.facet_admin.get_search_results(
+                    self.facet_request, queryset, search)
+                queryset = queryset.filter(pk__in=searched.values('pk')) \
+                    if duplicates else searched
+            for lookup, value in params.items():
+                try:
+                    queryset = queryset.filter(**{lookup: value})
+                except FieldError:
+                    # Parameters of custom filters aren't field lookups;
+                    # the counts leave those filters out.
+                    continue
+            counts = self.compute_counts(queryset)
+            cache.set(key, counts, FACET_CACHE_TIMEOUT)
+        return counts
+
+    @abstractmethod
+    def compute_counts(self, queryset):
+        """Return the counts for ``queryset``, keyed as ``choices`` reads
+        them."""
+
+    @staticmethod
+    def with_count(title, count):
+        return '{} ({})'.format(title, count or 0)
+
+
+class CountedChoicesFieldListFilter(FacetCountsMixin,
+                                    admin.ChoicesFieldListFilter):
+
+    def compute_counts(self, queryset):
+        return dict(queryset.values_list(self.field_path).annotate(
+            count=Count('pk')))
+
+    def choices(self, changelist):
+        counts = self.facet_counts(changelist)
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': changelist.get_query_string(
+                remove=[self.lookup_kwarg, self.lookup_kwarg_isnull]),
+            'display': self.with_count('All', sum(counts.values())),
+        }
+        none_title = ''
+        for lookup, title in self.field.flatchoices:
+            if lookup is None:
+                none_title = title
+                continue
+            yield {
+                'selected': str(lookup) == self.lookup_val,
+                'query_string': changelist.get_query_string(
+                    {self.lookup_kwarg: lookup}, [self.lookup_kwarg_isnull]),
+                'display': self.with_count(title, counts.get(lookup)),
+            }
+        if none_title:
+            yield {
+                'selected': bool(self.lookup_val_isnull),
+                'query_string': changelist.get_query_string(
+                    {self.lookup_kwarg_isnull: 'True'}, [self.lookup_kwarg]),
+                'display': self.with_count(none_title, counts.get(None)),
+            }
+
+
+class CountedDateFieldListFilter(FacetCountsMixin,
+                                 admin.DateFieldListFilter):
+
+    def facet_params(self, changelist):
+        return {k: v for k, v in changelist.get_filters_params().items()
+                if not k.startswith(self.field_generic)}
+
+    def facet_cache_key(self, params):
+        # The links move with the current date.
+        return super().facet_cache_key(dict(
+            params, _today=self.links[1][1][self.lookup_kwarg_since]))
+
+    def compute_counts(self, queryset):
+        return queryset.aggregate(**{
+            str(index): Count('pk', filter=Q(**param_dict))
+            for index, (title, param_dict) in enumerate(self.links)
+        })
+
+    def choices(self, changelist):
+        counts = self.facet_counts(changelist)
+        for index, (title, param_dict) in enumerate(self.links):
+            yield {
+                'selected': self.date_params == param_dict,
+                'query_string': changelist.get_query_string(
+                    param_dict, [self.field_generic]),
+                'display': self.with_count(title, counts.get(str(index))),
+            }
@@ -0,0 +1,88 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.flatpages.views import render_flatpage
+from django.contrib.sites.shortcuts import get_current_site
+from django.http import Http404, HttpResponsePermanentRedirect
+from django.utils.deprecation import MiddlewareMixin
+
+from .models import CacheVersion
+
+
+VERSION_NAME = 'flatpages'
+
+_pages = {'version': None, 'sites': {}}
+_checked = {'version': None, 'at': None}
+_lock = threading.Lock()
+
+
+def invalidate_flatpages():
+    """Make every process reload its flatpages, this one at once and the
+    others within ``FLATPAGES_CHECK_INTERVAL`` seconds."""
+    CacheVersion.bump(VERSION_NAME)
+    _checked['at'] = None
+
+
+def flatpages_version():
+    """Return the flatpages version, read from the database at most once
+    every ``FLATPAGES_CHECK_INTERVAL`` seconds."""
+    now = time.monotonic()
+    if _checked['at'] is None or \
+            now - _checked['at'] >= settings.FLATPAGES_CHECK_INTERVAL:
+        _checked['version'] = CacheVersion.get(VERSION_NAME)
+        _checked['at'] = now
+    return _checked['version']
+
+
+def get_flatpages(site_id):
+    """Return the flatpages of a site by URL, loaded once per process until
+    flatpages change."""
+    version = flatpages_version()
+    sites = _pages['sites']
+    if _pages['version'] != version or site_id not in sites:
+        with _lock:
+            if _pages['version'] != version:
+                sites = _pages['sites'] = {}
+                _pages['version'] = version
+            if site_id not in sites:
+                sites[site_id] = {
+                    page.url: page
+                    for page in FlatPage.objects.filter(sites=site_id)}
+    return sites[site_id]
+
+
+def flatpage(request, url):
+    """Cached version of ``django.contrib.flatpages.views.flatpage``.
+
+    Unknown URLs are answered from the cached pages too, without a query.
+    """
+    if not url.startswith('/'):
+        url = '/' + url
+    pages = get_flatpages(get_current_site(request).id)
+    page = pages.get(url)
+    if page is None:
+        if not url.endswith('/') and settings.APPEND_SLASH and \
+                url + '/' in pages:
+            return HttpResponsePermanentRedirect('%s/' % request.path)
+        raise Http404
+    # render_flatpage marks the title and content safe in place.
+    return render_flatpage(request, copy.copy(page))
+
+
+class FlatpageFallbackMiddleware(MiddlewareMixin):
+    """``FlatpageFallbackMiddleware`` using the cached flatpages."""
+
+    def process_response(self, request, response):
+        if response.status_code != 404:
+            return response
+        try:
+            return flatpage(request, request.path_info)
+        except Http404:
+            return response
+        except Exception:
+            if settings.DEBUG:
+                raise
+            return response
@@ -1,8 +1,10 @@
 from django import forms
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.urls import reverse
 
 from ..models import Booking, Rate, BOOKING_PAYMENT_METHOD_CHOICES_DICT
+from ..places import get_place_index
 
 
 class BaseBookingForm(forms.ModelForm):
@@ -13,21 +15,50 @@ class BaseBookingForm(forms.ModelForm):
             field.widget.attrs.update({'class': 'form-control'})
 
 
+class PlaceSuggestInput(forms.Widget):
+    """Text box suggesting places from the ``place_suggest`` endpoint as
+    the customer types, instead of a select listing every place. The id of
+    the chosen place goes in a hidden input.
+
+    With a ``data-source`` attribute naming another place input, only
+    places with a route from that place are suggested.
+    """
+    template_name = 'opencabs/widgets/place_suggest.html'
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            pk = None
+        context['widget'].update({
+            'place_name': get_place_index().names.get(pk, '') if pk else '',
+            'suggest_url': reverse('place_suggest'),
+        })
+        return context
+
+    def id_for_label(self, id_):
+        return id_ and id_ + '_name'
+
+
 class BookingTravelForm(BaseBookingForm):
     class Meta:
         model = Booking
         fields = (
             'source', 'destination', 'booking_type',
             'travel_date', 'travel_time', 'passengers')
+        widgets = {
+            'source': PlaceSuggestInput,
+            'destination': PlaceSuggestInput,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['booking_type'].widget = forms.RadioSelect()
         self.fields['booking_type'].widget.choices = self.fields['booking_type'].choices[1:]
         self.fields['booking_type'].widget.attrs = {'class': 'radio-inline'}
-        self.fields['source'].queryset = self.fields['source'].queryset.order_by('name')
-        self.fields['destination'].queryset = self.fields['destination'].queryset.order_by('name')
-
+        self.fields['destination'].widget.attrs['data-source'] = \
+            self.add_prefix('source')
 
 
 class BookingVehiclesForm(BaseBookingForm):
@@ -43,7 +74,10 @@ class BookingVehiclesForm(BaseBookingForm):
         self.fields['vehicle_type'].widget = forms.RadioSelect()
         code = settings.ROUTE_CODE_FUNC(source.name, destination.name)
         choices = []
-        for rate in Rate.objects.filter(code=code):
+        rates = Rate.objects.filter(code=code).select_related(
+            'vehicle_category__category').prefetch_related(
+                'vehicle_category__features')
+        for rate in rates:
             label = render_to_string(
                 'opencabs/partials/vehicle_rate_label.html',
                 context={'rate': rate, 'booking_type': booking_type})
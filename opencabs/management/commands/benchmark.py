@@ -0,0 +1,207 @@
+import json
+import os
+import platform
+import statistics
+import time
+from copy import deepcopy
+
+import django
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_databases, \
+    setup_test_environment, teardown_databases, \
+    teardown_test_environment
+from django.urls import reverse
+
+from finance.gateways.ccavenue.utils import encrypt
+from finance.models import Payment
+from opencabs.models import Booking
+from opencabs.synthetic import seed_dataset
+from utils import import_path
+
+from .checkout_load import wizard_steps
+
+
+WORKING_KEY = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = ('Time the hot paths against a synthetic dataset in a test '
+            'database, and compare wall time and query counts with a '
+            'baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--places', type=int, default=20)
+        parser.add_argument('--bookings', type=int, default=200)
+        parser.add_argument('--payments-per-booking', type=int, default=2)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs of each benchmark, after one '
+                                 'warm-up run.')
+        parser.add_argument('--only', nargs='*',
+                            help='Names, or name prefixes, of benchmarks to '
+                                 'run.')
+        parser.add_argument('--output', help='Write the results to this '
+                                             'JSON file.')
+        parser.add_argument('--baseline', default=os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'baseline.json'))
+        parser.add_argument('--time-tolerance', type=float, default=0.5,
+                            help='Allowed slowdown over the baseline, as a '
+                                 'fraction.')
+        parser.add_argument('--no-compare', action='store_true')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue']['WORKING_KEY'] = WORKING_KEY
+        try:
+            with override_settings(
+                    PAYMENT_PROVIDERS=providers, PAYMENT_PROVIDER='ccavenue',
+                    SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False,
+                    EMAIL_BACKEND='django.core.mail.backends.locmem.'
+                                  'EmailBackend',
+                    CACHES={'default': {
+                        'BACKEND': 'django.core.cache.backends.locmem.'
+                                   'LocMemCache',
+                        'LOCATION': 'benchmark'}}):
+                self.stdout.write('Seeding {places} places, {bookings} '
+                                  'bookings...'.format(**options))
+                self.rates = seed_dataset(
+                    options['places'], options['bookings'],
+                    options['payments_per_booking'])
+                results = self.run_benchmarks(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'dataset': {key: options[key] for key in (
+                'places', 'bookings', 'payments_per_booking')},
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        if options['no_compare'] or not os.path.exists(options['baseline']):
+            self.print_results(results, {})
+            return
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        if baseline['dataset'] != report['dataset']:
+            self.stderr.write('The baseline was recorded with a different '
+                              'dataset: {}'.format(baseline['dataset']))
+        regressions = self.print_results(
+            results, baseline['results'], options['time_tolerance'])
+        if regressions:
+            raise CommandError('Slower than the baseline: {}'.format(
+                ', '.join(regressions)))
+
+    def benchmarks(self):
+        """``(name, setup, run)`` of each benchmark. ``setup`` isn't timed,
+        and its result is passed to ``run``."""
+        user = User.objects.create_superuser('benchmark', '', 'benchmark')
+        client = Client()
+        client.force_login(user)
+        booking = Booking.objects.filter(payments__isnull=False).first()
+
+        def new_payment():
+            # A fresh unpaid booking each time, so every callback confirms
+            # a booking and pays it in full.
+            unpaid = Booking.objects.get(pk=booking.pk)
+            unpaid.pk = None
+            unpaid.save()
+            payment = Payment(item_object=unpaid, amount=unpaid.total_fare,
+                              mode='PG', status='STR', provider='ccavenue')
+            payment.save(update_item=False)
+            return payment
+
+        def callback(payment):
+            return client.post('/payment/success/ccavenue/', {
+                'encResp': encrypt('&'.join([
+                    'order_id={}'.format(payment.invoice_id),
+                    'tracking_id={}'.format(payment.pk),
+                    'bank_ref_no={}'.format(payment.pk),
+                    'order_status=Success',
+                    'amount={}'.format(payment.amount.amount),
+                ]), WORKING_KEY)})
+
+        def wizard():
+            wizard_client = Client()
+            wizard_client.get(reverse('index'))
+            for data in wizard_steps(self.rates[0]):
+                response = wizard_client.post(reverse('index'), data)
+            if response.status_code != 302:
+                raise CommandError('The booking wizard did not complete.')
+
+        def invoice():
+            os.remove(booking.invoice())
+
+        def export():
+            resource = import_path(settings.BOOKING_RESOURCE_CLASS)()
+            resource.export(Booking.objects.all()).csv
+
+        yield 'wizard', None, lambda setup: wizard()
+        yield 'booking_save', None, lambda setup: booking.save()
+        yield 'ccavenue_callback', new_payment, callback
+        yield 'booking_invoice', None, lambda setup: invoice()
+        yield 'booking_export', None, lambda setup: export()
+        for model in admin.site._registry:
+            url = reverse('admin:{}_{}_changelist'.format(
+                model._meta.app_label, model._meta.model_name))
+            yield ('admin:{}.{}'.format(model._meta.app_label,
+                                        model._meta.model_name),
+                   None, lambda setup, url=url: client.get(url))
+
+    def run_benchmarks(self, options):
+        results = {}
+        for name, setup, run in self.benchmarks():
+            if options['only'] and not name.startswith(tuple(
+                    options['only'])):
+                continue
+            times = []
+            for i in range(options['repeat'] + 1):
+                value = setup() if setup else None
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = run(value)
+                    elapsed = time.perf_counter() - start
+                if getattr(response, 'status_code', 200) >= 400:
+                    raise CommandError('{} failed with status {}'.format(
+                        name, response.status_code))
+                if i:  # the first run warms caches up
+                    times.append(elapsed)
+            results[name] = {
+                'queries': len(queries),
+                'time': statistics.median(times),
+                'min': min(times),
+                'max': max(times),
+            }
+        return results
+
+    def print_results(self, results, baseline, tolerance=0):
+        """Print the results next to the baseline's, and return the names
+        of the benchmarks that got slower or make more queries."""
+        regressions = []
+        self.stdout.write('{:<36} {:>8} {:>8} {:>10} {:>10}'.format(
+            'benchmark', 'queries', 'before', 'ms', 'before'))
+        for name, result in sorted(results.items()):
+            base = baseline.get(name)
+            line = '{:<36} {:>8} {:>8} {:>10.1f} {:>10}'.format(
+                name, result['queries'], base['queries'] if base else '-',
+                result['time'] * 1000,
+                '{:.1f}'.format(base['time'] * 1000) if base else '-')
+            if base and (result['queries'] > base['queries'] or
+                         result['time'] > base['time'] * (1 + tolerance)):
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        return regressions
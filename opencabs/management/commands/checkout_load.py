@@ -0,0 +1,105 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urljoin, urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from opencabs.models import Rate
+
+
+def wizard_steps(rate):
+    """POST data of each booking wizard step, for an online payment booking
+    on ``rate``'s route."""
+    steps = [
+        ('itinerary', {
+            'source': rate.source_id,
+            'destination': rate.destination_id,
+            'booking_type': 'OW',
+            'travel_date': (date.today() + timedelta(days=7)).isoformat(),
+            'travel_time': '10:00',
+            'passengers': 1,
+        }),
+        ('vehicles', {'vehicle_type': rate.vehicle_category_id}),
+        ('contactinfo', {
+            'customer_name': 'Load test',
+            'customer_mobile': '9999999999',
+            'customer_email': '',
+            'pickup_point': '',
+            'ssr': '',
+        }),
+        ('paymentinfo', {'payment_method': 'ONL'}),
+    ]
+    for step, fields in steps:
+        data = {'booking_wizard-current_step': step}
+        data.update({'{}-{}'.format(step, k): v for k, v in fields.items()})
+        yield data
+
+
+class Command(BaseCommand):
+    help = ('Drive concurrent checkouts through the booking wizard and the '
+            'payment provider of a running server, and report throughput. '
+            'Start the server with FAKE_GATEWAY=True and '
+            'PAYMENT_PROVIDER=fake to check out without a real gateway. '
+            'SQLite serialises writers, so use PostgreSQL with --concurrency '
+            'above 1.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/',
+                            help='Server to check out against.')
+        parser.add_argument('--checkouts', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds to wait for each response.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        rates = list(Rate.objects.select_related('source', 'destination'))
+        if not rates:
+            raise CommandError('Load some places and rates first.')
+        self.base_url = options['base_url']
+        self.timeout = options['timeout']
+        rng = random.Random(options['seed'])
+        plans = [rng.choice(rates) for i in range(options['checkouts'])]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(self.checkout, plans))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(t for ok, t in results if ok)
+        errors = len(results) - len(timings)
+        self.stdout.write('Checkouts: {}, errors: {}'.format(
+            len(results), errors))
+        self.stdout.write('Elapsed: {:.2f}s, throughput: {:.1f}/s'.format(
+            elapsed, len(results) / elapsed))
+        if timings:
+            self.stdout.write(
+                'Latency p50: {:.0f}ms, p95: {:.0f}ms, max: {:.0f}ms'.format(
+                    1000 * timings[len(timings) // 2],
+                    1000 * timings[int(len(timings) * 0.95)],
+                    1000 * timings[-1]))
+
+    def checkout(self, rate):
+        """Book ``rate``'s route and pay online, following the redirects
+        through the payment provider to the booking details page."""
+        import requests
+        url = urljoin(self.base_url, reverse('index').lstrip('/'))
+        started = time.perf_counter()
+        try:
+            with requests.Session() as session:
+                session.get(url, timeout=self.timeout).raise_for_status()
+                for data in wizard_steps(rate):
+                    data['csrfmiddlewaretoken'] = session.cookies['csrftoken']
+                    response = session.post(url, data, timeout=self.timeout,
+                                            headers={'Referer': url})
+                    response.raise_for_status()
+            ok = urlparse(response.url).path == reverse('booking_details')
+            if not ok:
+                self.stderr.write('Checkout ended on {}'.format(response.url))
+        except (requests.RequestException, KeyError) as e:
+            self.stderr.write('Checkout failed: {!r}'.format(e))
+            ok = False
+        return ok, time.perf_counter() - started
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from opencabs.synthetic import generate_load_data
+
+
+class Command(BaseCommand):
+    help = ('Bulk insert synthetic places, rates, bookings and payments for '
+            'load testing.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--places', type=int, default=100)
+        parser.add_argument('--bookings', type=int, default=10000)
+        parser.add_argument('--payments-per-booking', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['places'] < 2:
+            raise CommandError('At least 2 places are needed for a route.')
+        started = time.perf_counter()
+
+        def progress(done):
+            elapsed = time.perf_counter() - started
+            self.stdout.write('{} bookings in {:.0f}s ({:.0f}/s)'.format(
+                done, elapsed, done / elapsed))
+
+        generate_load_data(
+            options['places'], options['bookings'],
+            options['payments_per_booking'], seed=options['seed'],
+            batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} bookings with {} payments each in {:.0f}s.'.format(
+                options['bookings'], options['payments_per_booking'],
+                time.perf_counter() - started)))
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+SETUP = 'import django; django.setup()'
+
+
+def profile_imports(settings_module):
+    """Import times of a cold ``django.setup()`` in a fresh interpreter.
+
+    Returns ``(module, self_us, cumulative_us)`` tuples in import order.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', SETUP],
+                          env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode:
+        raise CommandError(proc.stderr.strip().splitlines()[-1])
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = line[12:].split('|')
+        if not self_us.strip().isdigit():
+            continue  # the header
+        modules.append((module.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Report the modules costing the most time in django.setup().'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=25,
+                            help='Number of modules to list.')
+        parser.add_argument('--sort', choices=('cumulative', 'self'),
+                            default='cumulative')
+        parser.add_argument('--packages', action='store_true',
+                            help='Sum the time of each top level package.')
+
+    def handle(self, *args, **options):
+        modules = profile_imports(
+            os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+        total = sum(self_us for _, self_us, _ in modules)
+
+        if options['packages']:
+            packages = defaultdict(int)
+            for module, self_us, _ in modules:
+                packages[module.split('.')[0]] += self_us
+            rows = [(package, us, us) for package, us in packages.items()]
+        else:
+            rows = modules
+        column = 1 if options['sort'] == 'self' or options['packages'] else 2
+        rows = sorted(rows, key=lambda row: row[column], reverse=True)
+
+        self.stdout.write('{:>10} {:>10}  {}'.format(
+            'self ms', 'cumul. ms', 'package' if options['packages']
+            else 'module'))
+        for name, self_us, cumulative_us in rows[:options['limit']]:
+            self.stdout.write('{:>10.1f} {:>10.1f}  {}'.format(
+                self_us / 1000, cumulative_us / 1000, name))
+        self.stdout.write('{} modules imported in {:.1f} ms.'.format(
+            len(modules), total / 1000))
@@ -0,0 +1,161 @@
+import re
+import time
+from collections import Counter
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from utils.querylog import read_log
+
+
+PREDICATE_RE = re.compile(
+    r'"(\w+)"\."(\w+)"\s+(=|<=|>=|<|>|IN\b|IS\b|LIKE\b|BETWEEN\b)',
+    re.IGNORECASE)
+ORDER_RE = re.compile(r'"(\w+)"\."(\w+)"')
+WHERE_RE = re.compile(r'\sWHERE\s(.*?)(?:\sORDER BY\s(.*?))?'
+                      r'(?:\sLIMIT\s.*|\sOFFSET\s.*)?$', re.DOTALL)
+# Operators an index can serve as an equality prefix; the others are
+# ranges, and only the first range can use an index.
+EQUALITY = ('=', 'IN', 'IS')
+
+
+def index_columns(shape):
+    """``{table: (columns, equal, required)}`` of the index each table
+    needs for the query ``shape``.
+
+    Columns compared for equality in the ``WHERE`` clause come first, then
+    the first range, or else the ``ORDER BY`` columns of the same table.
+    ``equal`` counts the equality columns, and ``required`` those that
+    filter; an index on these is enough.
+    """
+    match = WHERE_RE.search(shape)
+    if not match:
+        return {}
+    where, order_by = match.groups()
+    equal, ranges = {}, {}
+    for table, column, op in PREDICATE_RE.findall(where):
+        target = equal if op.upper() in EQUALITY else ranges
+        columns = target.setdefault(table, [])
+        if column not in columns:
+            columns.append(column)
+    proposals = {}
+    for table in set(equal) | set(ranges):
+        columns = list(equal.get(table, []))
+        count = len(columns)
+        columns += [c for c in ranges.get(table, [])
+                    if c not in columns][:1]
+        required = len(columns)
+        if required == count and order_by:
+            columns += [c for t, c in ORDER_RE.findall(order_by)
+                        if t == table and c not in columns]
+        proposals[table] = (tuple(columns), count, required)
+    return proposals
+
+
+def is_covered(columns, equal, indexes, unique):
+    """Whether one of ``indexes`` starts with ``columns``, the first
+    ``equal`` of them in any order, or the equality columns include a
+    ``unique`` set."""
+    if any(set(key) <= set(columns[:equal]) for key in unique):
+        return True
+    for index in indexes:
+        if len(index) >= len(columns) and \
+                set(index[:equal]) == set(columns[:equal]) and \
+                tuple(index[equal:len(columns)]) == columns[equal:]:
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = ('Propose indexes for the queries in the slow query log, from '
+            'the columns they filter and sort on.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.SLOW_QUERY_LOG,
+                            help='Log file, SLOW_QUERY_LOG by default.')
+        parser.add_argument('--hours', type=float,
+                            help='Only read the records of the last hours.')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Indexes to propose.')
+
+    def handle(self, *args, **options):
+        if not options['log']:
+            raise CommandError('Set SLOW_QUERY_LOG or pass --log.')
+        since = time.time() - options['hours'] * 3600 \
+            if options['hours'] else None
+        models = {model._meta.db_table: model for model in apps.get_models()
+                  if not model._meta.proxy}
+
+        proposals = {}
+        try:
+            for record in read_log(options['log'], since):
+                for table, (columns, equal, required) in index_columns(
+                        record['shape']).items():
+                    if table not in models:
+                        continue
+                    # Sorting on the primary key comes free with an index.
+                    pk = models[table]._meta.pk.column
+                    columns = columns[:required] + tuple(
+                        c for c in columns[required:] if c != pk)
+                    key = table, columns, equal
+                    proposal = proposals.get(key)
+                    if proposal is None:
+                        proposal = proposals[key] = {
+                            'table': table, 'columns': columns,
+                            'equal': equal, 'required': required,
+                            'alias': record['alias'],
+                            'queries': 0, 'duration': 0, 'max': 0,
+                            'origins': Counter(), 'shape': record['shape']}
+                    proposal['queries'] += record['count']
+                    proposal['duration'] += record['duration']
+                    proposal['max'] = max(proposal['max'],
+                                          record['duration'])
+                    proposal['origins'][record['origin']] += 1
+        except OSError as e:
+            raise CommandError(e)
+
+        indexes = {}
+        proposals = [p for p in proposals.values() if not is_covered(
+            p['columns'][:p['required']], p['equal'],
+            *self.indexes(indexes, p))]
+        proposals.sort(key=lambda p: p['duration'], reverse=True)
+        if not proposals:
+            self.stdout.write('No missing indexes found.')
+        for proposal in proposals[:options['limit']]:
+            self.write_proposal(models[proposal['table']], proposal)
+
+    def indexes(self, cache, proposal):
+        """Columns of the existing indexes of the proposal's table, and of
+        its unique ones."""
+        key = proposal['alias'], proposal['table']
+        if key not in cache:
+            connection = connections[proposal['alias']]
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(
+                    cursor, proposal['table']).values()
+            cache[key] = (
+                [tuple(c['columns']) for c in constraints
+                 if c['index'] or c['unique'] or c['primary_key']],
+                [tuple(c['columns']) for c in constraints
+                 if c['unique'] or c['primary_key']])
+        return cache[key]
+
+    def write_proposal(self, model, proposal):
+        fields = {f.column: f.name for f in model._meta.concrete_fields}
+        names = [fields.get(column, column) for column in proposal['columns']]
+        name = '{}_{}'.format(model._meta.model_name,
+                              '_'.join(names))[:30].rstrip('_')
+        self.stdout.write(self.style.MIGRATE_HEADING('{} ({})'.format(
+            model._meta.label, ', '.join(names))))
+        self.stdout.write(
+            '  {queries} queries, {duration:.3f}s in total, {max:.3f}s '
+            'max'.format(**proposal))
+        for origin, count in proposal['origins'].most_common(3):
+            self.stdout.write('  from {} ({}x)'.format(
+                origin or 'outside project code', count))
+        self.stdout.write('  ' + proposal['shape'])
+        self.stdout.write('  Meta.indexes: models.Index(fields={!r}, '
+                          'name={!r})'.format(names, name))
+        self.stdout.write('')
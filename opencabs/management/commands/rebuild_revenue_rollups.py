@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from opencabs.models import RevenueRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily revenue rollups from all bookings.'
+
+    def handle(self, *args, **options):
+        count = RevenueRollup.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} revenue rollup rows.'.format(count)))
@@ -0,0 +1,78 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.querylog import read_log
+
+
+def summarize(records):
+    """Group log records by kind and query shape."""
+    groups = {}
+    for record in records:
+        group = groups.get((record['kind'], record['fingerprint']))
+        if group is None:
+            group = groups[record['kind'], record['fingerprint']] = {
+                'kind': record['kind'], 'fingerprint': record['fingerprint'],
+                'shape': record['shape'], 'events': 0, 'queries': 0,
+                'duration': 0, 'max': 0, 'origins': Counter(),
+                'paths': Counter()}
+        group['events'] += 1
+        group['queries'] += record['count']
+        group['duration'] += record['duration']
+        group['max'] = max(group['max'], record['duration'])
+        group['origins'][record['origin']] += 1
+        group['paths'][record['path']] += 1
+    return list(groups.values())
+
+
+class Command(BaseCommand):
+    help = ('Summarize the slow query log: the slowest query shapes and the '
+            'ones repeated within requests.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.SLOW_QUERY_LOG,
+                            help='Log file, SLOW_QUERY_LOG by default.')
+        parser.add_argument('--hours', type=float,
+                            help='Only read the records of the last hours.')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Query shapes to list for each kind.')
+
+    def handle(self, *args, **options):
+        if not options['log']:
+            raise CommandError('Set SLOW_QUERY_LOG or pass --log.')
+        since = time.time() - options['hours'] * 3600 \
+            if options['hours'] else None
+        try:
+            groups = summarize(read_log(options['log'], since))
+        except OSError as e:
+            raise CommandError(e)
+
+        self._section(
+            'Slowest queries', options['limit'],
+            [g for g in groups if g['kind'] == 'slow'],
+            '{queries} queries, {duration:.3f}s in total, {max:.3f}s max')
+        self._section(
+            'Queries repeated within requests (N+1)', options['limit'],
+            [g for g in groups if g['kind'] == 'repeated'],
+            '{queries} queries in {events} requests, {duration:.3f}s in '
+            'total, up to {max:.3f}s per request')
+
+    def _section(self, title, limit, groups, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        if not groups:
+            self.stdout.write('  None.')
+        groups.sort(key=lambda g: g['duration'], reverse=True)
+        for group in groups[:limit]:
+            self.stdout.write('')
+            self.stdout.write('  [{}] {}'.format(
+                group['fingerprint'], summary.format(**group)))
+            for origin, count in group['origins'].most_common(3):
+                self.stdout.write('    from {} ({}x)'.format(
+                    origin or 'outside project code', count))
+            for path, count in group['paths'].most_common(3):
+                if path:
+                    self.stdout.write('    on {} ({}x)'.format(path, count))
+            self.stdout.write('    ' + group['shape'])
+        self.stdout.write('')
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.4 on 2026-10-19 16:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opencabs', '0002_auto_20211120_2304'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('payment_method', models.CharField(blank=True, choices=[('POA', 'Pay on arrival'), ('ONL', 'Online'), ('', '')], default='', max_length=3)),
+                ('bookings', models.IntegerField(default=0)),
+                ('total_fare', models.IntegerField(default=0)),
+                ('payment_done', models.IntegerField(default=0)),
+                ('payment_due', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='opencabs.Place')),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='opencabs.Place')),
+                ('vehicle_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='opencabs.VehicleRateCategory')),
+            ],
+            options={
+                'unique_together': {('date', 'source', 'destination', 'vehicle_type', 'payment_method')},
+            },
+        ),
+    ]
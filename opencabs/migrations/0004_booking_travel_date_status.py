@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-19 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opencabs', '0003_revenuerollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['travel_date', 'status'], name='booking_travel_date_status'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-19 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opencabs', '0005_cacheversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cacheversion',
+            name='version',
+            field=models.CharField(default='', max_length=32),
+        ),
+    ]
@@ -1,10 +1,10 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.conf import settings
 from django.urls import reverse
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.fields import GenericRelation
 from django.utils import timezone
-from django.core.mail import send_mail
 
 from finance.models import Payment
 
@@ -16,9 +16,7 @@ from hashlib import md5
 from datetime import datetime
 from collections import OrderedDict
 
-from utils.pdf import draw_pdf
-
-from .notification import send_sms
+from .notification import send_mail, send_sms
 
 
 class VehicleFeature(models.Model):
@@ -199,6 +197,41 @@ BOOKING_PAYMENT_METHOD_CHOICES_DICT = getattr(
 )
 
 
+ROLLUP_KEY_FIELDS = ('travel_date', 'source_id', 'destination_id',
+                     'vehicle_type_id', 'payment_method')
+ROLLUP_VALUE_FIELDS = ('total_fare', 'payment_done', 'payment_due', 'revenue')
+
+BOOKING_ACCOUNTS_FIELDS = frozenset(['accounts_verified', 'last_updated'])
+
+BOOKING_FACET_FIELDS = ('booking_type', 'status', 'travel_date',
+                        'payment_status', 'payment_method')
+
+
+class BookingQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        """Update the bookings, then recompute the revenue rollups they
+        moved out of and into and the facet counts, since ``update()``
+        sends no signals.
+
+        ``bulk_update()`` goes through here too.
+        """
+        if set(kwargs).intersection(BOOKING_FACET_FIELDS):
+            from .filters import invalidate_facets
+            invalidate_facets(Booking)
+        if not set(kwargs).intersection(ROLLUP_KEY_FIELDS +
+                                        ROLLUP_VALUE_FIELDS):
+            return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.values_list('pk', flat=True))
+            keys = RevenueRollup.keys_of(pks)
+            rows = super().update(**kwargs)
+            RevenueRollup.refresh(keys | RevenueRollup.keys_of(pks))
+        return rows
+
+    update.alters_data = True
+
+
 class Booking(models.Model):
     source = models.ForeignKey(Place, on_delete=models.PROTECT,
                                related_name='booking_source')
@@ -256,9 +289,48 @@ class Booking(models.Model):
 
     drivers = models.CharField(max_length=500, default="", blank=True)
 
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Dispatch and reporting filter on both.
+            models.Index(fields=['travel_date', 'status'],
+                         name='booking_travel_date_status'),
+        ]
+
     def __str__(self):
         return self.booking_id
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        deferred = instance.get_deferred_fields()
+        if not deferred.intersection(ROLLUP_KEY_FIELDS + ROLLUP_VALUE_FIELDS):
+            instance._rollup_snapshot = instance.rollup_snapshot()
+        if not deferred.intersection(BOOKING_FACET_FIELDS):
+            instance._facet_values = instance.facet_values()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # The snapshots may predate changes made elsewhere; the pre_save
+        # signal takes them again from the stored row.
+        self.__dict__.pop('_rollup_snapshot', None)
+        self.__dict__.pop('_facet_values', None)
+
+    def facet_values(self):
+        return tuple(getattr(self, field) for field in BOOKING_FACET_FIELDS)
+
+    def rollup_snapshot(self):
+        """Return the (key, values) this booking contributes to the
+        revenue rollups."""
+        key = tuple(getattr(self, field) for field in ROLLUP_KEY_FIELDS)
+        # Truncated like the integer fields store them; fares with taxes
+        # are floats until the booking is reloaded.
+        values = tuple(int(getattr(self, field) or 0)
+                       for field in ROLLUP_VALUE_FIELDS)
+        return key[:-1] + (key[-1] or '',), values
+
     @property
     def booking_type_display(self):
         return BOOKING_TYPE_CHOICES_DICT.get(self.booking_type)
@@ -275,6 +347,11 @@ class Booking(models.Model):
         return reverse("admin:%s_%s_change" % (self._meta.app_label, self._meta.model_name), args=(self.id,))
 
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and \
+                set(update_fields) <= BOOKING_ACCOUNTS_FIELDS:
+            # Accounting flags don't affect fares or payment totals.
+            return super().save(*args, **kwargs)
         if not self.customer_email and not self.customer_mobile:
             raise ValidationError('Either of customer email and mobile is '
                                   'mandatory.')
@@ -283,20 +360,31 @@ class Booking(models.Model):
             rate = self.vehicle_type.rate.get(
                 code=settings.ROUTE_CODE_FUNC(self.source.name,
                                               self.destination.name))
-            fare_details = {
-                'tariff_per_km': self.vehicle_type.tariff_per_km,
-                'after_hour_charges': self.vehicle_type.tariff_after_hours,
-                'price': (rate.oneway_price if self.booking_type == 'OW' else
-                          rate.roundtrip_price),
-                'driver_charge': (rate.oneway_driver_charge
-                                  if self.booking_type == 'OW' else
-                                  rate.roundtrip_driver_charge),
-                'discount': 0,
-                'markup': 0
-            }
+            fare_details = self.initial_fare_details(rate)
         else:
             fare_details = json.loads(self.fare_details)
+        self.update_fare(fare_details)
 
+        self.update_payment_summary()
+
+        super().save(*args, **kwargs)
+
+    def initial_fare_details(self, rate):
+        return {
+            'tariff_per_km': self.vehicle_type.tariff_per_km,
+            'after_hour_charges': self.vehicle_type.tariff_after_hours,
+            'price': (rate.oneway_price if self.booking_type == 'OW' else
+                      rate.roundtrip_price),
+            'driver_charge': (rate.oneway_driver_charge
+                              if self.booking_type == 'OW' else
+                              rate.roundtrip_driver_charge),
+            'discount': 0,
+            'markup': 0
+        }
+
+    def update_fare(self, fare_details):
+        """Apply taxes, discount and markup to ``fare_details`` and set the
+        booking's fare from it."""
         if timezone.now().timestamp() >= datetime.strptime(
                 settings.EXTRA_TAXES_FROM_DATETIME,
                 settings.DATETIME_STR_FORMAT).timestamp():
@@ -316,10 +404,6 @@ class Booking(models.Model):
             round(self.payment_done))
         self.fare_details = json.dumps(fare_details)
 
-        self.update_payment_summary()
-
-        super().save(*args, **kwargs)
-
     def _create_booking_id(self):
         text = '{}-{}-{}-{}-{}-{}-{}-{}'.format(
             self.source, self.destination, self.booking_type,
@@ -329,12 +413,16 @@ class Booking(models.Model):
         return (settings.BOOKING_ID_PREFIX + md5(
             text.encode('utf-8')).hexdigest()[:8]).upper()
 
-    def update_payment_summary(self):
+    def update_payment_summary(self, payments=None):
+        """Set the payment totals from ``payments``, ordered by timestamp,
+        or from the stored payments."""
         payment_done = 0
         expenses = 0
         last_payment_date = None
 
-        for payment in self.payments.all().order_by('timestamp'):
+        if payments is None:
+            payments = self.payments.all().order_by('timestamp')
+        for payment in payments:
             if payment.mode == 'PG' and payment.status != 'SUC':
                 continue
             if payment.type == 1:
@@ -406,6 +494,8 @@ class Booking(models.Model):
         paid = self.payment_done
         due = self.payment_due
         discount = fare_details.get('discount', 0)
+        # ReportLab is only needed here; don't load it with the models.
+        from utils.pdf import draw_pdf
         f = open('/tmp/oc-booking-invoice-{}.pdf'.format(self.booking_id),
                  'wb')
         draw_pdf(f, {'id': self.booking_id,
@@ -471,12 +561,12 @@ class Booking(models.Model):
     def confirm(self):
         self.status = '1'
         self.save()
-        self.send_trip_status_to_customer()
+        transaction.on_commit(self.send_trip_status_to_customer)
 
     def request(self):
         self.status = '0'
         self.save()
-        self.send_trip_status_to_customer()
+        transaction.on_commit(self.send_trip_status_to_customer)
 
     def update_drivers(self):
         drivers = ""
@@ -486,6 +576,182 @@ class Booking(models.Model):
         self.drivers = drivers
         self.save()
 
+
+class RevenueRollup(models.Model):
+    """Daily booking revenue per route, vehicle type and payment method.
+
+    Rows are kept up to date incrementally from booking saves and deletes
+    (see ``opencabs.signals``), and recomputed for the bookings changed by
+    ``Booking.objects.update()`` and ``bulk_update()``. Raw SQL, or
+    ``bulk_create()`` as in ``opencabs.synthetic``, bypass both and need a
+    rebuild: ``manage.py rebuild_revenue_rollups``.
+    """
+    date = models.DateField(db_index=True)
+    source = models.ForeignKey(Place, on_delete=models.CASCADE,
+                               related_name='+')
+    destination = models.ForeignKey(Place, on_delete=models.CASCADE,
+                                    related_name='+')
+    vehicle_type = models.ForeignKey(VehicleRateCategory,
+                                     on_delete=models.CASCADE,
+                                     related_name='+')
+    payment_method = models.CharField(
+        choices=BOOKING_PAYMENT_METHOD_CHOICES_DICT.items(), max_length=3,
+        blank=True, default='')
+
+    bookings = models.IntegerField(default=0)
+    total_fare = models.IntegerField(default=0)
+    payment_done = models.IntegerField(default=0)
+    payment_due = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    last_updated = models.DateTimeField(auto_now=True, blank=True)
+
+    class Meta:
+        unique_together = ('date', 'source', 'destination', 'vehicle_type',
+                           'payment_method')
+
+    def __str__(self):
+        return '{} {}-{}'.format(self.date, self.source, self.destination)
+
+    @classmethod
+    def apply_booking(cls, booking, deleted=False):
+        """Move the booking's contribution from its previous rollup row to
+        its current one."""
+        old = getattr(booking, '_rollup_snapshot', None)
+        new = None if deleted else booking.rollup_snapshot()
+        if old == new:
+            return
+        with transaction.atomic():
+            if old is not None and new is not None and old[0] == new[0]:
+                cls._add(new[0], [n - o for n, o in zip(new[1], old[1])], 0)
+            else:
+                if old is not None:
+                    cls._add(old[0], [-value for value in old[1]], -1)
+                if new is not None:
+                    cls._add(new[0], new[1], 1)
+        booking._rollup_snapshot = new
+
+    @classmethod
+    def _add(cls, key, values, bookings):
+        lookup = dict(zip(('date', 'source_id', 'destination_id',
+                           'vehicle_type_id', 'payment_method'), key))
+        deltas = dict(zip(ROLLUP_VALUE_FIELDS, values), bookings=bookings)
+        updates = {name: F(name) + value for name, value in deltas.items()}
+        if cls.objects.filter(**lookup).update(**updates):
+            if bookings < 0:
+                cls.objects.filter(bookings__lte=0, **lookup).delete()
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(**lookup, **deltas)
+        except IntegrityError:
+            cls.objects.filter(**lookup).update(**updates)
+
+    @classmethod
+    def keys_of(cls, pks):
+        """Rollup keys of the bookings with primary keys ``pks``."""
+        keys = set()
+        for start in range(0, len(pks), 500):
+            for key in Booking.objects.filter(
+                    pk__in=pks[start:start + 500]).values_list(
+                        *ROLLUP_KEY_FIELDS):
+                keys.add(key[:-1] + (key[-1] or '',))
+        return keys
+
+    @classmethod
+    def _totals(cls, bookings):
+        aggregates = {name: models.Sum(name) for name in ROLLUP_VALUE_FIELDS}
+        aggregates['bookings'] = models.Count('id')
+        rows = bookings.order_by().values(
+            *ROLLUP_KEY_FIELDS).annotate(**aggregates)
+        merged = {}
+        for row in rows.iterator():
+            key = tuple(row[field] for field in ROLLUP_KEY_FIELDS)
+            key = key[:-1] + (key[-1] or '',)
+            totals = merged.setdefault(key, dict.fromkeys(aggregates, 0))
+            for name in aggregates:
+                totals[name] += row[name] or 0
+        return merged
+
+    @classmethod
+    def _create(cls, merged):
+        rollups = [
+            cls(date=key[0], source_id=key[1], destination_id=key[2],
+                vehicle_type_id=key[3], payment_method=key[4], **totals)
+            for key, totals in merged.items()
+        ]
+        # Django 3.0 doesn't cap an explicit batch_size at the database's
+        # limit (999 parameters on SQLite), so let it size the batches
+        # within these chunks.
+        for i in range(0, len(rollups), 1000):
+            cls.objects.bulk_create(rollups[i:i + 1000])
+
+    @classmethod
+    def refresh(cls, keys):
+        """Recompute the rollup rows of ``keys`` from the bookings table."""
+        dates = sorted({key[0] for key in keys})
+        merged = {}
+        stale = []
+        for start in range(0, len(dates), 500):
+            chunk = dates[start:start + 500]
+            merged.update(
+                (key, totals) for key, totals in cls._totals(
+                    Booking.objects.filter(travel_date__in=chunk)).items()
+                if key in keys)
+            stale += [
+                row[0] for row in cls.objects.filter(
+                    date__in=chunk).values_list(
+                        'pk', 'date', 'source_id', 'destination_id',
+                        'vehicle_type_id', 'payment_method')
+                if row[1:] in keys]
+        with transaction.atomic():
+            for start in range(0, len(stale), 500):
+                cls.objects.filter(pk__in=stale[start:start + 500]).delete()
+            cls._create(merged)
+        return len(merged)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every rollup row from the bookings table."""
+        merged = cls._totals(Booking.objects.all())
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls._create(merged)
+        return len(merged)
+
+
+class CacheVersion(models.Model):
+    """Version of data that processes cache for themselves, changed when
+    the data changes.
+
+    Kept in the database rather than the cache, so every worker and
+    management command sees a change, whichever cache backend is used.
+    Versions are random rather than counted, so a bump rolled back with
+    its transaction is never taken again for different data.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.CharField(max_length=32, default='')
+
+    def __str__(self):
+        return '{} {}'.format(self.name, self.version)
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.filter(name=name).values_list(
+            'version', flat=True).first() or ''
+
+    @classmethod
+    def bump(cls, name):
+        version = uuid.uuid4().hex
+        if cls.objects.filter(name=name).update(version=version):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, version=version)
+        except IntegrityError:
+            cls.objects.filter(name=name).update(version=version)
+
+
 class BookingVehicle(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE)
     driver_paid = models.BooleanField(default=False)
@@ -1,9 +1,17 @@
-import requests
-
 from django.conf import settings
+from django.core import mail
+
+from utils.metrics import OUTBOUND_SECONDS, timed
+
+
+@timed(OUTBOUND_SECONDS, 'email')
+def send_mail(*args, **kwargs):
+    return mail.send_mail(*args, **kwargs)
 
 
+@timed(OUTBOUND_SECONDS, 'sms')
 def send_sms(mobiles, message):
+    import requests
     resp = requests.get(
         'https://control.msg91.com/api/sendhttp.php',
         params={
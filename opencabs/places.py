@@ -0,0 +1,79 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from .models import CacheVersion, Place, Rate
+
+
+VERSION_NAME = 'places'
+
+
+def places_version():
+    return CacheVersion.get(VERSION_NAME)
+
+
+def invalidate_places():
+    """Make every process rebuild its place index."""
+    CacheVersion.bump(VERSION_NAME)
+
+
+class PlaceIndex(object):
+    """Sorted prefix index of place names, with the routes between places.
+
+    Every word of a place name is indexed, so "del" finds "New Delhi".
+    """
+
+    def __init__(self, places, routes):
+        self.names = dict(places)
+        self.entries = sorted(
+            (word, name.lower(), pk)
+            for pk, name in places
+            for word in self._words(name))
+        self.keys = [entry[0] for entry in self.entries]
+        self.routes = routes
+
+    @staticmethod
+    def _words(name):
+        words = name.lower().split()
+        return {' '.join(words[i:]) for i in range(len(words))} or {''}
+
+    @classmethod
+    def build(cls):
+        routes = defaultdict(set)
+        # Rate codes don't depend on direction, and neither do routes.
+        for source, destination in Rate.objects.values_list(
+                'source_id', 'destination_id').distinct():
+            routes[source].add(destination)
+            routes[destination].add(source)
+        return cls(list(Place.objects.values_list('id', 'name')), routes)
+
+    def search(self, q='', source=None, limit=10):
+        """Return up to ``limit`` ``(id, name)`` pairs, ordered by name, for
+        places with a word starting with ``q``, reachable from ``source``
+        if given."""
+        q = ' '.join(q.lower().split())
+        allowed = self.routes.get(source, set()) if source else None
+        found = set()
+        start = bisect_left(self.keys, q)
+        for word, name, pk in self.entries[start:]:
+            if not word.startswith(q):
+                break
+            if allowed is None or pk in allowed:
+                found.add((name, pk))
+        return [(pk, self.names[pk]) for name, pk in sorted(found)[:limit]]
+
+
+_index = {'version': None, 'index': None}
+_lock = threading.Lock()
+
+
+def get_place_index():
+    """Return this process' place index, rebuilt when places change."""
+    version = places_version()
+    if _index['version'] != version:
+        with _lock:
+            if _index['version'] != version:
+                _index['index'] = PlaceIndex.build()
+                _index['version'] = version
+    return _index['index']
+
@@ -0,0 +1,53 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+_state = threading.local()
+
+
+def reporting_db():
+    """Database alias for reporting reads: the configured replica, or the
+    primary when there is none."""
+    alias = settings.REPORTING_DB_ALIAS
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reporting():
+    """Send the reads made inside the block to the reporting database."""
+    previous = getattr(_state, 'reporting', False)
+    _state.reporting = True
+    try:
+        yield
+    finally:
+        _state.reporting = previous
+
+
+class ReportingRouter(object):
+    """Route reads inside ``reporting()`` to ``REPORTING_DB_ALIAS``."""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'reporting', False):
+            return reporting_db()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db != DEFAULT_DB_ALIAS and db == settings.REPORTING_DB_ALIAS:
+            return False
+        return None
+
+
+class ReportingExportMixin(object):
+    """Admin export mixin reading the exported rows from the reporting
+    database."""
+
+    def get_export_data(self, *args, **kwargs):
+        with reporting():
+            return super().get_export_data(*args, **kwargs)
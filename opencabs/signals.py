@@ -1,13 +1,30 @@
-from django.db.models.signals import post_save, post_delete
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.contrib.flatpages.models import FlatPage
+from django.db.models.signals import pre_save, post_save, post_delete, \
+    m2m_changed
 from django.dispatch import receiver
 
-from finance.models import Payment
+from finance.models import Payment, ACCOUNTS_FIELDS
+from utils import querylog
 
-from .models import BookingVehicle
+from .filters import invalidate_facets
+from .flatpages import invalidate_flatpages
+from .models import Booking, BookingVehicle, Place, Rate, RevenueRollup
+from .places import invalidate_places
 
 
 @receiver([post_save, post_delete], sender=Payment)
-def update_booking_payment_info(sender, instance, **kwargs):
+def update_booking_payment_info(sender, instance, update_fields=None,
+                                **kwargs):
+    if update_fields and update_fields <= ACCOUNTS_FIELDS:
+        return
+    if not getattr(instance, '_update_item', True):
+        return
     if instance.item_content_type.app_label == 'opencabs' and \
             instance.item_content_type.model == 'booking':
         if instance.item_object:
@@ -17,3 +34,99 @@ def update_booking_payment_info(sender, instance, **kwargs):
 @receiver([post_save, post_delete], sender=BookingVehicle)
 def update_booking_drivers(sender, instance, **kwargs):
     instance.booking.update_drivers()
+
+
+@receiver(pre_save, sender=Booking)
+def snapshot_booking(sender, instance, raw=False, **kwargs):
+    # Bookings loaded with deferred fields or built by hand don't carry the
+    # snapshots taken in Booking.from_db, so read the stored row instead.
+    if raw or instance.pk is None or (
+            hasattr(instance, '_rollup_snapshot') and
+            hasattr(instance, '_facet_values')):
+        return
+    stored = Booking.objects.filter(pk=instance.pk).first()
+    instance._rollup_snapshot = stored.rollup_snapshot() if stored else None
+    instance._facet_values = stored.facet_values() if stored else None
+
+
+@receiver(post_save, sender=Booking)
+def update_revenue_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    RevenueRollup.apply_booking(instance)
+
+
+@receiver(post_delete, sender=Booking)
+def remove_revenue_rollup(sender, instance, **kwargs):
+    RevenueRollup.apply_booking(instance, deleted=True)
+
+
+@receiver(post_save, sender=Booking)
+def update_booking_facets(sender, instance, **kwargs):
+    values = instance.facet_values()
+    if getattr(instance, '_facet_values', None) != values:
+        invalidate_facets(Booking)
+    instance._facet_values = values
+
+
+@receiver(post_delete, sender=Booking)
+def remove_booking_facets(sender, instance, **kwargs):
+    invalidate_facets(Booking)
+
+
+@receiver([post_save, post_delete], sender=Place)
+@receiver([post_save, post_delete], sender=Rate)
+def update_places(sender, **kwargs):
+    invalidate_places()
+
+
+@receiver([post_save, post_delete], sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+def update_flatpages(sender, **kwargs):
+    invalidate_flatpages()
+
+
+@receiver(connection_created)
+def mark_connection_checked(sender, connection, **kwargs):
+    connection.health_checked_at = time.monotonic()
+
+
+@receiver(request_started)
+def check_database_connections(**kwargs):
+    """Drop persistent connections that the database has closed, so the
+    request opens a new one. Connections opened or checked within
+    ``DB_HEALTH_CHECK_AGE`` seconds aren't checked again."""
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or \
+                not connection.settings_dict['CONN_MAX_AGE'] or \
+                connection.in_atomic_block:
+            continue
+        checked_at = getattr(connection, 'health_checked_at', None)
+        if checked_at is not None and \
+                now - checked_at < settings.DB_HEALTH_CHECK_AGE:
+            continue
+        if connection.is_usable():
+            connection.health_checked_at = now
+        else:
+            connection.close()
+
+
+@receiver(connection_created)
+def install_query_log(sender, connection, **kwargs):
+    if settings.SLOW_QUERY_LOG:
+        querylog.install(connection)
+
+
+@receiver(request_started)
+def start_query_log(sender, environ=None, **kwargs):
+    if settings.SLOW_QUERY_LOG:
+        querylog.start_request(environ and environ.get('PATH_INFO'))
+
+
+@receiver(request_finished)
+def finish_query_log(sender, **kwargs):
+    if settings.SLOW_QUERY_LOG:
+        querylog.finish_request()
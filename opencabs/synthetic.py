@@ -0,0 +1,238 @@
+"""Synthetic places, rates, bookings and payments, for benchmarks and
+performance tests."""
+import random
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from finance.models import Payment
+
+from .filters import invalidate_facets
+from .models import Booking, Place, Rate, RevenueRollup, VehicleCategory, \
+    VehicleRateCategory
+from .places import invalidate_places
+
+
+# name, tariff per km, after hours tariff
+VEHICLE_TYPES = (('Hatchback', 9, 80), ('Sedan', 11, 100), ('SUV', 14, 150))
+# Most bookings get confirmed; (value, weight)
+BOOKING_STATUSES = (('1', 60), ('0', 20), ('2', 10), ('3', 10))
+PAYMENT_METHODS = (('ONL', 70), ('POA', 30))
+PAYMENT_STATUSES = (('SUC', 80), ('FAL', 12), ('ABT', 8))
+ROUTES_PER_PLACE = 4
+PLACE_NAME = 'Place {:06d}'
+# Generated ids have a Z, which ids made by the models (hex digests) don't.
+BOOKING_ID = '{}Z{:09d}'
+INVOICE_ID = '{}Z{:011d}'
+
+
+def _pick(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def seed_dataset(places=20, bookings=200, payments_per_booking=2, seed=0):
+    """Create a dataset with the models' own ``save``, signals included.
+
+    Places get routes to a few neighbours, and a few routes get most of the
+    bookings. Travel dates spread over a few months around today. Returns
+    the rates created.
+    """
+    rng = random.Random(seed)
+    category, _ = VehicleCategory.objects.get_or_create(name='Car')
+    vehicle_types = [
+        VehicleRateCategory.objects.create(
+            name=name, category=category, tariff_per_km=per_km,
+            tariff_after_hours=after_hours)
+        for name, per_km, after_hours in VEHICLE_TYPES]
+    place_list = [Place.objects.create(name=PLACE_NAME.format(i))
+                  for i in range(places)]
+
+    rates = []
+    for i, source in enumerate(place_list):
+        for destination in place_list[i + 1:i + 1 + ROUTES_PER_PLACE]:
+            distance = rng.randint(20, 400)
+            for vehicle_type in vehicle_types:
+                price = distance * vehicle_type.tariff_per_km
+                rates.append(Rate.objects.create(
+                    source=source, destination=destination,
+                    vehicle_category=vehicle_type, oneway_price=price,
+                    oneway_distance=distance,
+                    oneway_driver_charge=price // 5,
+                    roundtrip_price=price * 2 - price // 4,
+                    roundtrip_distance=distance * 2,
+                    roundtrip_driver_charge=price * 2 // 5))
+    popularity = [rng.paretovariate(1.5) for rate in rates]
+
+    for i in range(bookings):
+        rate = rng.choices(rates, popularity)[0]
+        source, destination = rate.source, rate.destination
+        if rng.random() < 0.5:
+            source, destination = destination, source
+        booking = Booking(
+            source=source, destination=destination,
+            booking_type='OW' if rng.random() < 0.8 else 'RT',
+            travel_date=date.today() + timedelta(days=int(rng.gauss(0, 45))),
+            travel_time=time(rng.randint(5, 22), rng.choice((0, 30))),
+            vehicle_type=rate.vehicle_category,
+            passengers=rng.randint(1, 4),
+            customer_name='Customer {}'.format(i),
+            customer_mobile='9{:09d}'.format(rng.randrange(10 ** 9)),
+            status=_pick(rng, BOOKING_STATUSES),
+            payment_method=_pick(rng, PAYMENT_METHODS))
+        booking.save()
+        for j in range(payments_per_booking):
+            Payment(
+                item_object=booking,
+                amount=int(booking.total_fare / payments_per_booking),
+                mode='PG' if booking.payment_method == 'ONL' else 'CA',
+                status='SUC' if rng.random() < 0.8 else 'FAL',
+                provider='ccavenue' if booking.payment_method == 'ONL'
+                else '',
+                type=1).save()
+    return rates
+
+
+def _next_number(model, field, prefix):
+    last = model.objects.filter(**{
+        field + '__startswith': prefix + 'Z'}).order_by(
+            '-' + field).values_list(field, flat=True).first()
+    return int(last[len(prefix) + 1:]) + 1 if last else 0
+
+
+def _bulk_rates(rng, places):
+    """Create ``places`` places with routes to a few neighbours, without
+    duplicating existing ones, and return all the rates between them."""
+    category, _ = VehicleCategory.objects.get_or_create(name='Car')
+    vehicle_types = []
+    for name, per_km, after_hours in VEHICLE_TYPES:
+        vehicle_types.append(VehicleRateCategory.objects.get_or_create(
+            name=name, defaults={
+                'category': category, 'tariff_per_km': per_km,
+                'tariff_after_hours': after_hours})[0])
+
+    names = [PLACE_NAME.format(i) for i in range(places)]
+    Place.objects.bulk_create([Place(name=name) for name in names],
+                              ignore_conflicts=True)
+    by_name = dict(Place.objects.filter(
+        name__gte=names[0], name__lte=names[-1]).values_list('name', 'id'))
+
+    rates = []
+    for i, source in enumerate(names):
+        for destination in names[i + 1:i + 1 + ROUTES_PER_PLACE]:
+            distance = rng.randint(20, 400)
+            for vehicle_type in vehicle_types:
+                price = distance * vehicle_type.tariff_per_km
+                rates.append(Rate(
+                    source_id=by_name[source],
+                    destination_id=by_name[destination],
+                    vehicle_category=vehicle_type,
+                    code=settings.ROUTE_CODE_FUNC(source, destination),
+                    oneway_price=price, oneway_distance=distance,
+                    oneway_driver_charge=price // 5,
+                    roundtrip_price=price * 2 - price // 4,
+                    roundtrip_distance=distance * 2,
+                    roundtrip_driver_charge=price * 2 // 5))
+    Rate.objects.bulk_create(rates, ignore_conflicts=True)
+    return list(Rate.objects.filter(
+        source__name__gte=names[0], source__name__lte=names[-1]
+    ).select_related('source', 'destination', 'vehicle_category'))
+
+
+def generate_load_data(places, bookings, payments_per_booking, seed=None,
+                       batch_size=5000, progress=None):
+    """Insert a large dataset with ``bulk_create``, in batches.
+
+    No model ``save`` or signal runs: each booking's fare and payment
+    totals are computed in memory with the model's own methods before the
+    batch is inserted, and the revenue rollups and caches are rebuilt once
+    at the end. ``progress`` is called with the number of bookings created
+    so far after each batch.
+    """
+    rng = random.Random(seed)
+    rates = _bulk_rates(rng, places)
+    cum_weights = list(accumulate(rng.paretovariate(1.5) for rate in rates))
+    content_type = ContentType.objects.get_for_model(Booking)
+    booking_number = _next_number(Booking, 'booking_id',
+                                  settings.BOOKING_ID_PREFIX)
+    invoice_number = _next_number(Payment, 'invoice_id',
+                                  settings.INVOICE_ID_PREFIX)
+    today = date.today()
+    # The fare only depends on the rate and the booking type.
+    fares = {}
+
+    for start in range(0, bookings, batch_size):
+        batch, payments = [], []
+        for rate in rng.choices(rates, cum_weights=cum_weights,
+                                k=min(batch_size, bookings - start)):
+            source, destination = rate.source, rate.destination
+            if rng.random() < 0.5:
+                source, destination = destination, source
+            booking = Booking(
+                source=source, destination=destination,
+                booking_type='OW' if rng.random() < 0.8 else 'RT',
+                travel_date=today + timedelta(days=int(rng.gauss(0, 120))),
+                travel_time=time(rng.randint(5, 22), rng.choice((0, 30))),
+                vehicle_type=rate.vehicle_category,
+                passengers=rng.randint(1, 4),
+                customer_name='Customer {}'.format(booking_number),
+                customer_mobile='9{:09d}'.format(rng.randrange(10 ** 9)),
+                status=_pick(rng, BOOKING_STATUSES),
+                payment_method=_pick(rng, PAYMENT_METHODS),
+                booking_id=BOOKING_ID.format(settings.BOOKING_ID_PREFIX,
+                                             booking_number))
+            booking_number += 1
+            fare = fares.get((rate.pk, booking.booking_type))
+            if fare is None:
+                booking.update_fare(booking.initial_fare_details(rate))
+                fare = fares[rate.pk, booking.booking_type] = (
+                    booking.total_fare, booking.fare_details)
+            booking.total_fare, booking.fare_details = fare
+
+            online = booking.payment_method == 'ONL'
+            booked = datetime.combine(
+                booking.travel_date - timedelta(days=rng.randint(1, 30)),
+                booking.travel_time, tzinfo=timezone.utc)
+            booking_payments = []
+            for i in range(payments_per_booking):
+                amount = int(booking.total_fare / payments_per_booking)
+                booking_payments.append(Payment(
+                    item_content_type=content_type, amount=amount,
+                    accounts_due=amount, type=1,
+                    mode='PG' if online else rng.choice(('CA', 'BT')),
+                    status=_pick(rng, PAYMENT_STATUSES) if online else 'SUC',
+                    provider=settings.PAYMENT_PROVIDER if online else '',
+                    timestamp=booked + timedelta(hours=i),
+                    invoice_id=INVOICE_ID.format(settings.INVOICE_ID_PREFIX,
+                                                 invoice_number)))
+                invoice_number += 1
+            booking.update_payment_summary(booking_payments)
+            batch.append(booking)
+            payments.append(booking_payments)
+
+        with transaction.atomic():
+            Booking.objects.bulk_create(batch)
+            if batch[0].pk is None:
+                # Only some databases return the ids of bulk inserted rows.
+                ids = dict(Booking.objects.filter(
+                    booking_id__gte=batch[0].booking_id,
+                    booking_id__lte=batch[-1].booking_id).values_list(
+                        'booking_id', 'id'))
+                for booking in batch:
+                    booking.pk = ids[booking.booking_id]
+            for booking, booking_payments in zip(batch, payments):
+                for payment in booking_payments:
+                    payment.item_object_id = booking.pk
+            Payment.objects.bulk_create(
+                [payment for booking_payments in payments
+                 for payment in booking_payments])
+        if progress:
+            progress(start + len(batch))
+
+    RevenueRollup.rebuild()
+    invalidate_places()
+    invalidate_facets(Booking)
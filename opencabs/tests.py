@@ -0,0 +1,941 @@
+import cProfile
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import date, timedelta
+from itertools import chain
+from unittest import mock
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, reverse
+from import_export.admin import ExportMixin
+
+from finance import urls as finance_urls
+from finance.gateways.ccavenue.utils import encrypt
+from finance.models import Payment
+from utils import metrics, querylog
+from utils.profiling import list_profiles, load_profile, profile_report, \
+    save_profile
+
+from . import flatpages, urls as opencabs_urls
+from .filters import CountedChoicesFieldListFilter
+from .forms.booking import BookingTravelForm
+from .management.commands.checkout_load import wizard_steps
+from .models import Booking, BookingVehicle, CacheVersion, Driver, Place, \
+    Rate, RevenueRollup, Vehicle, VehicleCategory, VehicleRateCategory
+from .places import PlaceIndex, get_place_index
+from .routers import ReportingRouter, reporting, reporting_db
+from .signals import check_database_connections, mark_connection_checked
+from .synthetic import generate_load_data, seed_dataset
+
+
+# Only needed by invoices, SMS and the payment gateway.
+DEFERRED_MODULES = ('reportlab', 'requests', 'Crypto', 'utils.pdf')
+
+WORKING_KEY = 'querycount'
+
+COLD_SETUP = '''
+import json, sys
+import django
+django.setup()
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+class StartupTest(SimpleTestCase):
+    """Cold ``django.setup()`` in a fresh interpreter leaves the heavy
+    modules out. ``manage.py import_profile`` reports where its time goes.
+    """
+
+    def test_heavy_modules_deferred(self):
+        # Inherits DJANGO_SETTINGS_MODULE, which manage.py sets.
+        out = subprocess.check_output([sys.executable, '-c', COLD_SETUP],
+                                      universal_newlines=True)
+        modules = set(json.loads(out.strip().splitlines()[-1]))
+        self.assertEqual(
+            [m for m in DEFERRED_MODULES if m in modules], [])
+
+
+class RevenueRollupTest(TestCase):
+    """Incremental rollups match the ones rebuilt from the bookings."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_dataset(places=6, bookings=20, seed=3)
+
+    def rollups(self):
+        return sorted(RevenueRollup.objects.values_list(
+            'date', 'source_id', 'destination_id', 'vehicle_type_id',
+            'payment_method', 'bookings', 'total_fare', 'payment_done',
+            'payment_due', 'revenue'))
+
+    def assertRollupsRebuilt(self):
+        incremental = self.rollups()
+        RevenueRollup.rebuild()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_rebuild(self):
+        RevenueRollup.objects.all().delete()
+        self.assertEqual(RevenueRollup.rebuild(),
+                         len(RevenueRollup.objects.all()))
+        rollups = RevenueRollup.objects.all()
+        self.assertEqual(sum(r.bookings for r in rollups), 20)
+        self.assertEqual(sum(r.total_fare for r in rollups), sum(
+            Booking.objects.values_list('total_fare', flat=True)))
+
+    def test_apply_booking(self):
+        booking, other = Booking.objects.order_by('pk')[:2]
+        self.assertRollupsRebuilt()
+        # Same rollup row, then a move to another one.
+        booking.payment_method = 'POA'
+        booking.save()
+        self.assertRollupsRebuilt()
+        booking.travel_date += timedelta(days=1)
+        booking.save()
+        self.assertRollupsRebuilt()
+        # Loaded with deferred fields, so without a snapshot.
+        deferred = Booking.objects.only('pk', 'travel_date').get(pk=other.pk)
+        deferred.travel_date += timedelta(days=2)
+        deferred.save()
+        self.assertRollupsRebuilt()
+        Payment.objects.create(item_object=booking, amount=100, type=-1)
+        self.assertRollupsRebuilt()
+        booking.delete()
+        self.assertRollupsRebuilt()
+
+    def test_update(self):
+        bookings = Booking.objects.order_by('pk')[:5]
+        Booking.objects.filter(pk__in=bookings.values('pk')).update(
+            travel_date=date.today() + timedelta(days=400))
+        self.assertRollupsRebuilt()
+        changed = list(bookings)
+        for booking in changed:
+            booking.payment_method = 'POA'
+            booking.revenue += 10
+        Booking.objects.bulk_update(changed, ['payment_method', 'revenue'])
+        self.assertRollupsRebuilt()
+
+
+class FacetCountsTest(TestCase):
+    """Booking admin filters count the bookings behind each choice."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', '', 'admin')
+        seed_dataset(places=4, bookings=12, seed=4)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        cache.clear()
+        # Nothing commits in a TestCase; run the version bumps at once.
+        patcher = mock.patch('opencabs.filters.transaction.on_commit',
+                             side_effect=lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def status_counts(self, **params):
+        response = self.client.get(
+            reverse('admin:opencabs_booking_changelist'), params)
+        spec = next(spec for spec in response.context['cl'].filter_specs
+                    if getattr(spec, 'field_path', None) == 'status')
+        return [choice['display'] for choice in spec.choices(
+            response.context['cl'])]
+
+    def expected(self, bookings):
+        return ['All ({})'.format(bookings.count())] + [
+            '{} ({})'.format(title, bookings.filter(status=value).count())
+            for value, title in Booking._meta.get_field('status').flatchoices]
+
+    def test_counts(self):
+        self.assertEqual(self.status_counts(),
+                         self.expected(Booking.objects.all()))
+        self.assertEqual(
+            self.status_counts(payment_method__exact='ONL'),
+            self.expected(Booking.objects.filter(payment_method='ONL')))
+
+    def test_invalidation(self):
+        counts = self.status_counts()
+        booking = Booking.objects.exclude(status='2').first()
+        # Changed without signals: the cached counts are kept...
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE opencabs_booking SET status = %s '
+                           'WHERE id = %s', ['2', booking.pk])
+        self.assertEqual(self.status_counts(), counts)
+        # ...until any process bumps the version stored in the database.
+        CacheVersion.bump('facets:opencabs.booking')
+        self.assertEqual(self.status_counts(),
+                         self.expected(Booking.objects.all()))
+        booking.refresh_from_db()
+        booking.status = '1'
+        booking.save()
+        self.assertEqual(self.status_counts(),
+                         self.expected(Booking.objects.all()))
+        Booking.objects.filter(pk=booking.pk).update(status='0')
+        self.assertEqual(self.status_counts(),
+                         self.expected(Booking.objects.all()))
+
+    def test_search(self):
+        booking = Booking.objects.order_by('pk').first()
+        self.assertEqual(
+            self.status_counts(q=booking.customer_mobile),
+            self.expected(Booking.objects.filter(
+                customer_mobile=booking.customer_mobile)))
+
+    def test_version_bumped_on_commit(self):
+        version = CacheVersion.get('facets:opencabs.booking')
+        booking = Booking.objects.exclude(status='1').first()
+        booking.status = '1'
+        with mock.patch('opencabs.filters.transaction.on_commit') as \
+                on_commit:
+            booking.save()
+        self.assertEqual(CacheVersion.get('facets:opencabs.booking'),
+                         version)
+        [[bump], kwargs] = on_commit.call_args
+        bump()
+        self.assertNotEqual(CacheVersion.get('facets:opencabs.booking'),
+                            version)
+
+    def test_custom_filter_params(self):
+        request = RequestFactory().get('/')
+        spec = CountedChoicesFieldListFilter(
+            Booking._meta.get_field('status'), request, {}, Booking,
+            admin.site._registry[Booking], 'status')
+        counts = spec.facet_counts(type('ChangeList', (), {
+            'get_filters_params': lambda self: {'custom': '1'}})())
+        self.assertEqual(sum(counts.values()), Booking.objects.count())
+
+
+class PlacesTest(TestCase):
+    """Place suggestions come from a per-process index, rebuilt when any
+    process changes places or rates."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.places = {name: Place.objects.create(name=name) for name in (
+            'New Delhi', 'Delhi Cantonment', 'Dehradun', 'Mumbai')}
+        vehicle_type = VehicleRateCategory.objects.create(
+            name='Sedan', tariff_per_km=10, tariff_after_hours=100,
+            category=VehicleCategory.objects.create(name='Car'))
+        for source, destination in (('New Delhi', 'Dehradun'),
+                                    ('Mumbai', 'Delhi Cantonment')):
+            Rate.objects.create(
+                source=cls.places[source],
+                destination=cls.places[destination],
+                vehicle_category=vehicle_type, oneway_price=1000,
+                oneway_driver_charge=100)
+
+    def suggest(self, **params):
+        response = self.client.get(reverse('place_suggest'), params)
+        return [place['name'] for place in response.json()['results']]
+
+    def test_search(self):
+        index = PlaceIndex.build()
+        names = lambda places: [name for pk, name in places]
+        self.assertEqual(names(index.search('del')),
+                         ['Delhi Cantonment', 'New Delhi'])
+        self.assertEqual(names(index.search(' NEW  del')), ['New Delhi'])
+        self.assertEqual(names(index.search('de', limit=2)),
+                         ['Dehradun', 'Delhi Cantonment'])
+        self.assertEqual(names(index.search('')), sorted(self.places))
+        # Routes go both ways.
+        self.assertEqual(names(index.search(
+            'de', source=self.places['Dehradun'].pk)), ['New Delhi'])
+        self.assertEqual(names(index.search(
+            '', source=self.places['Delhi Cantonment'].pk)), ['Mumbai'])
+
+    def test_suggest(self):
+        self.assertEqual(self.suggest(q='del'),
+                         ['Delhi Cantonment', 'New Delhi'])
+        self.assertEqual(self.suggest(q='d', source=self.places['Mumbai'].pk),
+                         ['Delhi Cantonment'])
+        self.assertEqual(self.suggest(limit=1), ['Dehradun'])
+        response = self.client.get(reverse('place_suggest'), {'source': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_kept_until_places_change(self):
+        self.suggest()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.suggest(q='mum'), ['Mumbai'])
+        Place.objects.create(name='Mumbai Airport')
+        self.assertEqual(self.suggest(q='mum'), ['Mumbai', 'Mumbai Airport'])
+        Rate.objects.get(source=self.places['Mumbai']).delete()
+        self.assertEqual(
+            self.suggest(q='', source=self.places['Mumbai'].pk), [])
+
+    def test_booking_form(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'data-place-suggest="{}"'.format(
+            reverse('place_suggest')), count=2)
+        self.assertContains(response, 'data-source="itinerary-source"')
+        # Places are suggested as the customer types, not listed.
+        self.assertNotContains(response, 'Mumbai')
+
+        form = BookingTravelForm(data={
+            'source': self.places['Mumbai'].pk, 'destination': 'x'})
+        self.assertIn('destination', form.errors)
+        self.assertInHTML(
+            '<input type="hidden" name="source" id="id_source" value="{}">'
+            .format(self.places['Mumbai'].pk), str(form['source']))
+        self.assertIn('value="Mumbai"', str(form['source']))
+        self.assertIn('value=""', str(form['destination']))
+
+    def test_changes_from_another_process(self):
+        index = get_place_index()
+        # Written without signals, as another process' bump is invisible
+        # to this one's cache.
+        Place.objects.filter(pk=self.places['Mumbai'].pk).update(
+            name='Bombay')
+        self.assertIs(get_place_index(), index)
+        CacheVersion.bump('places')
+        self.assertEqual(self.suggest(q='bom'), ['Bombay'])
+
+
+class FlatpagesTest(TestCase):
+    """Flatpages are loaded once per process, until any process changes
+    them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.page = FlatPage.objects.create(
+            url='/terms/', title='Terms', content='Terms of service')
+        cls.page.sites.add(settings.SITE_ID)
+
+    def setUp(self):
+        patcher = mock.patch.dict(flatpages._checked, at=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_served_from_process_cache(self):
+        self.assertContains(self.client.get('/terms/'), 'Terms of service')
+        # Not even the version is read, for pages or unknown URLs.
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get('/terms/'),
+                                'Terms of service')
+            self.assertEqual(self.client.get('/missing/').status_code, 404)
+
+    def test_changes(self):
+        self.client.get('/terms/')
+        self.page.content = 'New terms'
+        self.page.save()
+        self.assertContains(self.client.get('/terms/'), 'New terms')
+        self.page.sites.clear()
+        self.assertEqual(self.client.get('/terms/').status_code, 404)
+
+    def test_changes_from_another_process(self):
+        self.client.get('/terms/')
+        # Written without signals, as another process' bump is invisible
+        # to this one's cache.
+        FlatPage.objects.filter(pk=self.page.pk).update(content='Updated')
+        CacheVersion.bump('flatpages')
+        self.assertContains(self.client.get('/terms/'), 'Terms of service')
+        later = time.monotonic() + settings.FLATPAGES_CHECK_INTERVAL
+        with mock.patch('opencabs.flatpages.time.monotonic',
+                        return_value=later):
+            self.assertContains(self.client.get('/terms/'), 'Updated')
+
+
+class BookingWizardTest(TestCase):
+    """The booking wizard keeps its state in the database, for any worker
+    process to pick up."""
+
+    @classmethod
+    def setUpTestData(cls):
+        vehicle_type = VehicleRateCategory.objects.create(
+            name='Sedan', tariff_per_km=10, tariff_after_hours=100,
+            category=VehicleCategory.objects.create(name='Car'))
+        cls.rate = Rate.objects.create(
+            source=Place.objects.create(name='Pune'),
+            destination=Place.objects.create(name='Goa'),
+            vehicle_category=vehicle_type, oneway_price=1000,
+            oneway_driver_charge=100)
+
+    def setUp(self):
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue']['WORKING_KEY'] = WORKING_KEY
+        override = override_settings(
+            PAYMENT_PROVIDERS=providers, PAYMENT_PROVIDER='ccavenue',
+            SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_steps_served_by_other_workers(self):
+        self.client.get(reverse('index'))
+        self.assertFalse(Session.objects.exists())
+        for data in wizard_steps(self.rate):
+            # A worker with its own, empty, cache and the same session
+            # cookie.
+            cache.clear()
+            client = Client()
+            client.cookies = self.client.cookies
+            response = client.post(reverse('index'), data)
+            if 'paymentinfo-payment_method' not in data:
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.context['form'].errors)
+
+        booking = Booking.objects.get()
+        self.assertEqual((booking.source, booking.destination),
+                         (self.rate.source, self.rate.destination))
+        self.assertRedirects(
+            response, reverse('payment_start') + '?order_id=' +
+            booking.payments.get().invoice_id, fetch_redirect_response=False)
+        self.assertEqual(set(self.client.cookies),
+                         {settings.CSRF_COOKIE_NAME,
+                          settings.SESSION_COOKIE_NAME})
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_steps_validated_once(self):
+        steps = list(wizard_steps(self.rate))
+        self.client.post(reverse('index'), steps[0])
+        with mock.patch.object(BookingTravelForm, 'full_clean',
+                               side_effect=AssertionError):
+            for data in steps[1:]:
+                response = self.client.post(reverse('index'), data)
+        booking = Booking.objects.get()
+        self.assertEqual((booking.source, booking.destination),
+                         (self.rate.source, self.rate.destination))
+        self.assertEqual(response.status_code, 302)
+
+
+class BookingApiTest(TestCase):
+    """Only clients with an API token can create bookings."""
+
+    @classmethod
+    def setUpTestData(cls):
+        vehicle_type = VehicleRateCategory.objects.create(
+            name='Sedan', tariff_per_km=10, tariff_after_hours=100,
+            category=VehicleCategory.objects.create(name='Car'))
+        rate = Rate.objects.create(
+            source=Place.objects.create(name='Pune'),
+            destination=Place.objects.create(name='Goa'),
+            vehicle_category=vehicle_type, oneway_price=1000,
+            oneway_driver_charge=100)
+        cls.booking = {
+            'source': rate.source_id, 'destination': rate.destination_id,
+            'booking_type': 'OW',
+            'travel_date': (date.today() + timedelta(days=7)).isoformat(),
+            'travel_time': '10:00', 'passengers': 1,
+            'vehicle_type': rate.vehicle_category_id,
+            'customer_name': 'API', 'customer_mobile': '9999999999',
+            'payment_method': 'POA'}
+
+    def post(self, token=None):
+        kwargs = {'HTTP_AUTHORIZATION': 'Bearer ' + token} if token else {}
+        return self.client.post(reverse('api_bookings'),
+                                json.dumps(self.booking),
+                                content_type='application/json', **kwargs)
+
+    @override_settings(API_TOKENS=['first', 'second'],
+                       SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False)
+    def test_token_required(self):
+        for token in (None, 'wrong', 'firs'):
+            response = self.post(token)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        self.assertFalse(Booking.objects.exists())
+
+        response = self.post('second')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Booking.objects.get().booking_id,
+                         response.json()['booking_id'])
+
+    @override_settings(API_TOKENS=[])
+    def test_disabled_without_tokens(self):
+        self.assertEqual(self.post('').status_code, 401)
+        self.assertEqual(self.post('anything').status_code, 401)
+
+
+class ReportingRouterTest(TestCase):
+    """Reads inside ``reporting()`` go to a second SQLite database, a copy
+    of the test database standing in for a replica."""
+    databases = {'default', settings.REPORTING_DB_ALIAS}
+
+    @classmethod
+    def setUpClass(cls):
+        alias = settings.REPORTING_DB_ALIAS
+        cls.replica_dir = tempfile.mkdtemp()
+        name = os.path.join(cls.replica_dir, 'replica.sqlite3')
+        connection.ensure_connection()
+        replica = sqlite3.connect(name)
+        connection.connection.backup(replica)
+        replica.close()
+        connections.databases[alias] = dict(
+            connection.settings_dict, NAME=name, TEST={'NAME': name})
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        alias = settings.REPORTING_DB_ALIAS
+        connections[alias].close()
+        del connections.databases[alias]
+        delattr(connections._connections, alias)
+        shutil.rmtree(cls.replica_dir)
+
+    def test_reads_inside_reporting(self):
+        alias = settings.REPORTING_DB_ALIAS
+        Place.objects.create(name='Primary')
+        Place.objects.using(alias).create(name='Replica')
+        names = lambda: list(Place.objects.values_list('name', flat=True))
+
+        self.assertEqual(reporting_db(), alias)
+        self.assertEqual(names(), ['Primary'])
+        with reporting():
+            self.assertEqual(names(), ['Replica'])
+            # Writes still go to the primary.
+            Place.objects.create(name='Written')
+        self.assertEqual(names(), ['Primary', 'Written'])
+        router = ReportingRouter()
+        self.assertIs(router.allow_migrate(alias, 'opencabs'), False)
+        self.assertIsNone(router.allow_migrate('default', 'opencabs'))
+
+    def test_revenue_report(self):
+        alias = settings.REPORTING_DB_ALIAS
+        vehicle_type = VehicleRateCategory.objects.using(alias).create(
+            name='Sedan', tariff_per_km=10, tariff_after_hours=100,
+            category=VehicleCategory.objects.using(alias).create(name='Car'))
+        RevenueRollup.objects.using(alias).create(
+            date=date.today(), vehicle_type=vehicle_type, bookings=1,
+            source=Place.objects.using(alias).create(name='Pune'),
+            destination=Place.objects.using(alias).create(name='Goa'),
+            total_fare=4321, payment_done=4321, revenue=4321)
+        self.client.force_login(User.objects.create_superuser(
+            'admin', '', 'admin'))
+
+        response = self.client.get(reverse(
+            'admin:opencabs_revenuerollup_changelist'))
+
+        self.assertEqual(response.context_data['totals']['total_fare'], 4321)
+        self.assertFalse(RevenueRollup.objects.exists())
+
+    def test_no_replica(self):
+        with override_settings(REPORTING_DB_ALIAS='missing'):
+            self.assertEqual(reporting_db(), 'default')
+
+
+class HealthCheckTest(SimpleTestCase):
+    """Persistent connections are checked once they are
+    ``DB_HEALTH_CHECK_AGE`` seconds past their last check."""
+
+    def test_check_age(self):
+        conn = mock.Mock(settings_dict={'CONN_MAX_AGE': 60},
+                         in_atomic_block=False)
+        conn.is_usable.return_value = True
+        mark_connection_checked(None, conn)
+        handler = mock.Mock(all=lambda: [conn])
+        with mock.patch('opencabs.signals.connections', handler), \
+                override_settings(DB_HEALTH_CHECK_AGE=30), \
+                mock.patch('opencabs.signals.time.monotonic') as monotonic:
+            monotonic.return_value = conn.health_checked_at + 10
+            check_database_connections()
+            conn.is_usable.assert_not_called()
+
+            monotonic.return_value += 30
+            check_database_connections()
+            self.assertEqual(conn.is_usable.call_count, 1)
+            self.assertEqual(conn.health_checked_at, monotonic.return_value)
+            conn.close.assert_not_called()
+
+            monotonic.return_value += 30
+            conn.is_usable.return_value = False
+            check_database_connections()
+            conn.close.assert_called_once_with()
+
+
+def _samples(histogram, *labels):
+    """Number of values observed by ``histogram`` with ``labels``."""
+    return sum(histogram.series.get(labels, [0])[:-1])
+
+
+class MetricsTest(TestCase):
+    """Sampled requests and outbound calls are recorded, and the metrics of
+    every process are reported."""
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        override = override_settings(METRICS_SAMPLE_RATE=1,
+                                     METRICS_DIR=self.metrics_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        process = mock.patch.dict(metrics._process, pid=None)
+        process.start()
+        self.addCleanup(process.stop)
+        self.client.force_login(User.objects.create_superuser(
+            'admin', '', 'admin'))
+
+    def test_request_samples(self):
+        before = (_samples(metrics.REQUEST_SECONDS, 'index', 'GET'),
+                  _samples(metrics.REQUEST_QUERIES, 'index'))
+        self.client.get(reverse('index'))
+        self.assertEqual((_samples(metrics.REQUEST_SECONDS, 'index', 'GET'),
+                          _samples(metrics.REQUEST_QUERIES, 'index')),
+                         (before[0] + 1, before[1] + 1))
+
+        with override_settings(METRICS_SAMPLE_RATE=0):
+            self.client.get(reverse('index'))
+        self.assertEqual(_samples(metrics.REQUEST_SECONDS, 'index', 'GET'),
+                         before[0] + 1)
+
+    def test_outbound_outcomes(self):
+        def fail():
+            raise ValueError
+        fail = metrics.timed(metrics.OUTBOUND_SECONDS, 'test')(fail)
+        with self.assertRaises(ValueError):
+            fail()
+        self.assertEqual(
+            _samples(metrics.OUTBOUND_SECONDS, 'test', 'error'), 1)
+        self.assertEqual(_samples(metrics.OUTBOUND_SECONDS, 'test', 'ok'), 0)
+
+    def test_processes_added_up(self):
+        self.client.get(reverse('index'))
+        count = _samples(metrics.REQUEST_SECONDS, 'index', 'GET')
+        # Another process' file.
+        with open(os.path.join(self.metrics_dir, 'metrics-1-x.json'),
+                  'w') as f:
+            json.dump({metrics.REQUEST_SECONDS.name: [
+                [['index', 'GET'], [2] + [0] * 11 + [0.002]]]}, f)
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertContains(
+            response, 'opencabs_request_duration_seconds_count{view="index",'
+            'method="GET"} %d\n' % (count + 2))
+
+    def test_concurrent_flushes(self):
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: metrics.flush(force=True), range(32)))
+        [path] = os.listdir(self.metrics_dir)
+        with open(os.path.join(self.metrics_dir, path)) as f:
+            self.assertIn(metrics.REQUEST_SECONDS.name, json.load(f))
+
+    def test_write_errors_logged(self):
+        blocker = os.path.join(self.metrics_dir, 'file')
+        open(blocker, 'w').close()
+        with override_settings(METRICS_DIR=os.path.join(blocker, 'metrics')), \
+                self.assertLogs('utils.metrics', 'ERROR'):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ProfilingTest(TestCase):
+    """Sampled requests are profiled, and slow ones keep their stacks."""
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        override = override_settings(PROFILE_DIR=self.profile_dir,
+                                     PROFILE_SAMPLE_RATE=0,
+                                     PROFILE_SLOW_THRESHOLD=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_sampled_requests(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            self.client.get(reverse('index'))
+
+        [info] = list_profiles()
+        self.assertEqual((info['kind'], info['view'], info['status']),
+                         ('profile', 'index', 200))
+        # The booking wizard only starts a session on its first POST.
+        self.assertEqual(info['queries'], 0)
+        self.assertIn('function calls',
+                      profile_report(*load_profile(info['name'])))
+
+    def test_slow_requests(self):
+        with override_settings(PROFILE_SLOW_THRESHOLD=60):
+            self.client.get(reverse('index'))
+        self.assertEqual(list_profiles(), [])
+
+        with override_settings(PROFILE_SLOW_THRESHOLD=1e-6):
+            self.client.get(reverse('index'))
+
+        [info] = list_profiles()
+        self.assertEqual((info['kind'], info['view']), ('slow', 'index'))
+        self.assertTrue(info['dump'].endswith('.folded'))
+        self.assertIn('Hottest stacks:',
+                      profile_report(*load_profile(info['name'])))
+
+    def test_newest_kept(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_KEEP=2):
+            for i in range(3):
+                self.client.get(reverse('index'))
+        self.assertEqual(len(list_profiles()), 2)
+        self.assertEqual(len(os.listdir(self.profile_dir)), 4)
+
+
+class QueryLogTest(TestCase):
+    """Slow queries, and query shapes repeated within a request, are logged
+    with the project code they came from."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.places = [Place.objects.create(name='Place {}'.format(i))
+                      for i in range(3)]
+
+    def setUp(self):
+        querylog.install(connection)
+        self.addCleanup(connection.execute_wrappers.remove,
+                        querylog.log_queries)
+
+    def records(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_query_shape(self):
+        self.assertEqual(
+            querylog.query_shape(
+                "SELECT * FROM t WHERE a = 12 AND b = 'x''y' AND c IN "
+                "(%s, %s, %s)"),
+            'SELECT * FROM t WHERE a = N AND b = %s AND c IN (...)')
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_slow_queries(self):
+        with self.assertLogs('slow_queries', 'INFO') as logs:
+            Place.objects.get(pk=self.places[0].pk)
+
+        [record] = self.records(logs)
+        self.assertEqual((record['kind'], record['count'], record['alias']),
+                         ('slow', 1, 'default'))
+        self.assertIn('"opencabs_place"."id" = %s', record['shape'])
+        self.assertTrue(record['origin'].startswith(
+            'opencabs/tests.py:'), record['origin'])
+        self.assertTrue(record['origin'].endswith('test_slow_queries'))
+
+    @override_settings(SLOW_QUERY_THRESHOLD=60, SLOW_QUERY_REPEAT=3)
+    def test_repeated_queries(self):
+        querylog.start_request('/places/')
+        with self.assertLogs('slow_queries', 'INFO') as logs:
+            for place in self.places:
+                Place.objects.get(pk=place.pk)
+            # Under the repeat threshold.
+            Place.objects.count()
+            Place.objects.count()
+            querylog.finish_request()
+
+        [record] = self.records(logs)
+        self.assertEqual((record['kind'], record['count'], record['path']),
+                         ('repeated', 3, '/places/'))
+        self.assertTrue(record['origin'].endswith('test_repeated_queries'))
+        # Queries outside requests aren't counted.
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('slow_queries', 'INFO'):
+                for place in self.places:
+                    Place.objects.get(pk=place.pk)
+                querylog.finish_request()
+
+
+def _url_patterns(patterns, prefix=''):
+    """``(key, route)`` of each view in ``patterns``, with includes
+    expanded. The key is the URL name, or the view's name."""
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace != admin.site.name:
+                yield from _url_patterns(pattern.url_patterns, route)
+        else:
+            yield pattern.name or pattern.callback.__name__, route
+
+
+class QueryCountTest(TestCase):
+    """Every view of ``opencabs/urls.py`` and ``finance/urls.py`` and every
+    admin page makes a bounded number of queries, however much data there
+    is."""
+
+    # Queries per request, at any data size.
+    DEFAULT_CEILING = 12
+    CEILINGS = {
+        'api_bookings': 22,
+        # The inlines list the payments and vehicles, with shared choices.
+        'admin:opencabs.booking:change': 16,
+        'admin:opencabs.booking:changelist': 14,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', '', 'admin')
+        category, _ = VehicleCategory.objects.get_or_create(name='Car')
+        cls.vehicles = [
+            Vehicle.objects.create(
+                name='Vehicle {}'.format(i), number='KA{:04d}'.format(i),
+                category=category,
+                driver=Driver.objects.create(
+                    name='Driver {}'.format(i),
+                    mobile='8{:09d}'.format(i)))
+            for i in range(3)]
+        FlatPage.objects.create(
+            url='/about/', title='About', content='About us'
+        ).sites.add(settings.SITE_ID)
+        seed_dataset(places=6, bookings=10, seed=1)
+        cls.assign_vehicles()
+
+    @classmethod
+    def assign_vehicles(cls):
+        BookingVehicle.objects.bulk_create([
+            BookingVehicle(booking=booking, vehicle=vehicle,
+                           driver=vehicle.driver)
+            for booking in Booking.objects.filter(bookingvehicle=None)
+            for vehicle in cls.vehicles[:2]])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        providers = deepcopy(settings.PAYMENT_PROVIDERS)
+        providers['ccavenue']['WORKING_KEY'] = WORKING_KEY
+        override = override_settings(
+            PAYMENT_PROVIDERS=providers, PAYMENT_PROVIDER='ccavenue',
+            PAYMENT_CALLBACK_INBOX=False, PROFILE_DIR=self.profile_dir,
+            API_TOKENS=[WORKING_KEY],
+            SEND_CUSTOMER_SMS=False, SEND_DRIVER_SMS=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        profiler = cProfile.Profile()
+        profiler.runcall(sorted, [])
+        save_profile('profile', profiler.dump_stats, {
+            'view': 'index', 'method': 'GET', 'path': '/', 'status': 200,
+            'duration': 1, 'queries': 0, 'query_seconds': 0})
+
+    def view_requests(self):
+        """``(key, method, path, data)`` of a request to each view."""
+        booking = Booking.objects.order_by('pk').first()
+        payment = booking.payments.order_by('pk').first()
+        rate = Rate.objects.order_by('pk').first()
+
+        def callback():
+            # A fresh unpaid booking each time, paid in full.
+            unpaid = Booking.objects.get(pk=booking.pk)
+            unpaid.pk = None
+            unpaid.save()
+            started = Payment(item_object=unpaid, amount=unpaid.total_fare,
+                              mode='PG', status='STR', provider='ccavenue')
+            started.save(update_item=False)
+            return {'encResp': encrypt('&'.join([
+                'order_id={}'.format(started.invoice_id),
+                'tracking_id={}'.format(started.pk),
+                'bank_ref_no={}'.format(started.pk),
+                'order_status=Success',
+                'amount={}'.format(started.amount.amount)]), WORKING_KEY)}
+
+        yield 'index', 'get', reverse('index'), None
+        yield 'place_suggest', 'get', reverse('place_suggest'), {
+            'q': 'Place', 'source': rate.source_id}
+        yield 'booking_details', 'get', reverse('booking_details'), {
+            'bookingid': booking.booking_id, 'orderid': payment.invoice_id}
+        yield 'booking_invoice', 'get', reverse(
+            'booking_invoice', args=[booking.pk]), None
+        yield 'api_bookings', 'post', reverse('api_bookings'), {
+            'source': rate.source_id, 'destination': rate.destination_id,
+            'booking_type': 'OW',
+            'travel_date': (date.today() + timedelta(days=7)).isoformat(),
+            'travel_time': '10:00', 'passengers': 1,
+            'vehicle_type': rate.vehicle_category_id,
+            'customer_name': 'Query count', 'customer_mobile': '9999999999',
+            'payment_method': 'ONL'}
+        yield 'api_booking', 'get', reverse(
+            'api_booking', args=[booking.booking_id]), None
+        yield 'metrics', 'get', reverse('metrics'), None
+        yield 'profiles', 'get', reverse('profiles'), None
+        yield 'profile', 'get', reverse(
+            'profile', args=[list_profiles()[0]['name']]), None
+        yield 'payment_index', 'get', reverse('payment_index'), {
+            'order_id': payment.invoice_id}
+        yield 'payment_start', 'get', reverse('payment_start'), {
+            'order_id': payment.invoice_id}
+        for view in ('success', 'cancel'):
+            for provider in ('', 'ccavenue/'):
+                yield view, 'post', '/payment/{}/{}'.format(
+                    view, provider), callback
+        yield 'flatpage', 'get', '/about/', None
+
+    def grow_first_booking(self):
+        """Move the payments and vehicles of other bookings to the first
+        one, whose pages both runs request."""
+        booking = Booking.objects.order_by('pk').first()
+        others = list(Booking.objects.exclude(pk=booking.pk).order_by(
+            '-pk').values_list('pk', flat=True)[:5])
+        Payment.objects.filter(
+            item_content_type=ContentType.objects.get_for_model(Booking),
+            item_object_id__in=others).update(item_object_id=booking.pk)
+        BookingVehicle.objects.filter(booking__in=others).update(
+            booking=booking)
+
+    def admin_requests(self):
+        for model, model_admin in admin.site._registry.items():
+            info = model._meta.app_label, model._meta.model_name
+            key = 'admin:{}.{}'.format(*info)
+            yield key + ':changelist', 'get', reverse(
+                'admin:{}_{}_changelist'.format(*info)), None
+            if model_admin.has_add_permission(self.request()):
+                yield key + ':add', 'get', reverse(
+                    'admin:{}_{}_add'.format(*info)), None
+            if isinstance(model_admin, ExportMixin):
+                yield key + ':export', 'post', reverse(
+                    'admin:{}_{}_export'.format(*info)), {'file_format': 0}
+            obj = model._default_manager.order_by('pk').first()
+            if obj is not None:
+                yield key + ':change', 'get', reverse(
+                    'admin:{}_{}_change'.format(*info), args=[obj.pk]), None
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return request
+
+    def count_queries(self):
+        counts = {}
+        for key, method, path, data in chain(self.view_requests(),
+                                             self.admin_requests()):
+            if callable(data):
+                data = data()
+            if key == 'api_bookings':
+                kwargs = {'data': json.dumps(data),
+                          'content_type': 'application/json',
+                          'HTTP_AUTHORIZATION': 'Bearer ' + WORKING_KEY}
+            else:
+                kwargs = {'data': data}
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(path, **kwargs)
+            self.assertLess(response.status_code, 400, '{} {}'.format(
+                method.upper(), path))
+            counts[key] = max(counts.get(key, 0), len(queries))
+        return counts
+
+    def test_views_covered(self):
+        keys = {key for key, method, path, data in self.view_requests()}
+        # finance/urls.py is included by opencabs/urls.py, and checked on
+        # its own in case it ever stops being.
+        for urls in (opencabs_urls, finance_urls):
+            with self.subTest(urls.__name__):
+                patterns = list(_url_patterns(urls.urlpatterns))
+                self.assertEqual(
+                    [route for key, route in patterns if key not in keys], [])
+
+    def test_query_counts(self):
+        small = self.count_queries()
+        generate_load_data(places=12, bookings=200, payments_per_booking=3,
+                           seed=2)
+        self.assign_vehicles()
+        self.grow_first_booking()
+        large = self.count_queries()
+        for key in sorted(small):
+            with self.subTest(key):
+                ceiling = self.CEILINGS.get(key, self.DEFAULT_CEILING)
+                self.assertLessEqual(small[key], ceiling)
+                self.assertLessEqual(large[key], small[key])
@@ -16,24 +16,37 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.conf import settings
 from django.contrib import admin
-from django.contrib.flatpages import views as flatpages_views
 from django.conf.urls.static import static
 
-from . import views
+from utils import metrics
+
+from . import api, flatpages, views
 
 urlpatterns = [
     url(r'^' + settings.URL_PREFIX + r'$', views.booking_wizard, name='index'),
+    url(r'^' + settings.URL_PREFIX + r'places/suggest/$', views.place_suggest,
+        name='place_suggest'),
     url(r'^' + settings.URL_PREFIX + r'booking/$', views.booking_details,
         name='booking_details'),
     url(r'^' + settings.URL_PREFIX + 'booking/(?P<booking_id>\d+)/invoice/$',
         views.booking_invoice, name='booking_invoice'),
+    url(r'^' + settings.URL_PREFIX + r'api/v1/bookings/$', api.bookings,
+        name='api_bookings'),
+    url(r'^' + settings.URL_PREFIX + r'api/v1/bookings/(?P<booking_id>\w+)/$',
+        api.booking, name='api_booking'),
+    url(r'^' + settings.URL_PREFIX + r'metrics/$', metrics.metrics,
+        name='metrics'),
     url(r'^' + settings.URL_PREFIX + r'payment/', include('finance.urls')),
+    url(r'^' + settings.URL_PREFIX + r'admin/profiles/$', views.profiles,
+        name='profiles'),
+    url(r'^' + settings.URL_PREFIX + r'admin/profiles/(?P<name>[\w-]+)/$',
+        views.profile, name='profile'),
     url(r'^' + settings.URL_PREFIX + r'admin/', admin.site.urls),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += [
-    url(r'^' + settings.URL_PREFIX + r'(?P<url>.*/)$', flatpages_views.flatpage),
+    url(r'^' + settings.URL_PREFIX + r'(?P<url>.*/)$', flatpages.flatpage),
 ]
 
 if settings.DEBUG:
@@ -1,16 +1,27 @@
+import hashlib
 import os
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
 from django.urls import reverse
-from django.core.mail import send_mail
+from django.core.cache import cache
+from django.contrib import admin
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import HttpResponse
+from django.core.exceptions import ValidationError
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
-from formtools.wizard.views import CookieWizardView
+from formtools.wizard.views import WizardView
+
+from finance.utils import choose_provider
+from utils.profiling import list_profiles, load_profile, profile_report
 
 from .forms import booking as booking_form
 from .models import Booking
+from .notification import send_mail
+from .places import get_place_index
 
 FORMS = [
     ('itinerary', booking_form.BookingTravelForm),
@@ -26,15 +37,83 @@ TEMPLATES = {
     'paymentinfo': 'opencabs/booking_paymentinfo.html',
 }
 
+# Payments whose outcome isn't known yet. The booking details pages showing
+# them aren't cached.
+PENDING_PAYMENT_STATUSES = ('WAT', 'STR')
+
+
+def create_booking(data):
+    """Save a booking from the booking forms' cleaned data.
+
+    Returns the booking and the URL to send the customer to next: the
+    payment gateway for online payments, the booking details otherwise.
+    """
+    booking = Booking(**data)
+    if booking.payment_method == 'ONL':
+        booking.status = '3'
+    booking.save()
 
-class BookingWizard(CookieWizardView):
+    if booking.payment_method == 'ONL':
+        payment = booking.payments.create(
+            amount=booking.total_fare, type=1, mode='PG', status='WAT',
+            provider=choose_provider(booking.booking_id))
+        return booking, reverse('payment_start') + '?order_id=' + payment.invoice_id
+    else:
+        booking.send_booking_request_ack_to_customer()
+        return booking, reverse('booking_details') + '?bookingid=' + booking.booking_id
+
+
+class BookingWizard(WizardView):
 
     form_list = FORMS
+    storage_name = 'opencabs.wizard.BookingStorage'
 
-    def get_context_data(self, form, **kwargs):
-        context_data = super().get_context_data(form, **kwargs)
-        context_data['settings'] = settings
-        return context_data
+    def process_step(self, form):
+        data = super().process_step(form)
+        self.storage.set_cleaned_data(self.steps.current, data,
+                                      form.cleaned_data)
+        return data
+
+    def get_cleaned_data_for_step(self, step):
+        cleaned_data = self.storage.get_cleaned_data(step)
+        if cleaned_data is None:
+            cleaned_data = self.get_validated_data(step)
+        if cleaned_data is None:
+            cleaned_data = super().get_cleaned_data_for_step(step)
+            if cleaned_data is not None:
+                self.storage.set_cleaned_data(
+                    step, self.storage.get_step_data(step), cleaned_data)
+        return cleaned_data
+
+    def get_validated_data(self, step):
+        """Rebuild the cleaned data of an already validated ``step`` from
+        its data and the pks kept, without validating it again."""
+        pks = self.storage.get_validated_pks(step)
+        if pks is None:
+            return None
+        data = self.storage.get_step_data(step)
+        prefix = self.get_form_prefix(step)
+        fields = self.form_list[step].base_fields
+        cleaned_data = {}
+        try:
+            for name, field in fields.items():
+                if name not in pks:
+                    cleaned_data[name] = field.clean(
+                        field.widget.value_from_datadict(
+                            data, {}, '{}-{}'.format(prefix, name)))
+        except ValidationError:
+            return None
+        by_model = {}
+        for name, pk in pks.items():
+            by_model.setdefault(fields[name].queryset.model, {})[name] = pk
+        for model, model_pks in by_model.items():
+            instances = model._default_manager.in_bulk(model_pks.values())
+            for name, pk in model_pks.items():
+                if pk not in instances:
+                    return None
+                cleaned_data[name] = instances[pk]
+        self.storage.set_cleaned_data(step, data, cleaned_data)
+        return cleaned_data
 
     def get_form_kwargs(self, step):
         data = {}
@@ -48,53 +127,102 @@ class BookingWizard(CookieWizardView):
     def get_template_names(self):
         return [TEMPLATES[self.steps.current]]
 
-    def done(self, form_list, form_dict, **kwargs):
-        data = form_dict['itinerary'].cleaned_data
-        data.update(form_dict['vehicles'].cleaned_data)
-        contact_info = form_dict['contactinfo'].cleaned_data
-        data.update(contact_info)
-        payment_info = form_dict['paymentinfo'].cleaned_data
-        data.update(payment_info)
-        booking = Booking(**data)
-        if booking.payment_method == 'ONL':
-            booking.status = '3'
-        booking.save()
-
-        if booking.payment_method == 'ONL':
-            payment = booking.payments.create(
-                amount=booking.total_fare, type=1, mode='PG', status='WAT')
-            return redirect(reverse('payment_start') + '?order_id=' + payment.invoice_id)
-        else:
-            booking.send_booking_request_ack_to_customer()
-            return redirect(
-                reverse('booking_details') + '?bookingid=' + booking.booking_id)
+    def render_done(self, form, **kwargs):
+        """Create the booking from the cleaned data of every step, kept when
+        it was validated, rather than validating all the steps again."""
+        data = {}
+        for step in self.get_form_list():
+            cleaned_data = self.get_cleaned_data_for_step(step)
+            if cleaned_data is None:
+                return self.render_revalidation_failure(
+                    step, self.get_form(
+                        step, data=self.storage.get_step_data(step)),
+                    **kwargs)
+            data.update(cleaned_data)
+        booking, next_url = create_booking(data)
+        self.storage.reset()
+        return redirect(next_url)
 
 booking_wizard = BookingWizard.as_view()
 
 
 def index(request):
     return render(request, 'opencabs/index.html', {
-        'settings': settings,
         'wizard': booking_wizard
     })
 
 
+def place_suggest(request):
+    """Places whose name starts with ``q``; with ``source``, only those
+    reachable from it."""
+    try:
+        source = int(request.GET.get('source') or 0) or None
+        limit = min(int(request.GET.get('limit') or 10), 50)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid source or limit.'}, status=400)
+    places = get_place_index().search(
+        request.GET.get('q', ''), source=source, limit=limit)
+    return JsonResponse({
+        'results': [{'id': pk, 'name': name} for pk, name in places]})
+
+
 def booking_details(request):
+    """Public booking page, cached per booking version and served with an
+    ETag and Last-Modified.
+
+    The version, the booking's ``last_updated``, is read from the database
+    on every request, so changes made by any process show at once. Pages
+    of payments still in progress aren't cached.
+    """
     booking_id = request.GET.get('bookingid', '').upper()
-    booking = get_object_or_404(Booking, booking_id=booking_id)
-    payment_status = ""
     order_id = request.GET.get('orderid', None)
-    if order_id:
-        payment = booking.payments.get(invoice_id=order_id)
-        if payment.status in ['ERR', 'CAN', 'ABT', 'FAL']:
-            payment_status = "failure"
-
-    return render(request, 'opencabs/booking_details.html', {
-        'settings': settings,
-        'booking': booking,
-        'payment_status': payment_status,
-        'order_id': order_id
-    })
+    order_digest = hashlib.md5(
+        (order_id or '').encode('utf-8')).hexdigest()[:12]
+
+    last_updated = Booking.objects.filter(booking_id=booking_id).values_list(
+        'last_updated', flat=True).first()
+    if last_updated is None:
+        raise Http404
+    page_key = 'booking-details:{}:{}:{}'.format(
+        booking_id, last_updated.timestamp(), order_digest)
+    page = cache.get(page_key)
+
+    if page is None:
+        booking = get_object_or_404(
+            Booking.objects.select_related(
+                'source', 'destination', 'vehicle_type'),
+            booking_id=booking_id)
+        payment_status = ""
+        pending = False
+        if order_id:
+            payment = booking.payments.get(invoice_id=order_id)
+            if payment.status in ['ERR', 'CAN', 'ABT', 'FAL']:
+                payment_status = "failure"
+            pending = payment.status in PENDING_PAYMENT_STATUSES
+
+        version = booking.last_updated.timestamp()
+        page = {
+            'content': render_to_string(
+                'opencabs/booking_details.html', {
+                    'booking': booking,
+                    'payment_status': payment_status,
+                    'order_id': order_id
+                }, request),
+            'etag': quote_etag('{}-{}-{}'.format(
+                booking_id, version, order_digest)),
+            'last_modified': int(version),
+        }
+        if not pending:
+            cache.set(page_key, page, settings.BOOKING_DETAILS_CACHE_TIMEOUT)
+
+    response = get_conditional_response(
+        request, etag=page['etag'], last_modified=page['last_modified'])
+    if response is None:
+        response = HttpResponse(page['content'])
+    response['ETag'] = page['etag']
+    response['Last-Modified'] = http_date(page['last_modified'])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 @staff_member_required
@@ -106,3 +234,38 @@ def booking_invoice(request, booking_id):
             content=f.read(), content_type='application/pdf')
         os.remove(f.name)
         return response
+
+
+@staff_member_required
+def profiles(request):
+    """Profiles of sampled and slow requests, slowest first."""
+    profiles = list_profiles()
+    view = request.GET.get('view')
+    if view:
+        profiles = [info for info in profiles if info['view'] == view]
+    return render(request, 'admin/opencabs/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': profiles,
+        'view': view,
+    })
+
+
+@staff_member_required
+def profile(request, name):
+    loaded = load_profile(name)
+    if loaded is None:
+        raise Http404
+    info, path = loaded
+    if 'download' in request.GET:
+        try:
+            return FileResponse(open(path, 'rb'), as_attachment=True,
+                                filename=info['dump'])
+        except OSError:
+            raise Http404
+    return render(request, 'admin/opencabs/profile.html', {
+        **admin.site.each_context(request),
+        'title': 'Profile of {}'.format(info['view']),
+        'info': info,
+        'report': profile_report(info, path),
+    })
@@ -0,0 +1,75 @@
+from django.db import models
+from django.utils.datastructures import MultiValueDict
+
+from formtools.wizard.storage.base import BaseStorage
+from formtools.wizard.storage.session import SessionStorage
+
+
+class BookingStorage(SessionStorage):
+    """Wizard storage keeping the state in the session, in the database, so
+    that every worker process sees it.
+
+    The client only holds the session cookie. Besides the raw data of each
+    step, the pks of the model instances in its cleaned data are kept once
+    it is validated, so later steps get them back without validating it
+    again. The cleaned data itself, model instances included, is only kept
+    for the rest of the request.
+
+    GET requests only start the wizard over, so they keep its state out of
+    the session, and visiting the page doesn't create one. The session is
+    created on the first POST.
+    """
+    validated_key = 'validated'
+
+    def __init__(self, *args, **kwargs):
+        BaseStorage.__init__(self, *args, **kwargs)
+        self.unsaved_data = None
+        self.cleaned_data = {}
+        if self.prefix not in self.request.session:
+            self.init_data()
+
+    def _get_data(self):
+        if self.unsaved_data is not None:
+            return self.unsaved_data
+        return super()._get_data()
+
+    def _set_data(self, value):
+        if self.request.method == 'POST':
+            self.unsaved_data = None
+            super()._set_data(value)
+        else:
+            self.request.session.pop(self.prefix, None)
+            self.unsaved_data = value
+
+    data = property(_get_data, _set_data)
+
+    def init_data(self):
+        super().init_data()
+        self.data[self.validated_key] = {}
+
+    def get_cleaned_data(self, step):
+        """Return the cleaned data kept for the current data of ``step``."""
+        stored = self.cleaned_data.get(step)
+        if stored is None or stored[0] != self.data[
+                self.step_data_key].get(step):
+            return None
+        return stored[1]
+
+    def get_validated_pks(self, step):
+        """Return ``{field: pk}`` of the model instances in the cleaned data
+        of ``step``, if its current data was validated."""
+        validated = self.data.get(self.validated_key, {}).get(step)
+        if validated is None or validated['data'] != self.data[
+                self.step_data_key].get(step):
+            return None
+        return validated['pks']
+
+    def set_cleaned_data(self, step, data, cleaned_data):
+        if isinstance(data, MultiValueDict):
+            data = dict(data.lists())
+        self.cleaned_data[step] = (data, cleaned_data)
+        self.data.setdefault(self.validated_key, {})[step] = {
+            'data': data,
+            'pks': {name: value.pk for name, value in cleaned_data.items()
+                    if isinstance(value, models.Model)},
+        }
@@ -8,10 +8,19 @@ DATABASES = {
         'USER': os.environ.get('DB_USER', 'postgres'),
         'PASSWORD': os.environ.get('DB_PASS', 'postgres'),
         'HOST': 'db',
-        'PORT': 5432
+        'PORT': 5432,
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', '60')),
     }
 }
 
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES[REPORTING_DB_ALIAS] = dict(
+        DATABASES['default'],
+        HOST=os.environ['DB_REPLICA_HOST'],
+        PORT=int(os.environ.get('DB_REPLICA_PORT', '5432')),
+        TEST={'MIRROR': 'default'},
+    )
+
 INVOICE_BUSINESS_NAME = os.environ.get('INVOICE_BUSINESS_NAME', 'Gauranga Travels')
 
 INVOICE_BUSINESS_ADDRESS = """
@@ -0,0 +1,42 @@
+import os
+
+# Read by opencabs.default_settings, which leaves out debug_toolbar unless
+# DEBUG is on.
+os.environ.setdefault('DEBUG', 'false')
+
+from settings_compose import *
+
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'static'))
+
+# gunicorn runs several worker processes, which must share a cache: local
+# memory caches are per process. Memcached (MEMCACHED_LOCATION, e.g.
+# "memcached:11211", as docker-compose.yml sets) or Redis (REDIS_URL, needs
+# django-redis) is used when configured. Without either, the database cache
+# is the fallback: it needs `manage.py createcachetable`, and every cache
+# hit is an SQL query, so sessions, facet counts and the other cached reads
+# still cost a round trip to the database each. CACHE_BACKEND and
+# CACHE_LOCATION name any other backend.
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHE_BACKEND = 'django.core.cache.backends.memcached.MemcachedCache'
+    CACHE_LOCATION = os.environ['MEMCACHED_LOCATION']
+elif os.environ.get('REDIS_URL'):
+    CACHE_BACKEND = 'django_redis.cache.RedisCache'
+    CACHE_LOCATION = os.environ['REDIS_URL']
+else:
+    CACHE_BACKEND = 'django.core.cache.backends.db.DatabaseCache'
+    CACHE_LOCATION = 'django_cache'
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', CACHE_BACKEND),
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_LOCATION),
+    }
+}
@@ -0,0 +1,42 @@
+from itertools import islice
+
+from django.db.models import QuerySet, prefetch_related_objects
+
+
+def iterate_prefetched(queryset, chunk_size=2000):
+    """Iterate over ``queryset`` without caching it, like ``iterator()``,
+    but still running its ``prefetch_related`` lookups, a chunk of rows at
+    a time."""
+    lookups = queryset._prefetch_related_lookups
+    rows = queryset.iterator(chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        prefetch_related_objects(chunk, *lookups)
+        yield from chunk
+
+
+class PrefetchingResourceMixin(object):
+    """``ModelResource`` mixin loading the relations its fields read along
+    with the exported rows, instead of one query per row.
+
+    import-export iterates with ``iterator()``, which skips
+    ``prefetch_related``, so rows are fetched in chunks and prefetched per
+    chunk.
+    """
+    export_select_related = ()
+    export_prefetch_related = ()
+    export_chunk_size = 2000
+
+    def export(self, queryset=None, *args, **kwargs):
+        if queryset is None:
+            queryset = self.get_queryset()
+        if isinstance(queryset, QuerySet):
+            if self.export_select_related:
+                queryset = queryset.select_related(
+                    *self.export_select_related)
+            queryset = iterate_prefetched(
+                queryset.prefetch_related(*self.export_prefetch_related),
+                self.export_chunk_size)
+        return super().export(queryset, *args, **kwargs)
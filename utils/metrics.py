@@ -0,0 +1,283 @@
+"""Latency histograms exposed in the Prometheus text format.
+
+Metrics live in the memory of each process. With ``METRICS_DIR`` set, every
+process also writes its metrics to a file there now and then, and the
+metrics view adds up the files of all processes. Management commands running
+outside the web workers call ``flush()`` themselves.
+"""
+import glob
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+REGISTRY = {}
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Histogram of observed values, by label values."""
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above, sum]
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(series)]
+                    for labels, series in self.series.items()]
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    """Return the histogram registered as ``name``, creating it first."""
+    if name not in REGISTRY:
+        REGISTRY[name] = Histogram(name, documentation, labels, buckets)
+    return REGISTRY[name]
+
+
+REQUEST_SECONDS = histogram(
+    'opencabs_request_duration_seconds', 'Time spent handling requests.',
+    ('view', 'method'))
+REQUEST_QUERIES = histogram(
+    'opencabs_request_db_queries', 'Database queries made per request.',
+    ('view',), QUERY_BUCKETS)
+REQUEST_DB_SECONDS = histogram(
+    'opencabs_request_db_seconds', 'Time spent in database queries per '
+    'request.', ('view',))
+OUTBOUND_SECONDS = histogram(
+    'opencabs_outbound_duration_seconds', 'Time spent calling SMS, email '
+    'and payment gateway services.', ('service', 'outcome'))
+CALLBACK_SECONDS = histogram(
+    'opencabs_payment_callback_duration_seconds', 'Time spent applying '
+    'payment gateway responses to payments and bookings.', ('outcome',))
+PDF_SECONDS = histogram(
+    'opencabs_pdf_render_seconds', 'Time spent drawing PDF documents.',
+    ('document', 'outcome'))
+
+
+def enabled():
+    return settings.METRICS_SAMPLE_RATE > 0
+
+
+def timed(histogram, *label_values):
+    """Decorator recording call durations in ``histogram``, labelled with
+    ``label_values`` followed by the outcome, ``ok`` or ``error``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            outcome = 'error'
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - start,
+                                  *(label_values + (outcome,)))
+        return wrapper
+    return decorator
+
+
+class QueryTimer(object):
+    """Database execute wrapper counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware(object):
+    """Record the latency and database use of a ``METRICS_SAMPLE_RATE``
+    share of the requests, by view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.METRICS_SAMPLE_RATE
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        queries = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        REQUEST_SECONDS.observe(duration, view, request.method)
+        REQUEST_QUERIES.observe(queries.count, view)
+        REQUEST_DB_SECONDS.observe(queries.seconds, view)
+        flush()
+        return response
+
+
+_process = {'pid': None, 'path': None, 'flushed': 0}
+_flush_lock = threading.Lock()
+
+
+def flush(force=False):
+    """Write this process' metrics to ``METRICS_DIR``, at most every
+    ``METRICS_FLUSH_INTERVAL`` seconds.
+
+    Called from the request path, so it never waits for another thread's
+    flush unless forced, and errors writing the file are logged rather
+    than raised.
+    """
+    if not settings.METRICS_DIR:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        now = time.monotonic()
+        if _process['pid'] != os.getpid():
+            # A new process, possibly forked from one that already had a
+            # file.
+            _process.update(pid=os.getpid(), flushed=0, path=os.path.join(
+                settings.METRICS_DIR, 'metrics-{}-{}.json'.format(
+                    os.getpid(), secrets.token_hex(4))))
+        elif not force and \
+                now - _process['flushed'] < settings.METRICS_FLUSH_INTERVAL:
+            return
+        _process['flushed'] = now
+        data = {name: hist.snapshot() for name, hist in REGISTRY.items()}
+        tmp = '{}.{}.tmp'.format(_process['path'], threading.get_ident())
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, _process['path'])
+        except OSError:
+            logger.exception('Could not write metrics to %s',
+                             _process['path'])
+    finally:
+        _flush_lock.release()
+
+
+def collect():
+    """Metrics of every process writing to ``METRICS_DIR``, or of this
+    process only, as ``{name: {label values: series}}``."""
+    collected = {name: {} for name in REGISTRY}
+    if settings.METRICS_DIR:
+        flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(settings.METRICS_DIR,
+                                           'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # being replaced
+    else:
+        snapshots = [{name: hist.snapshot()
+                      for name, hist in REGISTRY.items()}]
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            merged = collected.setdefault(name, {})
+            for labels, values in series:
+                labels = tuple(labels)
+                if labels in merged:
+                    values = [a + b for a, b in zip(merged[labels], values)]
+                merged[labels] = values
+    return collected
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs)
+
+
+def render(collected):
+    """Prometheus text exposition of ``collected`` metrics."""
+    lines = []
+    for name, series in sorted(collected.items()):
+        hist = REGISTRY.get(name)
+        if hist is None:
+            continue
+        lines.append('# HELP {} {}'.format(name, hist.documentation))
+        lines.append('# TYPE {} histogram'.format(name))
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(hist.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _labels(hist.labels, label_values, le=bound),
+                    cumulative))
+            labels = _labels(hist.labels, label_values)
+            lines.append('{}_sum{} {}'.format(name, labels, values[-1]))
+            lines.append('{}_count{} {}'.format(name, labels, cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def _metrics_response():
+    return HttpResponse(render(collect()),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
+
+
+@staff_member_required
+def _staff_metrics(request):
+    return _metrics_response()
+
+
+def metrics(request):
+    """Metrics for staff users, or for scrapers sending ``METRICS_TOKEN``
+    as a bearer token."""
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if token and authorization:
+        if not secrets.compare_digest(authorization,
+                                      'Bearer {}'.format(token)):
+            return HttpResponseForbidden()
+        return _metrics_response()
+    return _staff_metrics(request)
@@ -7,6 +7,8 @@ from reportlab.lib.pagesizes import landscape, A4, A5
 from reportlab.lib.units import cm
 from reportlab.lib.styles import ParagraphStyle
 
+from utils.metrics import PDF_SECONDS, timed
+
 
 STYLES = {
     'pAlignLeft': ParagraphStyle(name="left", alignment=TA_LEFT),
@@ -50,6 +52,7 @@ address_func = draw_address
 footer_func = draw_footer
 
 
+@timed(PDF_SECONDS, 'invoice')
 def draw_pdf(buffer, data):
     """ Draws the invoice """
     canvas = Canvas(buffer, pagesize=A5)
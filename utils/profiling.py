@@ -0,0 +1,224 @@
+"""Profiles of sampled and slow requests.
+
+A ``PROFILE_SAMPLE_RATE`` share of the requests runs under cProfile. With
+``PROFILE_SLOW_THRESHOLD`` set, the other requests are watched by a stack
+sampler, and those taking longer than the threshold are kept as collapsed
+stacks, the input of flame graph tools. Dumps go to ``PROFILE_DIR``, which
+keeps the newest ``PROFILE_KEEP`` of them.
+"""
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from utils.metrics import QueryTimer
+
+
+EXTENSIONS = {'profile': '.prof', 'slow': '.folded'}
+NAME_RE = re.compile(r'^[\w-]+$')
+
+
+def _stack(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{}:{}'.format(code.co_filename, code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class StackSampler(threading.Thread):
+    """Thread recording, every ``interval`` seconds, the stacks of the
+    threads being watched."""
+    daemon = True
+
+    def __init__(self, interval):
+        super().__init__(name='profiling-sampler')
+        self.interval = interval
+        self.watched = {}
+        self.lock = threading.Lock()
+
+    def watch(self, ident):
+        with self.lock:
+            self.watched[ident] = Counter()
+
+    def unwatch(self, ident):
+        """Stop watching a thread, returning its stack counts."""
+        with self.lock:
+            return self.watched.pop(ident)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.watched:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self.watched.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_stack(frame)] += 1
+
+
+_sampler = {'pid': None, 'thread': None}
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """This process' stack sampler, started on first use."""
+    if _sampler['pid'] != os.getpid():
+        with _sampler_lock:
+            if _sampler['pid'] != os.getpid():
+                sampler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+                sampler.start()
+                _sampler.update(pid=os.getpid(), thread=sampler)
+    return _sampler['thread']
+
+
+def save_profile(kind, write, info):
+    """Write a dump with ``write(file)`` and its ``info`` to
+    ``PROFILE_DIR``, dropping the oldest dumps beyond ``PROFILE_KEEP``."""
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    now = timezone.now()
+    name = '{:%Y%m%d-%H%M%S}-{}-{}'.format(
+        now, os.getpid(), secrets.token_hex(3))
+    dump = name + EXTENSIONS[kind]
+    write(os.path.join(directory, dump))
+    info = dict(info, name=name, kind=kind, dump=dump,
+                created=now.isoformat())
+    with open(os.path.join(directory, name + '.json'), 'w') as f:
+        json.dump(info, f)
+
+    infos = sorted(glob.glob(os.path.join(directory, '*.json')),
+                   key=os.path.getmtime, reverse=True)
+    for path in infos[settings.PROFILE_KEEP:]:
+        for path in glob.glob(path[:-len('.json')] + '.*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # removed by another process
+
+
+def list_profiles():
+    """Info of the dumps in ``PROFILE_DIR``, slowest first."""
+    profiles = []
+    for path in glob.glob(os.path.join(settings.PROFILE_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # rotated away or being written
+    return sorted(profiles, key=lambda info: info['duration'], reverse=True)
+
+
+def load_profile(name):
+    """Return the info and the path of the dump ``name``, or ``None``."""
+    if not NAME_RE.match(name):
+        return None
+    try:
+        with open(os.path.join(settings.PROFILE_DIR, name + '.json')) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info, os.path.join(settings.PROFILE_DIR, info['dump'])
+
+
+def profile_report(info, path, limit=40):
+    """Readable summary of a dump: the costliest functions of a cProfile
+    dump, or the hottest frames and stacks of a collapsed stacks dump."""
+    if info['kind'] == 'profile':
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(
+            limit)
+        return out.getvalue()
+
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, count = line.rsplit(' ', 1)
+            stacks[stack] = int(count)
+    total = sum(stacks.values()) or 1
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    lines = ['{} samples'.format(total), '', 'Hottest frames:']
+    lines += ['{:6.1f}%  {}'.format(100 * count / total, frame)
+              for frame, count in leaves.most_common(limit)]
+    lines += ['', 'Hottest stacks:']
+    for stack, count in stacks.most_common(limit // 4):
+        lines.append('{:6.1f}%'.format(100 * count / total))
+        lines += ['    ' + frame for frame in stack.split(';')]
+    return '\n'.join(lines)
+
+
+class ProfilingMiddleware(object):
+    """Profile sampled requests with cProfile and catch slow requests with
+    the stack sampler."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.PROFILE_SAMPLE_RATE
+        threshold = settings.PROFILE_SLOW_THRESHOLD
+        profiler = None
+        if rate > 0 and random.random() < rate:
+            profiler = cProfile.Profile()
+        elif not threshold:
+            return self.get_response(request)
+
+        queries = QueryTimer()
+        ident = threading.get_ident()
+        if profiler is None:
+            get_sampler().watch(ident)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                if profiler is not None:
+                    stack.callback(profiler.disable)
+                    profiler.enable()
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            stacks = get_sampler().unwatch(ident) if profiler is None \
+                else None
+
+        if profiler is not None:
+            kind, write = 'profile', profiler.dump_stats
+        elif threshold and duration >= threshold:
+            def write(path):
+                with open(path, 'w') as f:
+                    for line, count in stacks.items():
+                        f.write('{} {}\n'.format(line, count))
+            kind = 'slow'
+        else:
+            return response
+
+        match = request.resolver_match
+        save_profile(kind, write, {
+            'view': match.view_name if match else '<unresolved>',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration': duration,
+            'queries': queries.count,
+            'query_seconds': queries.seconds,
+        })
+        return response
@@ -0,0 +1,127 @@
+"""Slow and repeated query log.
+
+Queries slower than ``SLOW_QUERY_THRESHOLD`` seconds are logged as they
+finish. Queries are also grouped by shape, their SQL with literals and
+``IN`` lists folded, and shapes run ``SLOW_QUERY_REPEAT`` times or more in
+one request are logged when it finishes: the usual sign of a lazy relation
+loaded once per row. Each record names the project code the query came
+from. Records are JSON lines on the ``slow_queries`` logger.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger('slow_queries')
+
+CURSOR_FILE = os.path.join('django', 'db', 'backends', 'utils.py')
+_state = threading.local()
+
+_IN_LIST_RE = re.compile(r'\bIN \((?:%s, )*%s\)', re.IGNORECASE)
+_NUMBER_RE = re.compile(r'\b\d+\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+def query_shape(sql):
+    """SQL with ``IN`` lists, numbers and strings folded, so queries
+    differing only in their values share a shape."""
+    sql = _STRING_RE.sub('%s', sql)
+    sql = _NUMBER_RE.sub('N', sql)
+    return _IN_LIST_RE.sub('IN (...)', sql)
+
+
+def fingerprint(shape):
+    return hashlib.md5(shape.encode()).hexdigest()[:12]
+
+
+def query_origin():
+    """``file:line qualified.name`` of the innermost project frame in the
+    current stack."""
+    base_dir = settings.BASE_DIR
+    frame = sys._getframe(1)
+    # Skip the execute wrappers, up to Django's cursor.
+    while frame is not None and \
+            not frame.f_code.co_filename.endswith(CURSOR_FILE):
+        frame = frame.f_back
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base_dir) and \
+                'site-packages' not in filename:
+            code = frame.f_code
+            return '{}:{} {}'.format(
+                os.path.relpath(filename, base_dir), frame.f_lineno,
+                getattr(code, 'co_qualname', code.co_name))
+        frame = frame.f_back
+    return None
+
+
+def _log(**record):
+    record.update(time=time.time(), path=getattr(_state, 'path', None))
+    logger.info(json.dumps(record))
+
+
+def log_queries(execute, sql, params, many, context):
+    """Execute wrapper logging slow queries and counting query shapes."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        shape = query_shape(sql)
+        key = fingerprint(shape)
+        origin = None
+        if duration >= settings.SLOW_QUERY_THRESHOLD:
+            origin = query_origin()
+            _log(kind='slow', fingerprint=key, shape=shape, sql=sql,
+                 alias=context['connection'].alias, origin=origin,
+                 count=1, duration=duration)
+        shapes = getattr(_state, 'shapes', None)
+        if shapes is not None:
+            seen = shapes.get(key)
+            if seen is None:
+                seen = shapes[key] = {
+                    'shape': shape, 'sql': sql, 'count': 0, 'duration': 0,
+                    'alias': context['connection'].alias,
+                    'origin': origin or query_origin()}
+            seen['count'] += 1
+            seen['duration'] += duration
+
+
+def install(connection):
+    if log_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_queries)
+
+
+def start_request(path):
+    _state.path = path
+    _state.shapes = {}
+
+
+def finish_request():
+    """Log the query shapes repeated in the request that just finished."""
+    shapes = getattr(_state, 'shapes', None) or {}
+    _state.shapes = None
+    for key, seen in shapes.items():
+        if seen['count'] >= settings.SLOW_QUERY_REPEAT:
+            _log(kind='repeated', fingerprint=key, **seen)
+    _state.path = None
+
+
+def read_log(path, since=None):
+    """Records of the slow query log at ``path``, newer than the
+    ``since`` timestamp if given."""
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a partly written line
+            if since is None or record['time'] >= since:
+                yield record
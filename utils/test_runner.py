@@ -0,0 +1,22 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Test runner serving static files from the plain storage.
+
+    The manifest storage of ``STATICFILES_STORAGE`` only resolves static
+    URLs after ``collectstatic``, so rendering any page would fail on a
+    fresh checkout.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.static_storage = override_settings(
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.'
+                                'StaticFilesStorage')
+        self.static_storage.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.static_storage.disable()
+        super().teardown_test_environment(**kwargs)
@@ -18,7 +18,6 @@ from django.core.wsgi import get_wsgi_application
 # This allows easy placement of apps within the interior
 # vmb directory.
 app_path = os.path.dirname(os.path.abspath(__file__))
-print(app_path)
 sys.path.append(app_path)
 # We defer to a DJANGO_SETTINGS_MODULE already in the environment. This breaks
 # if running multiple sites in the same mod_wsgi process. To fix this, use